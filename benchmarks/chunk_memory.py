@@ -0,0 +1,56 @@
+"""
+Peak memory used to send a large binary result, reported as a multiple of
+the payload size (the payload itself is allocated beforehand and excluded).
+
+    python benchmarks/chunk_memory.py --sizes 256 1024
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import tracemalloc
+
+from common import GenericClient, create_endpoint
+
+MB = 1024 * 1024
+
+
+async def discard(_is_binary, _data):
+    pass
+
+
+async def measure(size):
+    endpoint = create_endpoint()
+    client = GenericClient(endpoint)
+    await client.connect()
+    client.connection.on_message(discard)
+    client_id = client.connection.client_id
+
+    payload = b"x" * size
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    await endpoint.sendWrappedMessage("rpc:bench:0", payload, client_id=client_id)
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+
+    return {
+        "payload_mb": size / MB,
+        "peak_mb": peak / MB,
+        "peak_ratio": peak / size,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[256, 1024], help="payload in MB"
+    )
+    args = parser.parse_args()
+
+    results = [asyncio.run(measure(size * MB)) for size in args.sizes]
+    sys.stdout.write(json.dumps(results, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import contextlib
+import statistics
+
+from aiohttp import web
+
+from wslink import register, testing
+from wslink.backends.aiohttp.relay import WsHandler
+from wslink.backends.generic.core import GenericServer
+from wslink.websocket import LinkProtocol, ServerProtocol
+
+SECRET = "wslink-benchmark"
+
+
+class BenchmarkProtocol(LinkProtocol):
+    @register("bench.echo")
+    def echo(self, value):
+        return value
+
+    @register("bench.payload")
+    def payload(self, size):
+        return b"x" * size
+
+    @register("bench.size")
+    def size(self, data):
+        return len(data)
+
+
+class BenchmarkServerProtocol(ServerProtocol):
+    def initialize(self):
+        self.updateSecret(SECRET)
+        self.bench = BenchmarkProtocol()
+        self.registerLinkProtocol(self.bench)
+
+
+def create_endpoint(protocol=BenchmarkServerProtocol):
+    server = GenericServer({"ws": {"ws": protocol()}})
+    return server["ws"]
+
+
+class GenericClient(testing.Client):
+    """In-process client of a generic backend endpoint, not keeping publishes"""
+
+    def __init__(self, endpoint, delay=0):
+        super().__init__(endpoint, SECRET, delay, keep_publications=False)
+
+
+class AiohttpClient(testing.AiohttpClient):
+    """Client connected through an actual websocket, not keeping publishes"""
+
+    def __init__(self, url, delay=0):
+        super().__init__(url, SECRET, delay, keep_publications=False)
+
+
+def _site_port(runner):
+    return runner.addresses[0][1]
+
+
+@contextlib.asynccontextmanager
+async def relay_server(target_url):
+    """Yield the url of an aiohttp relay forwarding to target_url (forward mode)"""
+    _, _, host_port, path = target_url.split("/", 3)
+    host, port = host_port.split(":")
+    app = web.Application()
+    app.add_routes(
+        [web.get("/proxy/{host}/{port}/{path}", WsHandler().forward_connect)]
+    )
+    runner = web.AppRunner(app, handle_signals=False)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    try:
+        yield f"ws://127.0.0.1:{_site_port(runner)}/proxy/{host}/{port}/{path}"
+    finally:
+        await runner.cleanup()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(len(values) - 1, round(p / 100 * (len(values) - 1)))
+    return values[index]
+
+
+def summarize(latencies):
+    return {
+        "count": len(latencies),
+        "mean_ms": 1000 * statistics.fmean(latencies),
+        "p50_ms": 1000 * percentile(latencies, 50),
+        "p99_ms": 1000 * percentile(latencies, 99),
+    }
@@ -0,0 +1,65 @@
+"""
+Cost of RPCs carrying a large argument, either as a binary field or as a list
+of floats (msgpack encodes each one on 9 bytes), with and without a debug log
+listener attached.
+
+    python benchmarks/large_arguments.py --size 10 --calls 50
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+
+from common import GenericClient, create_endpoint
+
+MB = 1024 * 1024
+
+
+def make_argument(kind, size):
+    if kind == "binary":
+        return b"x" * size
+    return [1.5] * (size // 9)
+
+
+async def measure(kind, size, calls, debug_listener):
+    endpoint = create_endpoint()
+    if debug_listener:
+        endpoint.log_emitter.add_event_listener("debug", lambda _message: None)
+
+    client = GenericClient(endpoint)
+    await client.connect()
+
+    data = make_argument(kind, size)
+    durations = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        await client.call("bench.size", [data])
+        durations.append(time.perf_counter() - start)
+
+    return {
+        "argument": kind,
+        "argument_mb": size / MB,
+        "debug_listener": debug_listener,
+        "mean_ms": 1000 * statistics.fmean(durations),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=10, help="argument in MB")
+    parser.add_argument("--calls", type=int, default=50)
+    args = parser.parse_args()
+
+    results = [
+        asyncio.run(measure(kind, args.size * MB, args.calls, debug_listener))
+        for kind in ("binary", "list")
+        for debug_listener in (False, True)
+    ]
+    sys.stdout.write(json.dumps(results, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Measure RPC reply latency for fast clients while another client connected to
+the same endpoint is throttled and publishes are broadcast to everyone.
+
+    python benchmarks/slow_client.py --clients 4 --delay 0.05
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+
+from common import GenericClient, create_endpoint, summarize
+
+
+async def run(clients, delay, calls, publish_size, publish_period):
+    endpoint = create_endpoint()
+
+    slow = GenericClient(endpoint, delay=delay)
+    await slow.connect()
+    fast_clients = [GenericClient(endpoint) for _ in range(clients)]
+    for client in fast_clients:
+        await client.connect()
+
+    running = True
+
+    async def publisher():
+        while running:
+            endpoint.publish("bench.topic", b"x" * publish_size)
+            await asyncio.sleep(publish_period)
+
+    async def caller(client):
+        latencies = []
+        for i in range(calls):
+            latencies.append(await client.timed_call("bench.echo", [i]))
+        return latencies
+
+    publish_task = asyncio.ensure_future(publisher())
+    results = await asyncio.gather(*[caller(c) for c in fast_clients])
+    running = False
+    await publish_task
+
+    return summarize([latency for latencies in results for latency in latencies])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=4, help="fast clients")
+    parser.add_argument("--delay", type=float, default=0.05, help="slow chunk delay")
+    parser.add_argument("--calls", type=int, default=50, help="RPCs per client")
+    parser.add_argument("--publish-size", type=int, default=64 * 1024)
+    parser.add_argument("--publish-period", type=float, default=0.1)
+    args = parser.parse_args()
+
+    result = asyncio.run(
+        run(
+            args.clients,
+            args.delay,
+            args.calls,
+            args.publish_size,
+            args.publish_period,
+        )
+    )
+    sys.stdout.write(json.dumps(result, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Throughput of small (~100 bytes) RPC messages, in messages per second.
+
+  - chunking: pack + chunk + unchunk of the message, no I/O
+  - rpc: full request/response round trips through a generic backend endpoint
+
+    python benchmarks/small_messages.py --count 20000
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import msgpack
+from common import GenericClient, create_endpoint
+
+from wslink.chunking import UnChunker, generate_chunks
+
+MAX_MSG_SIZE = 512 * 1024
+
+
+SMALL_MESSAGE = {
+    "wslink": "1.0",
+    "id": "rpc:c0:1",
+    "method": "bench.echo",
+    "args": ["x" * 40],
+    "kwargs": {},
+}
+
+
+def measure_chunking(count):
+    unchunker = UnChunker()
+    packed = msgpack.packb(SMALL_MESSAGE)
+
+    start = time.perf_counter()
+    for _ in range(count):
+        for chunk in generate_chunks(packed, MAX_MSG_SIZE):
+            unchunker.process_chunk(chunk)
+    elapsed = time.perf_counter() - start
+
+    return {"message_bytes": len(packed), "msg_per_s": count / elapsed}
+
+
+async def measure_rpc(count):
+    client = GenericClient(create_endpoint())
+    await client.connect()
+
+    start = time.perf_counter()
+    for _ in range(count):
+        await client.call("bench.echo", ["x" * 40])
+    elapsed = time.perf_counter() - start
+
+    return {"msg_per_s": 2 * count / elapsed, "rpc_per_s": count / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=20000)
+    args = parser.parse_args()
+
+    results = {
+        "chunking": measure_chunking(args.count),
+        "rpc": asyncio.run(measure_rpc(args.count)),
+    }
+    sys.stdout.write(json.dumps(results, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""
+Benchmark suite of the transport layer, run against the in-process generic
+backend and an aiohttp server on localhost, with machine readable results:
+
+  - rpc_latency: round trips of an echo RPC carrying a binary payload
+  - publish_fanout: a topic published to many clients at once
+  - chunking: pack + chunk and unchunk + unpack of a message, no I/O
+  - memory: peak memory of a RPC returning a large binary result, server
+    and in-process client included, as a multiple of the payload size
+  - relay: download throughput through the aiohttp relay (forward mode)
+    compared to a direct connection
+
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --quick --baseline results.json
+
+Each result is identified by its benchmark, backend and parameters. With
+--baseline, the metrics are compared to the ones of a previous run and the
+regressions beyond --tolerance are listed (the exit code is then 1): the
+metrics ending in _per_s are better higher, the others better lower.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import datetime
+import functools
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import msgpack
+from common import (
+    AiohttpClient,
+    BenchmarkServerProtocol,
+    GenericClient,
+    create_endpoint,
+    relay_server,
+    summarize,
+)
+
+import wslink
+from wslink.chunking import UnChunker, generate_chunks
+from wslink.testing import aiohttp_server
+
+KB = 1024
+MB = 1024 * KB
+MAX_MSG_SIZE = 4 * MB
+BACKENDS = ("generic", "aiohttp")
+
+# (full, quick) settings
+SETTINGS = {
+    "rpc_sizes": ([100, 10 * KB, MB, 16 * MB], [100, 10 * KB, MB]),
+    "rpc_calls": (200, 30),
+    "fanout_clients": ([1, 10, 50], [1, 10]),
+    "fanout_publishes": (1000, 200),
+    "fanout_size": (10 * KB, 10 * KB),
+    "chunking_sizes": ([KB, MB, 64 * MB], [KB, MB]),
+    "chunking_bytes": (512 * MB, 64 * MB),
+    "memory_sizes": ([16 * MB, 128 * MB], [16 * MB]),
+    "relay_sizes": ([10 * KB, MB, 16 * MB], [10 * KB, MB]),
+    "relay_bytes": (256 * MB, 32 * MB),
+}
+
+
+@contextlib.asynccontextmanager
+async def clients(backend, count=1):
+    """
+    Yield the server protocol and count clients connected to a server of the
+    given backend
+    """
+    protocol = BenchmarkServerProtocol()
+    connected = []
+    async with contextlib.AsyncExitStack() as stack:
+        if backend == "generic":
+            endpoint = create_endpoint(lambda: protocol)
+            new_client = functools.partial(GenericClient, endpoint)
+        else:
+            _, url = await stack.enter_async_context(aiohttp_server(protocol))
+            new_client = functools.partial(AiohttpClient, url)
+
+        for _ in range(count):
+            client = new_client()
+            await client.connect()
+            connected.append(client)
+        try:
+            yield protocol, connected
+        finally:
+            for client in connected:
+                await client.close()
+
+
+def result(benchmark, backend, params, metrics):
+    return {
+        "benchmark": benchmark,
+        "backend": backend,
+        "params": params,
+        "metrics": metrics,
+    }
+
+
+async def rpc_latency(backend, size, calls):
+    async with clients(backend) as (_, (client,)):
+        payload = b"x" * size
+        latencies = [
+            await client.timed_call("bench.echo", [payload]) for _ in range(calls)
+        ]
+
+    metrics = summarize(latencies)
+    metrics["rpc_per_s"] = metrics.pop("count") / sum(latencies)
+    return result("rpc_latency", backend, {"size": size}, metrics)
+
+
+async def publish_fanout(backend, count, publishes, size):
+    async with clients(backend, count) as (protocol, connected):
+        payload = b"x" * size
+        done = [client.wait_publishes(publishes) for client in connected]
+
+        start = time.perf_counter()
+        for _ in range(publishes):
+            protocol.bench.publish("bench.topic", payload)
+        await asyncio.gather(*done)
+        elapsed = time.perf_counter() - start
+
+    deliveries = count * publishes
+    return result(
+        "publish_fanout",
+        backend,
+        {"clients": count, "publishes": publishes, "size": size},
+        {
+            "deliveries_per_s": deliveries / elapsed,
+            "mb_per_s": deliveries * size / MB / elapsed,
+        },
+    )
+
+
+def chunking(size, total):
+    message = {"wslink": "1.0", "id": "rpc:c0:0", "result": b"x" * size}
+    repeat = max(1, total // size)
+    unchunker = UnChunker()
+    unchunker.set_max_message_size(4 * 1024 * MB)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        chunks = list(generate_chunks(msgpack.packb(message), MAX_MSG_SIZE))
+    packed = time.perf_counter()
+    for _ in range(repeat):
+        for chunk in chunks:
+            unchunker.process_chunk(chunk)
+    unpacked = time.perf_counter()
+
+    volume = repeat * size / MB
+    return result(
+        "chunking",
+        "none",
+        {"size": size},
+        {
+            "chunk_mb_per_s": volume / (packed - start),
+            "unchunk_mb_per_s": volume / (unpacked - packed),
+            "chunks": len(chunks),
+        },
+    )
+
+
+async def memory(backend, size):
+    async with clients(backend) as (_, (client,)):
+        tracemalloc.start()
+        try:
+            base = tracemalloc.get_traced_memory()[0]
+            await client.call("bench.payload", [size])
+            peak = tracemalloc.get_traced_memory()[1] - base
+        finally:
+            tracemalloc.stop()
+
+    return result(
+        "memory",
+        backend,
+        {"size": size},
+        {"peak_mb": peak / MB, "peak_ratio": peak / size},
+    )
+
+
+async def relay(size, total):
+    calls = max(1, total // size)
+    metrics = {}
+    async with (
+        aiohttp_server(BenchmarkServerProtocol()) as (_, url),
+        relay_server(url) as relay_url,
+    ):
+        for route, route_url in (("direct", url), ("relay", relay_url)):
+            client = AiohttpClient(route_url)
+            await client.connect()
+            start = time.perf_counter()
+            for _ in range(calls):
+                await client.call("bench.payload", [size])
+            elapsed = time.perf_counter() - start
+            await client.close()
+            metrics[f"{route}_mb_per_s"] = calls * size / MB / elapsed
+
+    metrics["overhead_ratio"] = metrics["direct_mb_per_s"] / metrics["relay_mb_per_s"]
+    return result("relay", "aiohttp", {"size": size}, metrics)
+
+
+async def run(benchmarks, backends, quick):
+    setting = {key: value[quick] for key, value in SETTINGS.items()}
+    results = []
+
+    def report(entry):
+        sys.stderr.write(f"{entry['benchmark']} {entry['backend']} {entry['params']}\n")
+        results.append(entry)
+
+    for backend in backends:
+        if "rpc_latency" in benchmarks:
+            for size in setting["rpc_sizes"]:
+                report(await rpc_latency(backend, size, setting["rpc_calls"]))
+        if "publish_fanout" in benchmarks:
+            for count in setting["fanout_clients"]:
+                report(
+                    await publish_fanout(
+                        backend,
+                        count,
+                        setting["fanout_publishes"],
+                        setting["fanout_size"],
+                    )
+                )
+        if "memory" in benchmarks:
+            for size in setting["memory_sizes"]:
+                report(await memory(backend, size))
+
+    if "chunking" in benchmarks:
+        for size in setting["chunking_sizes"]:
+            report(chunking(size, setting["chunking_bytes"]))
+    if "relay" in benchmarks and "aiohttp" in backends:
+        for size in setting["relay_sizes"]:
+            report(await relay(size, setting["relay_bytes"]))
+
+    return results
+
+
+def environment(quick):
+    return {
+        "wslink": wslink.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "quick": quick,
+    }
+
+
+def _key(entry):
+    return (
+        entry["benchmark"],
+        entry["backend"],
+        json.dumps(entry["params"], sort_keys=True),
+    )
+
+
+def compare(baseline, results, tolerance):
+    """Descriptions of the metrics worse than in baseline by more than tolerance"""
+    previous = {_key(entry): entry["metrics"] for entry in baseline["results"]}
+    regressions = []
+    for entry in results:
+        for name, value in entry["metrics"].items():
+            before = previous.get(_key(entry), {}).get(name)
+            if not before or name == "chunks":
+                continue
+            change = value / before - 1
+            if name.endswith("_per_s"):
+                change = -change
+            if change > tolerance:
+                benchmark, backend, params = _key(entry)
+                regressions.append(
+                    f"{benchmark} {backend} {params} {name}: "
+                    f"{before:.4g} => {value:.4g} ({100 * change:+.1f}% worse)"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--benchmarks",
+        nargs="+",
+        default=["rpc_latency", "publish_fanout", "chunking", "memory", "relay"],
+    )
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=BACKENDS)
+    parser.add_argument("--quick", action="store_true", help="smaller sizes and counts")
+    parser.add_argument("--output", type=Path, help="JSON file of the results")
+    parser.add_argument("--baseline", type=Path, help="JSON file of a previous run")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.benchmarks, args.backends, args.quick))
+    report = {"environment": environment(args.quick), "results": results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text)
+    else:
+        sys.stdout.write(text + "\n")
+
+    if args.baseline:
+        regressions = compare(
+            json.loads(args.baseline.read_text()), results, args.tolerance
+        )
+        for regression in regressions:
+            sys.stderr.write(regression + "\n")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
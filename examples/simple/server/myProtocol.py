@@ -74,6 +74,8 @@ class MyProtocol(LinkProtocol):
 
         self.topic = topic
         self.subscribers += 1
+        # Slow clients only get the latest image instead of a growing backlog
+        self.publishManager.setTopicPolicy(topic, coalesce=True)
         return {"subscribed": topic}
 
     @exportRPC("myprotocol.stop")
@@ -8,6 +8,14 @@ const MESSAGE_OFFSET_LENGTH = UINT32_LENGTH;
 const MESSAGE_SIZE_LOCATION = MESSAGE_OFFSET_LOCATION + MESSAGE_OFFSET_LENGTH;
 const MESSAGE_SIZE_LENGTH = UINT32_LENGTH;
 const HEADER_LENGTH = ID_LENGTH + MESSAGE_OFFSET_LENGTH + MESSAGE_SIZE_LENGTH;
+// Set on the ids of messages compressed with the negotiated codec
+const COMPRESSED_FLAG = 0x80000000;
+async function decompress(content, format) {
+  const stream = new Blob([content])
+    .stream()
+    .pipeThrough(new DecompressionStream(format));
+  return new Uint8Array(await new Response(stream).arrayBuffer());
+}
 function encodeHeader(id, offset, size) {
   const buffer = new ArrayBuffer(HEADER_LENGTH);
   const header = new Uint8Array(buffer);
@@ -18,22 +26,36 @@ function encodeHeader(id, offset, size) {
   return header;
 }
 function decodeHeader(header) {
-  const view = new DataView(header.buffer);
+  const view = new DataView(
+    header.buffer,
+    header.byteOffset,
+    header.byteLength
+  );
   const id = view.getUint32(ID_LOCATION, true);
   const offset = view.getUint32(MESSAGE_OFFSET_LOCATION, true);
   const size = view.getUint32(MESSAGE_SIZE_LOCATION, true);
   return { id, offset, size };
 }
+// Messages sent in a single chunk are never reassembled,
+// their id only has to differ from the ones of the other messages in flight.
+let singleChunkId = 0;
 function* generateChunks(message, maxSize) {
   const totalSize = message.byteLength;
-  let maxContentSize;
-  if (maxSize === 0) {
-    maxContentSize = totalSize;
-  } else {
-    maxContentSize = Math.max(maxSize - HEADER_LENGTH, 1);
+  if (maxSize === 0 || totalSize + HEADER_LENGTH <= maxSize) {
+    const chunk = new Uint8Array(HEADER_LENGTH + totalSize);
+    const view = new DataView(chunk.buffer);
+    view.setUint32(ID_LOCATION, singleChunkId, true);
+    view.setUint32(MESSAGE_OFFSET_LOCATION, 0, true);
+    view.setUint32(MESSAGE_SIZE_LOCATION, totalSize, true);
+    chunk.set(message, HEADER_LENGTH);
+    singleChunkId = (singleChunkId + 1) & 0x7fffffff;
+    yield chunk;
+    return;
   }
+  const maxContentSize = Math.max(maxSize - HEADER_LENGTH, 1);
   const id = new Uint32Array(1);
   crypto.getRandomValues(id);
+  id[0] &= 0x7fffffff;
   let offset = 0;
   while (offset < totalSize) {
     const contentSize = Math.min(maxContentSize, totalSize - offset);
@@ -55,23 +77,31 @@ function* generateChunks(message, maxSize) {
 */
 class UnChunker {
   pendingMessages;
+  decoder;
+  // DecompressionStream format of the negotiated codec
+  compression;
   constructor() {
     this.pendingMessages = {};
+    this.decoder = null;
+    this.compression = null;
   }
   releasePendingMessages() {
     this.pendingMessages = {};
   }
   async processChunk(chunk, decoderFactory) {
-    const headerBlob = chunk.slice(0, HEADER_LENGTH);
-    const contentBlob = chunk.slice(HEADER_LENGTH);
-    const header = new Uint8Array(await headerBlob.arrayBuffer());
+    const buffer = await chunk.arrayBuffer();
+    const header = new Uint8Array(buffer, 0, HEADER_LENGTH);
     const { id, offset, size: totalSize } = decodeHeader(header);
+    const chunkContent = new Uint8Array(buffer, HEADER_LENGTH);
+    if (offset === 0 && chunkContent.byteLength === totalSize) {
+      // Whole message in a single chunk, nothing to reassemble
+      return this.decode(id, chunkContent, decoderFactory);
+    }
     let pendingMessage = this.pendingMessages[id];
     if (!pendingMessage) {
       pendingMessage = {
         receivedSize: 0,
         content: new Uint8Array(totalSize),
-        decoder: decoderFactory(),
       };
       this.pendingMessages[id] = pendingMessage;
     }
@@ -82,18 +112,29 @@ class UnChunker {
         `Total size in chunk header for message ${id} does not match total size declared by previous chunk.`
       );
     }
-    const chunkContent = new Uint8Array(await contentBlob.arrayBuffer());
     const content = pendingMessage.content;
     content.set(chunkContent, offset);
     pendingMessage.receivedSize += chunkContent.byteLength;
     if (pendingMessage.receivedSize >= totalSize) {
       delete this.pendingMessages[id];
-      try {
-        return pendingMessage["decoder"].decode(content);
-      } catch (e) {
-        console.error("Malformed message: ", content.slice(0, 100));
-        // debugger;
-      }
+      return this.decode(id, content, decoderFactory);
+    }
+    return undefined;
+  }
+  // msgpack decoding is synchronous, a single decoder can be shared by all messages
+  async decode(id, content, decoderFactory) {
+    // The flag means nothing until a codec got negotiated
+    if (this.compression && id & COMPRESSED_FLAG) {
+      content = await decompress(content, this.compression);
+    }
+    if (!this.decoder) {
+      this.decoder = decoderFactory();
+    }
+    try {
+      return this.decoder.decode(content);
+    } catch (e) {
+      console.error("Malformed message: ", content.slice(0, 100));
+      // debugger;
     }
     return undefined;
   }
@@ -11,6 +11,16 @@ const MESSAGE_SIZE_LENGTH = UINT32_LENGTH;
 
 const HEADER_LENGTH = ID_LENGTH + MESSAGE_OFFSET_LENGTH + MESSAGE_SIZE_LENGTH;
 
+// Set on the ids of messages compressed with the negotiated codec
+const COMPRESSED_FLAG = 0x80000000;
+
+async function decompress(content: Uint8Array, format: string) {
+  const stream = new Blob([content])
+    .stream()
+    .pipeThrough(new DecompressionStream(format as any));
+  return new Uint8Array(await new Response(stream).arrayBuffer());
+}
+
 function encodeHeader(id: number, offset: number, size: number): Uint8Array {
   const buffer = new ArrayBuffer(HEADER_LENGTH);
   const header = new Uint8Array(buffer);
@@ -23,7 +33,11 @@ function encodeHeader(id: number, offset: number, size: number): Uint8Array {
 }
 
 function decodeHeader(header: Uint8Array) {
-  const view = new DataView(header.buffer);
+  const view = new DataView(
+    header.buffer,
+    header.byteOffset,
+    header.byteLength
+  );
   const id = view.getUint32(ID_LOCATION, true);
   const offset = view.getUint32(MESSAGE_OFFSET_LOCATION, true);
   const size = view.getUint32(MESSAGE_SIZE_LOCATION, true);
@@ -31,18 +45,31 @@ function decodeHeader(header: Uint8Array) {
   return { id, offset, size };
 }
 
+// Messages sent in a single chunk are never reassembled,
+// their id only has to differ from the ones of the other messages in flight.
+let singleChunkId = 0;
+
 function* generateChunks(message: Uint8Array, maxSize: number) {
   const totalSize = message.byteLength;
-  let maxContentSize: number;
 
-  if (maxSize === 0) {
-    maxContentSize = totalSize;
-  } else {
-    maxContentSize = Math.max(maxSize - HEADER_LENGTH, 1);
+  if (maxSize === 0 || totalSize + HEADER_LENGTH <= maxSize) {
+    const chunk = new Uint8Array(HEADER_LENGTH + totalSize);
+    const view = new DataView(chunk.buffer);
+    view.setUint32(ID_LOCATION, singleChunkId, true);
+    view.setUint32(MESSAGE_OFFSET_LOCATION, 0, true);
+    view.setUint32(MESSAGE_SIZE_LOCATION, totalSize, true);
+    chunk.set(message, HEADER_LENGTH);
+    singleChunkId = (singleChunkId + 1) & 0x7fffffff;
+
+    yield chunk;
+    return;
   }
 
+  const maxContentSize = Math.max(maxSize - HEADER_LENGTH, 1);
+
   const id = new Uint32Array(1);
   crypto.getRandomValues(id);
+  id[0] &= 0x7fffffff;
 
   let offset = 0;
 
@@ -64,7 +91,6 @@ function* generateChunks(message: Uint8Array, maxSize: number) {
 type PendingMessage = {
   receivedSize: number;
   content: Uint8Array;
-  decoder: any;
 };
 
 /*
@@ -76,9 +102,14 @@ type PendingMessage = {
 */
 class UnChunker {
   private pendingMessages: { [key: number]: PendingMessage };
+  private decoder: any;
+  // DecompressionStream format of the negotiated codec
+  compression: string | null;
 
   constructor() {
     this.pendingMessages = {};
+    this.decoder = null;
+    this.compression = null;
   }
 
   releasePendingMessages() {
@@ -89,11 +120,15 @@ class UnChunker {
     chunk: Blob,
     decoderFactory: () => any
   ): Promise<unknown | undefined> {
-    const headerBlob = chunk.slice(0, HEADER_LENGTH);
-    const contentBlob = chunk.slice(HEADER_LENGTH);
-
-    const header = new Uint8Array(await headerBlob.arrayBuffer());
+    const buffer = await chunk.arrayBuffer();
+    const header = new Uint8Array(buffer, 0, HEADER_LENGTH);
     const { id, offset, size: totalSize } = decodeHeader(header);
+    const chunkContent = new Uint8Array(buffer, HEADER_LENGTH);
+
+    if (offset === 0 && chunkContent.byteLength === totalSize) {
+      // Whole message in a single chunk, nothing to reassemble
+      return this.decode(id, chunkContent, decoderFactory);
+    }
 
     let pendingMessage = this.pendingMessages[id];
 
@@ -101,7 +136,6 @@ class UnChunker {
       pendingMessage = {
         receivedSize: 0,
         content: new Uint8Array(totalSize),
-        decoder: decoderFactory(),
       };
 
       this.pendingMessages[id] = pendingMessage;
@@ -115,20 +149,38 @@ class UnChunker {
       );
     }
 
-    const chunkContent = new Uint8Array(await contentBlob.arrayBuffer());
     const content = pendingMessage.content;
     content.set(chunkContent, offset);
     pendingMessage.receivedSize += chunkContent.byteLength;
 
     if (pendingMessage.receivedSize >= totalSize) {
       delete this.pendingMessages[id];
+      return this.decode(id, content, decoderFactory);
+    }
 
-      try {
-        return pendingMessage["decoder"].decode(content);
-      } catch (e) {
-        console.error("Malformed message: ", content.slice(0, 100));
-        // debugger;
-      }
+    return undefined;
+  }
+
+  // msgpack decoding is synchronous, a single decoder can be shared by all messages
+  private async decode(
+    id: number,
+    content: Uint8Array,
+    decoderFactory: () => any
+  ) {
+    // The flag means nothing until a codec got negotiated
+    if (this.compression && id & COMPRESSED_FLAG) {
+      content = await decompress(content, this.compression);
+    }
+
+    if (!this.decoder) {
+      this.decoder = decoderFactory();
+    }
+
+    try {
+      return this.decoder.decode(content);
+    } catch (e) {
+      console.error("Malformed message: ", content.slice(0, 100));
+      // debugger;
     }
 
     return undefined;
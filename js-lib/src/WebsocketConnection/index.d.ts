@@ -11,6 +11,22 @@ export interface WebsocketSession {
     args?: any[],
     kwargs?: Record<string, any>
   ): Promise<any>;
+  // Stream data to a method registered with upload=True, resolving with its result.
+  upload(
+    methodName: string,
+    data: Blob | ReadableStream<Uint8Array>,
+    args?: any[],
+    kwargs?: Record<string, any>
+  ): Promise<any>;
+  // Start a profiler in the server, requires its admin secret.
+  startProfile(
+    secret: string,
+    options?: { mode?: "sampling" | "cprofile"; interval?: number }
+  ): Promise<{ format: string }>;
+  // Stop the profiler, resolving with the collapsed stacks or pstats data.
+  stopProfile(
+    secret: string
+  ): Promise<{ format: "collapsed" | "pstats"; data: string | Uint8Array }>;
   // Subscribe to one-way messages from the server.
   subscribe(
     topic: string,
@@ -1,7 +1,89 @@
 // Helper borrowed from paraviewweb/src/Common/Core
 import CompositeClosureHelper from "../CompositeClosureHelper";
-import { UnChunker, generateChunks } from "./chunking";
-import { Encoder, Decoder } from "@msgpack/msgpack";
+import { UnChunker, SequentialTaskQueue, generateChunks } from "./chunking";
+import { Encoder, Decoder, ExtensionCodec } from "@msgpack/msgpack";
+
+// msgpack ext type of NumPy arrays (see wslink/serializer.py)
+const NDARRAY_EXT_TYPE = 1;
+const TYPED_ARRAYS = {
+  "|b1": Uint8Array,
+  "|i1": Int8Array,
+  "|u1": Uint8Array,
+  "<i2": Int16Array,
+  "<u2": Uint16Array,
+  "<i4": Int32Array,
+  "<u4": Uint32Array,
+  "<i8": BigInt64Array,
+  "<u8": BigUint64Array,
+  "<f4": Float32Array,
+  "<f8": Float64Array,
+};
+
+// Arrays become a TypedArray on the received data, with `dtype` and `shape`
+// properties. Unsupported dtypes give a Uint8Array of the raw content.
+function decodeNdArray(data) {
+  const view = new DataView(data.buffer, data.byteOffset, data.byteLength);
+  const dtypeLength = view.getUint8(0);
+  const dtype = String.fromCharCode(...data.subarray(1, 1 + dtypeLength));
+  const ndim = view.getUint8(1 + dtypeLength);
+  const shape = [];
+  let offset = 2 + dtypeLength;
+  for (let i = 0; i < ndim; i++, offset += 4) {
+    shape.push(view.getUint32(offset, true));
+  }
+
+  const TypedArray = TYPED_ARRAYS[dtype] || Uint8Array;
+  let content = data.subarray(offset);
+  if (content.byteOffset % TypedArray.BYTES_PER_ELEMENT) {
+    // typed arrays need aligned memory, copy it
+    content = content.slice();
+  }
+  const array = new TypedArray(
+    content.buffer,
+    content.byteOffset,
+    content.byteLength / TypedArray.BYTES_PER_ELEMENT
+  );
+  array.dtype = dtype;
+  array.shape = shape;
+  return array;
+}
+
+const extensionCodec = new ExtensionCodec();
+extensionCodec.register({
+  type: NDARRAY_EXT_TYPE,
+  // typed arrays keep being sent as binary
+  encode: () => null,
+  decode: decodeNdArray,
+});
+
+// Patch of a delta topic (see wslink/delta.py): ["set", path, value] and
+// ["del", path] operations. The objects and arrays along the modified paths are
+// copied, the values handed to the subscribers before are left as is.
+function applyPatch(value, patch) {
+  const root = [value];
+  const copies = new Set();
+  patch.forEach(([operation, path, newValue]) => {
+    let parent = root;
+    let key = 0;
+    path.forEach((step) => {
+      let child = parent[key];
+      if (!copies.has(child)) {
+        child = Array.isArray(child) ? child.slice() : { ...child };
+        copies.add(child);
+        parent[key] = child;
+      }
+      parent = child;
+      key = step;
+    });
+    if (operation === "del") {
+      if (Array.isArray(parent)) parent.splice(key, 1);
+      else delete parent[key];
+    } else {
+      parent[key] = newValue;
+    }
+  });
+  return root[0];
+}
 
 function defer() {
   const deferred = {};
@@ -18,26 +100,131 @@ function Session(publicAPI, model) {
   const CLIENT_ERROR = -32099;
   let msgCount = 0;
   const inFlightRpc = {};
+  // rpc id => stream of partial results, once the first one is received
+  const inFlightStreams = {};
   // matches 'rpc:client3:21'
   // client may be dot-separated and include '_'
   // number is message count - unique.
   // matches 'publish:dot.separated.topic:42'
   const regexRPC = /^(rpc|publish|system):(\w+(?:\.\w+)*):(?:\d+)$/;
   const subscriptions = {};
+  // topic => { version, value } of the delta topics, where patches apply
+  const topicStates = {};
   let clientID = null;
   let MAX_MSG_SIZE = 512 * 1024;
   const unchunker = new UnChunker();
+  // decompression is asynchronous, keep messages in order of arrival
+  const receiveQueue = new SequentialTaskQueue();
+  // encode() returns a copy of its internal buffer, so one encoder is enough
+  const encoder = new CustomEncoder();
 
   // --------------------------------------------------------------------------
   // Private helpers
   // --------------------------------------------------------------------------
 
+  function createStream(cancel) {
+    const values = [];
+    const waiting = [];
+    let finished = false;
+    let failure = null;
+
+    function settle() {
+      while (waiting.length && (values.length || finished || failure)) {
+        const { resolve, reject } = waiting.shift();
+        if (values.length) {
+          resolve({ value: values.shift(), done: false });
+        } else if (failure) {
+          reject(failure);
+        } else {
+          resolve({ value: undefined, done: true });
+        }
+      }
+    }
+
+    return {
+      push(value) {
+        values.push(value);
+        settle();
+      },
+      end() {
+        finished = true;
+        settle();
+      },
+      fail(error) {
+        failure = error;
+        settle();
+      },
+      cancel,
+      [Symbol.asyncIterator]() {
+        return {
+          next: () =>
+            new Promise((resolve, reject) => {
+              waiting.push({ resolve, reject });
+              settle();
+            }),
+          // leaving a for await loop early stops the server
+          return: () => {
+            if (!finished && !failure) {
+              cancel();
+              finished = true;
+            }
+            return Promise.resolve({ value: undefined, done: true });
+          },
+        };
+      },
+    };
+  }
+
+  function onStreamMessage(payload) {
+    let stream = inFlightStreams[payload.id];
+    if (!stream) {
+      const deferred = inFlightRpc[payload.id];
+      if (!deferred) {
+        console.log("session stream id without matching call, dropped", payload);
+        return;
+      }
+      // the call resolves with an async iterator over the partial results
+      stream = createStream(deferred.promise.cancel);
+      inFlightStreams[payload.id] = stream;
+      delete inFlightRpc[payload.id];
+      deferred.resolve(stream);
+    }
+    if (payload.stream === "end") {
+      delete inFlightStreams[payload.id];
+      stream.end();
+    } else {
+      stream.push(payload.result);
+    }
+  }
+
+  function onTopicState(topic, payload) {
+    const state = topicStates[topic];
+    if (payload.patch === undefined) {
+      topicStates[topic] = { version: payload.version, value: payload.result };
+    } else if (state && state.version === payload.base) {
+      state.version = payload.version;
+      state.value = applyPatch(state.value, payload.patch);
+    } else {
+      // a patch went missing, ask once for the whole value
+      if (!state || !state.resync) {
+        topicStates[topic] = { version: null, value: null, resync: true };
+        systemCall("wslink.resync", [topic]).catch(() => {});
+      }
+      return false;
+    }
+    return true;
+  }
+
   function onCompleteMessage(payload) {
     if (!payload) return;
     if (!payload.id) return;
     if (payload.error) {
       const deferred = inFlightRpc[payload.id];
-      if (deferred) {
+      const stream = inFlightStreams[payload.id];
+      if (stream) {
+        delete inFlightStreams[payload.id];
+        stream.fail(payload.error);
+      } else if (deferred) {
         deferred.reject(payload.error);
       } else {
         console.error("Server error:", payload.error);
@@ -47,6 +234,10 @@ function Session(publicAPI, model) {
       if (match) {
         const type = match[1];
         if (type === "rpc") {
+          if (payload.stream) {
+            onStreamMessage(payload);
+            return;
+          }
           const deferred = inFlightRpc[payload.id];
           if (!deferred) {
             console.log(
@@ -66,17 +257,25 @@ function Session(publicAPI, model) {
           if (!subscriptions[topic]) {
             return;
           }
+          if (payload.version !== undefined && !onTopicState(topic, payload)) {
+            return;
+          }
+          const result =
+            payload.version === undefined
+              ? payload.result
+              : topicStates[topic].value;
           // for each callback, provide the message data. Wrap in an array, for back-compatibility with WAMP
-          subscriptions[topic].forEach((callback) =>
-            callback([payload.result])
-          );
+          subscriptions[topic].forEach((callback) => callback([result]));
         } else if (type == "system") {
           // console.log('DBG system:', payload.id, payload.result);
           const deferred = inFlightRpc[payload.id];
           if (payload.id === "system:c0:0") {
             clientID = payload.result.clientID;
             MAX_MSG_SIZE = payload.result.maxMsgSize || MAX_MSG_SIZE;
+            unchunker.compression = payload.result.compression || null;
             if (deferred) deferred.resolve(clientID);
+          } else if (deferred) {
+            deferred.resolve(payload.result);
           } else {
             console.error("Unknown system message", payload.id);
             if (deferred)
@@ -93,6 +292,87 @@ function Session(publicAPI, model) {
     delete inFlightRpc[payload.id];
   }
 
+  function sendMessage(wrapper) {
+    const packedWrapper = encoder.encode(wrapper);
+
+    for (let chunk of generateChunks(packedWrapper, MAX_MSG_SIZE)) {
+      model.ws.send(chunk, { binary: true });
+    }
+  }
+
+  function sendCall(method, args, kwargs, extra = {}) {
+    // create a promise that we will use to notify the caller of the result.
+    const deferred = defer();
+    // readyState OPEN === 1
+    if (model.ws && clientID && model.ws.readyState === 1) {
+      const id = `rpc:${clientID}:${msgCount++}`;
+      inFlightRpc[id] = deferred;
+
+      sendMessage({ wslink: "1.0", id, method, args, kwargs, ...extra });
+
+      // Ask the server to stop working on it, the promise then gets rejected
+      deferred.promise.cancel = () => {
+        if (inFlightRpc[id] || inFlightStreams[id]) {
+          systemCall("wslink.cancel", [id]).catch(() => {});
+        }
+      };
+      return { id, promise: deferred.promise };
+    }
+
+    deferred.reject({
+      code: CLIENT_ERROR,
+      message: `RPC call ${method} unsuccessful: connection not open`,
+    });
+    return { id: null, promise: deferred.promise };
+  }
+
+  function bufferedBelow(limit) {
+    return new Promise(function poll(resolve) {
+      if (model.ws.readyState !== 1 || model.ws.bufferedAmount <= limit) {
+        resolve();
+      } else {
+        setTimeout(() => poll(resolve), 10);
+      }
+    });
+  }
+
+  async function sendUpload(id, data) {
+    // pieces small enough to go out as a single chunk
+    const pieceSize = Math.max(MAX_MSG_SIZE - 1024, 1024);
+    const reader = (data instanceof Blob ? data.stream() : data).getReader();
+    try {
+      for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        const bytes = ArrayBuffer.isView(value)
+          ? new Uint8Array(value.buffer, value.byteOffset, value.byteLength)
+          : new Uint8Array(value);
+        for (let offset = 0; offset < bytes.byteLength; offset += pieceSize) {
+          // only read what the socket manages to send
+          await bufferedBelow(4 * pieceSize);
+          if (!inFlightRpc[id] || model.ws.readyState !== 1) {
+            // the call is over, the server drops the rest anyway
+            await reader.cancel();
+            return;
+          }
+          const piece = bytes.subarray(offset, offset + pieceSize);
+          sendMessage({ wslink: "1.0", id, upload: "data", data: piece });
+        }
+      }
+      sendMessage({ wslink: "1.0", id, upload: "end" });
+    } finally {
+      reader.releaseLock();
+    }
+  }
+
+  function systemCall(method, args = []) {
+    const deferred = defer();
+    const id = `system:${clientID}:${msgCount++}`;
+    inFlightRpc[id] = deferred;
+    sendMessage({ wslink: "1.0", id, method, args, kwargs: {} });
+    return deferred.promise;
+  }
+
   // --------------------------------------------------------------------------
   // Public API
   // --------------------------------------------------------------------------
@@ -103,62 +383,86 @@ function Session(publicAPI, model) {
     const id = "system:c0:0";
     inFlightRpc[id] = deferred;
 
-    const wrapper = {
+    // subscriptions: let the server only send the topics we subscribe to
+    // streams: results of async generators come as an async iterator
+    // compression: codecs the server can use for the messages it sends
+    // patches: delta topics only send what changed
+    const compression =
+      typeof DecompressionStream === "undefined" ? [] : ["deflate"];
+    sendMessage({
       wslink: "1.0",
       id,
       method: "wslink.hello",
-      args: [{ secret: model.secret }],
+      args: [
+        {
+          secret: model.secret,
+          subscriptions: true,
+          streams: true,
+          compression,
+          patches: true,
+        },
+      ],
       kwargs: {},
-    };
-
-    const encoder = new CustomEncoder();
-    const packedWrapper = encoder.encode(wrapper);
-
-    for (let chunk of generateChunks(packedWrapper, MAX_MSG_SIZE)) {
-      model.ws.send(chunk, { binary: true });
-    }
+    });
 
     return deferred.promise;
   };
 
   // --------------------------------------------------------------------------
 
-  publicAPI.call = (method, args = [], kwargs = {}) => {
-    // create a promise that we will use to notify the caller of the result.
-    const deferred = defer();
-    // readyState OPEN === 1
-    if (model.ws && clientID && model.ws.readyState === 1) {
-      const id = `rpc:${clientID}:${msgCount++}`;
-      inFlightRpc[id] = deferred;
+  publicAPI.call = (method, args = [], kwargs = {}) =>
+    sendCall(method, args, kwargs).promise;
 
-      const wrapper = { wslink: "1.0", id, method, args, kwargs };
-
-      const encoder = new CustomEncoder();
-      const packedWrapper = encoder.encode(wrapper);
+  // --------------------------------------------------------------------------
 
-      for (let chunk of generateChunks(packedWrapper, MAX_MSG_SIZE)) {
-        model.ws.send(chunk, { binary: true });
-      }
-    } else {
-      deferred.reject({
-        code: CLIENT_ERROR,
-        message: `RPC call ${method} unsuccessful: connection not open`,
+  publicAPI.upload = (method, data, args = [], kwargs = {}) => {
+    // data (a Blob or a ReadableStream of bytes) is sent while the server
+    // method consumes it, the promise resolves with the method result
+    const { id, promise } = sendCall(method, args, kwargs, { upload: "start" });
+    if (id) {
+      sendUpload(id, data).catch((error) => {
+        const deferred = inFlightRpc[id];
+        promise.cancel();
+        if (deferred) {
+          delete inFlightRpc[id];
+          deferred.reject({
+            code: CLIENT_ERROR,
+            message: `Upload ${method} unsuccessful: ${error}`,
+          });
+        }
       });
     }
-    return deferred.promise;
+    return promise;
   };
 
   // --------------------------------------------------------------------------
 
+  publicAPI.startProfile = (secret, options = {}) =>
+    // options: { mode: "sampling" | "cprofile", interval (seconds) }
+    systemCall("wslink.profile.start", [{ ...options, secret }]);
+
+  publicAPI.stopProfile = (secret) =>
+    // resolves with { format: "collapsed" | "pstats", data }
+    systemCall("wslink.profile.stop", [{ secret }]);
+
+  // --------------------------------------------------------------------------
+
   publicAPI.subscribe = (topic, callback) => {
     const deferred = defer();
     if (model.ws && clientID) {
       // we needs to track subscriptions, to trigger callback when publish is received.
-      if (!subscriptions[topic]) subscriptions[topic] = [];
+      if (!subscriptions[topic]) {
+        subscriptions[topic] = [];
+        // let the server know it can start sending that topic.
+        // Older servers don't know about it but send every topic anyway.
+        systemCall("wslink.subscribe", [topic]).then(
+          () => deferred.resolve({ topic, callback }),
+          () => deferred.resolve({ topic, callback })
+        );
+      } else {
+        deferred.resolve({ topic, callback });
+      }
       subscriptions[topic].push(callback);
-      // we can notify the server, but we don't need to, if the server always sends messages unconditionally.
-      // model.ws.send(JSON.stringify({ wslink: '1.0', id: `subscribe:${msgCount++}`, method, args: [] }));
-      deferred.resolve({ topic, callback });
     } else {
       deferred.reject({
         code: CLIENT_ERROR,
@@ -188,6 +492,13 @@ function Session(publicAPI, model) {
     const index = subscriptions[topic].indexOf(callback);
     if (index !== -1) {
       subscriptions[topic].splice(index, 1);
+      if (subscriptions[topic].length === 0) {
+        delete subscriptions[topic];
+        delete topicStates[topic];
+        if (model.ws && clientID && model.ws.readyState === 1) {
+          systemCall("wslink.unsubscribe", [topic]).catch(() => {});
+        }
+      }
       deferred.resolve();
     } else {
       deferred.reject({
@@ -212,16 +523,19 @@ function Session(publicAPI, model) {
   // --------------------------------------------------------------------------
 
   function createDecoder() {
-    return new Decoder();
+    return new Decoder(extensionCodec);
   }
 
-  publicAPI.onmessage = async (event) => {
-    const message = await unchunker.processChunk(event.data, createDecoder);
+  async function receiveChunk(chunk) {
+    const message = await unchunker.processChunk(chunk, createDecoder);
 
     if (message) {
       onCompleteMessage(message);
     }
-  };
+  }
+
+  publicAPI.onmessage = (event) =>
+    receiveQueue.enqueue(receiveChunk, event.data);
 
   // --------------------------------------------------------------------------
 
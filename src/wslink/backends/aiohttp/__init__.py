@@ -10,13 +10,19 @@ from pathlib import Path
 import aiohttp
 import aiohttp.web as aiohttp_web
 
+from wslink.metrics import registry as metrics_registry
 from wslink.protocol import AbstractWebApp, WslinkHandler
 
 # 4MB is the default inside aiohttp
 MSG_OVERHEAD = int(os.environ.get("WSLINK_MSG_OVERHEAD", "4096"))
 MAX_MSG_SIZE = int(os.environ.get("WSLINK_MAX_MSG_SIZE", "4194304"))
 HEART_BEAT = int(os.environ.get("WSLINK_HEART_BEAT", "30"))  # 30 seconds
+# permessage-deflate, turned off for the connections negotiating
+# WSLINK_COMPRESSION
+WS_COMPRESS = bool(int(os.environ.get("WSLINK_WS_COMPRESS", "1")))
 HTTP_HEADERS = os.environ.get("WSLINK_HTTP_HEADERS")  # path to json file
+# Route serving the metrics when enabled (WSLINK_METRICS=1)
+METRICS_ROUTE = os.environ.get("WSLINK_METRICS_ROUTE", "/metrics")
 
 if HTTP_HEADERS and Path(HTTP_HEADERS).exists():
     HTTP_HEADERS = json.loads(Path(HTTP_HEADERS).read_text())
@@ -27,14 +33,16 @@ logger = logging.getLogger(__name__)
 
 
 def reload_settings():
-    global MSG_OVERHEAD, MAX_MSG_SIZE, HEART_BEAT, HTTP_HEADERS  # noqa:PLW0603
+    global MSG_OVERHEAD, MAX_MSG_SIZE, HEART_BEAT, WS_COMPRESS, HTTP_HEADERS, METRICS_ROUTE  # noqa:PLW0603
 
     MSG_OVERHEAD = int(os.environ.get("WSLINK_MSG_OVERHEAD", MSG_OVERHEAD))
     MAX_MSG_SIZE = int(os.environ.get("WSLINK_MAX_MSG_SIZE", MAX_MSG_SIZE))
     HEART_BEAT = int(
         os.environ.get("WSLINK_HEART_BEAT", HEART_BEAT or 30)
     )  # 30 seconds
+    WS_COMPRESS = bool(int(os.environ.get("WSLINK_WS_COMPRESS", int(WS_COMPRESS))))
     HTTP_HEADERS = os.environ.get("WSLINK_HTTP_HEADERS", HTTP_HEADERS)
+    METRICS_ROUTE = os.environ.get("WSLINK_METRICS_ROUTE", METRICS_ROUTE)
 
     # Allow to skip heart beat
     if HEART_BEAT < 1:
@@ -52,6 +60,13 @@ async def _root_handler(request):
     return aiohttp.web.HTTPFound("index.html")
 
 
+async def _metrics_handler(_request):
+    return aiohttp_web.Response(
+        text=metrics_registry.render(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
 def _fix_path(path):
     if not path.startswith("/"):
         return f"/{path}"
@@ -90,6 +105,11 @@ class WebAppServer(AbstractWebApp):
                     aiohttp_web.get(_fix_path(route), protocol_handler.handleWsRequest)
                 )
 
+            if METRICS_ROUTE and any(h.metrics is not None for h in self._ws_handlers):
+                routes.append(
+                    aiohttp_web.get(_fix_path(METRICS_ROUTE), _metrics_handler)
+                )
+
             self.app.add_routes(routes)
 
         if "static" in server_config:
@@ -165,11 +185,16 @@ class WebAppServer(AbstractWebApp):
 
         logger.info("Schedule auto shutdown with timeout %s", self.timeout)
         self.shutdown_schedule()
+        self.watchdog_start(
+            [h.getServerProtocol().log_emitter for h in self._ws_handlers]
+        )
 
         logger.info("awaiting running future")
         await self.completion
 
     async def stop(self):
+        self.watchdog_stop()
+
         # Disconnecting any connected clients of handler(s)
         for handler in self._ws_handlers:
             await handler.disconnectClients()
@@ -198,12 +223,15 @@ class ReverseWebAppServer(AbstractWebApp):
         if port_callback is not None:
             port_callback(0)
 
+        self.watchdog_start([self._server_protocol.log_emitter])
         await self._ws_handler.reverse_connect_to(self._url)
 
     async def stop(self):
+        self.watchdog_stop()
         client_id = self._ws_handler.reverse_connection_client_id
         ws = self._ws_handler.connections[client_id]
         await ws.close()
+        self._ws_handler.shutdown()
 
 
 def create_webserver(server_config):
@@ -238,12 +266,30 @@ class AioHttpWsHandler(WslinkHandler):
                 code=aiohttp.WSCloseCode.GOING_AWAY, message="Server shutdown"
             )
 
-        self.publishManager.unregisterProtocol(self)
+        self.shutdown()
+
+    def disableTransportCompression(self, client_id):
+        # permessage-deflate is negotiated during the handshake, before hello,
+        # and aiohttp has no public API to stop compressing afterwards: the
+        # writer attribute used here was checked against aiohttp 3.9 to 3.14
+        writer = getattr(self.connections.get(client_id), "_writer", None)
+        if writer is None or not hasattr(writer, "compress"):
+            logger.warning(
+                "Cannot turn off permessage-deflate of client %s with aiohttp %s, "
+                "set WSLINK_WS_COMPRESS=0 along with WSLINK_COMPRESSION to avoid "
+                "compressing its messages twice",
+                client_id,
+                aiohttp.__version__,
+            )
+            return
+        writer.compress = 0
 
     async def handleWsRequest(self, request):
         client_id = str(uuid.uuid4()).replace("-", "")
         current_ws = aiohttp_web.WebSocketResponse(
-            max_msg_size=MSG_OVERHEAD + MAX_MSG_SIZE, heartbeat=HEART_BEAT
+            max_msg_size=MSG_OVERHEAD + MAX_MSG_SIZE,
+            heartbeat=HEART_BEAT,
+            compress=WS_COMPRESS,
         )
         self.connections[client_id] = current_ws
 
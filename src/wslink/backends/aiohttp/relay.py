@@ -10,6 +10,7 @@ from aiohttp import web
 # 4MB is the default inside aiohttp
 # -----------------------------------------------------------------------------
 
+MSG_OVERHEAD = int(os.environ.get("WSLINK_MSG_OVERHEAD", "4096"))
 MAX_MSG_SIZE = int(os.environ.get("WSLINK_MAX_MSG_SIZE", "4194304"))
 HEART_BEAT = int(os.environ.get("WSLINK_HEART_BEAT", "30"))  # 30 seconds
 
@@ -46,7 +47,9 @@ class WsClientConnection:
                 logger.debug("client::connect::session")
                 self._session = session
                 try:
-                    async with session.ws_connect(self._url) as ws:
+                    async with session.ws_connect(
+                        self._url, max_msg_size=MSG_OVERHEAD + MAX_MSG_SIZE
+                    ) as ws:
                         logger.debug("client::connect::ws")
                         self._ws = ws
                         self._connected += 1
@@ -72,7 +75,8 @@ class WsClientConnection:
                         self._ws = None
                         self._session = None
                 finally:
-                    self._ready.set_result(False)
+                    if not self._ready.done():
+                        self._ready.set_result(False)
 
         logger.debug("client::connect::exit")
 
@@ -124,7 +128,7 @@ class WsServerConnection:
     async def connect(self, request):
         logger.debug("server::connect")
         self._ws = web.WebSocketResponse(
-            max_msg_size=MAX_MSG_SIZE, heartbeat=HEART_BEAT
+            max_msg_size=MSG_OVERHEAD + MAX_MSG_SIZE, heartbeat=HEART_BEAT
         )
         await self._ws.prepare(request)
         logger.debug("server::connect::prepare")
@@ -147,11 +151,13 @@ class WsServerConnection:
         self.disconnect()
 
         # Cleanup connection
-        if not self._ws.closed:
-            await self._ws.close()
+        ws = self._ws
+        if not ws.closed:
+            await ws.close()
         self._ws = None
 
         logger.debug("server::connect::exit")
+        return ws
 
     async def send(self, msg):
         if self._connected > 0 and not self._ws.closed:
@@ -201,7 +207,7 @@ class ForwardConnection:
         task = asyncio.create_task(self._ws_client.connect(self._url))
         task.add_done_callback(lambda *_: self._ws_server.disconnect())
         await self._ws_client.ready
-        await self._ws_server.connect(self._req)
+        return await self._ws_server.connect(self._req)
 
     def disconnect(self):
         self._ws_client.disconnect()
@@ -294,8 +300,9 @@ class WsHandler:
 
         forwarder = ForwardConnection(request, target_url)
         self._forward_map[target_url] = forwarder
-        await forwarder.connect()
+        ws = await forwarder.connect()
         self._forward_map.pop(target_url)
+        return ws
 
     # -----------------------------
     # relay server infrastructure
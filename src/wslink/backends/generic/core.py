@@ -70,7 +70,9 @@ class WsEndpoint(WslinkHandler):
             client_or_id if isinstance(client_or_id, str) else client_or_id.client_id
         )
         if client_or_id in self.connections:
+            await self.onClose(client_or_id)
             client = self.connections.pop(client_or_id)
+            self.authentified_client_ids.discard(client_or_id)
             await client.on_close(client_or_id)
 
 
@@ -116,10 +118,16 @@ class GenericServer(AbstractWebApp):
         if port_callback is not None:
             port_callback(self.get_port())
 
+        self.watchdog_start(
+            [ws.getServerProtocol().log_emitter for ws in self._websockets.values()]
+        )
         self._stop_event.clear()
         await self._stop_event.wait()
 
     async def stop(self):
+        self.watchdog_stop()
+        for ws in self._websockets.values():
+            ws.shutdown()
         self._stop_event.set()
 
 
@@ -1,10 +1,15 @@
 import contextlib
+import itertools
 import os
-import secrets
+import struct
+import time
 from typing import TypedDict  # pylint: disable=no-name-in-module
 
 import msgpack
 
+from wslink.compression import COMPRESSED_FLAG
+from wslink.serializer import Serializer
+
 UINT32_LENGTH = 4
 ID_LOCATION = 0
 ID_LENGTH = UINT32_LENGTH
@@ -14,50 +19,122 @@ MESSAGE_SIZE_LOCATION = MESSAGE_OFFSET_LOCATION + MESSAGE_OFFSET_LENGTH
 MESSAGE_SIZE_LENGTH = UINT32_LENGTH
 
 HEADER_LENGTH = ID_LENGTH + MESSAGE_OFFSET_LENGTH + MESSAGE_SIZE_LENGTH
+HEADER = struct.Struct("<III")
+
+# Ids of the messages sent, drawn from a single counter so a message never
+# reuses the id of another one still in flight (until 2**31 messages later).
+# The highest bit is left for COMPRESSED_FLAG.
+_chunk_ids = itertools.count()
+
+
+def _next_id():
+    return next(_chunk_ids) & 0x7FFFFFFF
 
 
 def _encode_header(id: int, offset: int, size: int) -> bytes:
-    return (
-        id.to_bytes(ID_LENGTH, "little", signed=False)
-        + offset.to_bytes(MESSAGE_OFFSET_LENGTH, "little", signed=False)
-        + size.to_bytes(MESSAGE_SIZE_LENGTH, "little", signed=False)
-    )
+    return HEADER.pack(id, offset, size)
 
 
 def _decode_header(header: bytes) -> tuple[int, int, int]:
-    id = int.from_bytes(
-        header[ID_LOCATION:ID_LENGTH],
-        "little",
-        signed=False,
-    )
-    offset = int.from_bytes(
-        header[
-            MESSAGE_OFFSET_LOCATION : MESSAGE_OFFSET_LOCATION + MESSAGE_OFFSET_LENGTH
-        ],
-        "little",
-        signed=False,
-    )
-    size = int.from_bytes(
-        header[MESSAGE_SIZE_LOCATION : MESSAGE_SIZE_LOCATION + MESSAGE_SIZE_LENGTH],
-        "little",
-        signed=False,
-    )
-    return id, offset, size
-
-
-def generate_chunks(message: bytes, max_size: int):
-    total_size = len(message)
-    max_content_size = total_size if max_size == 0 else max(max_size - HEADER_LENGTH, 1)
-    id = int.from_bytes(secrets.token_bytes(ID_LENGTH), "little", signed=False)
+    return HEADER.unpack_from(header)
+
+
+def _split_segments(segments, size):
+    """
+    Yield the content of a message made of several buffers in pieces of the
+    given size, a piece spanning several buffers being a tuple of views.
+    """
+    parts = []
+    missing = size
+    for segment in segments:
+        view = memoryview(segment)
+        while view:
+            parts.append(view[:missing])
+            missing -= len(parts[-1])
+            view = view[len(parts[-1]) :]
+            if not missing:
+                yield parts[0] if len(parts) == 1 else tuple(parts)
+                parts = []
+                missing = size
+    if parts:
+        yield parts[0] if len(parts) == 1 else tuple(parts)
+
+
+def generate_chunk_views(message, max_size: int, compressed=False):
+    """
+    Yield (header, content) pairs where content is a memoryview into message,
+    so nothing gets copied until the chunk is actually written.
+
+    message can also be a list of buffers to put end to end (see
+    Serializer.pack()), the content of a chunk spanning several of them is
+    then a tuple of memoryviews.
+
+    compressed flags the chunk ids of a message compressed with the codec
+    negotiated for the connection.
+    """
+    flag = COMPRESSED_FLAG if compressed else 0
+    if isinstance(message, list):
+        segments = [segment for segment in message if len(segment)]
+        if len(segments) == 1:
+            message = segments[0]
+    else:
+        segments = None
+    total_size = len(message) if segments is None else sum(map(len, segments))
+
+    if max_size == 0 or total_size + HEADER_LENGTH <= max_size:
+        id = _next_id() | flag
+        content = (
+            memoryview(message)
+            if segments is None
+            else tuple(map(memoryview, segments))
+        )
+        yield HEADER.pack(id, 0, total_size), content
+        return
+
+    max_content_size = max(max_size - HEADER_LENGTH, 1)
+    id = _next_id() | flag
+    if segments is None:
+        view = memoryview(message)
+        contents = (
+            view[offset : offset + max_content_size]
+            for offset in range(0, total_size, max_content_size)
+        )
+    else:
+        contents = _split_segments(segments, max_content_size)
+
     offset = 0
+    for content in contents:
+        yield _encode_header(id, offset, total_size), content
+        offset += max_content_size
 
-    while offset < total_size:
-        header = _encode_header(id, offset, total_size)
-        chunk_content = message[offset : offset + max_content_size]
 
-        yield header + chunk_content
+def join_chunk(header, content):
+    """Bytes of a chunk out of a (header, content) pair"""
+    if isinstance(content, tuple):
+        return b"".join((header, *content))
+    return header + content
 
-        offset += max_content_size
+
+def generate_chunks(message, max_size: int):
+    if not isinstance(message, list) and (
+        max_size == 0 or len(message) + HEADER_LENGTH <= max_size
+    ):
+        id = _next_id()
+        yield HEADER.pack(id, 0, len(message)) + message
+        return
+
+    for header, chunk_content in generate_chunk_views(message, max_size):
+        yield join_chunk(header, chunk_content)
+
+
+def _check_message_size(id, total_size, max_size):
+    if total_size > max_size:
+        msg = (
+            f"Total size for message {id} exceeds the allocation limit allowed.\n"
+            f"Maximum size = {max_size},\n"
+            f"Received size = {total_size}."
+        )
+        raise ValueError(msg)
 
 
 class PendingMessage(TypedDict):
@@ -70,13 +147,32 @@ class PendingMessage(TypedDict):
 # it will allocate the memory blindly even without actually receiving the content
 # Chunks for a given message can come in any order
 # Chunks across messages can be interleaved.
+#
+# With binary_views, bin fields are handed back as memoryviews into the
+# reassembly buffer instead of bytes copies (see Serializer.unpack()).
 class UnChunker:
     pending_messages: dict[bytes, PendingMessage]
     max_message_size: int
 
-    def __init__(self):
+    def __init__(self, binary_views=False, serializer=None):
         self.pending_messages = {}
         self.max_message_size = int(os.environ.get("WSLINK_AUTH_MSG_SIZE", "512"))
+        self.serializer = serializer or Serializer()
+        self.binary_views = binary_views
+        # Codec negotiated in hello, only set on the client side: the server
+        # compresses what it sends, never what it receives
+        self.compression = None
+
+    def unpack(self, buffer):
+        return self.serializer.unpack(buffer, self.binary_views)
+
+    def decode(self, id, buffer):
+        # The flag means nothing until a codec got negotiated, older clients
+        # use the whole id range
+        if self.compression is not None and id & COMPRESSED_FLAG:
+            decompressor = self.compression.decompressor(self.max_message_size)
+            buffer = decompressor.decompress(buffer)
+        return self.unpack(buffer)
 
     def set_max_message_size(self, size):
         self.max_message_size = size
@@ -85,19 +181,18 @@ class UnChunker:
         self.pending_messages = {}
 
     def process_chunk(self, chunk: bytes) -> bytes | None:
-        header, chunk_content = chunk[:HEADER_LENGTH], chunk[HEADER_LENGTH:]
-        id, offset, total_size = _decode_header(header)
+        id, offset, total_size = _decode_header(chunk)
+        chunk_content = memoryview(chunk)[HEADER_LENGTH:]
+
+        if offset == 0 and len(chunk_content) == total_size:
+            # Whole message in a single chunk, nothing to reassemble
+            _check_message_size(id, total_size, self.max_message_size)
+            return self.decode(id, chunk_content)
 
         pending_message = self.pending_messages.get(id)
 
         if pending_message is None:
-            if total_size > self.max_message_size:
-                msg = (
-                    f"Total size for message {id} exceeds the allocation limit allowed.\n"
-                    f"Maximum size = {self.max_message_size},\n"
-                    f"Received size = {total_size}."
-                )
-                raise ValueError(msg)
+            _check_message_size(id, total_size, self.max_message_size)
 
             pending_message = PendingMessage(
                 received_size=0, content=bytearray(total_size)
@@ -118,7 +213,8 @@ class UnChunker:
         if pending_message["received_size"] >= total_size:
             full_message = pending_message["content"]
             del self.pending_messages[id]
-            return msgpack.unpackb(bytes(full_message))
+            # Decode in place, the buffer is not referenced anywhere else
+            return self.decode(id, full_message)
 
         return None
 
@@ -127,6 +223,8 @@ class StreamPendingMessage(TypedDict):
     received_size: int
     total_size: int
     unpacker: msgpack.Unpacker
+    decompressor: object | None
+    last_activity: float
 
 
 # This un-chunker is more memory efficient
@@ -134,56 +232,158 @@ class StreamPendingMessage(TypedDict):
 # and it will only allocate memory when it receives content.
 # Chunks for a given message are expected to come sequentially
 # Chunks across messages can be interleaved.
+#
+# To bound what a misbehaving client can make the server hold, it can enforce
+#   - max_pending_bytes: bytes received for messages not complete yet
+#   - max_pending_messages: messages being received concurrently
+#   - pending_timeout: seconds after which a partial message not receiving
+#     any chunk is discarded by expire()
+# (0 meaning unlimited) on top of the maximum message size.
+#
+# There is no reassembly buffer here, binary_views only applies to messages
+# received in a single chunk.
 class StreamUnChunker:
     pending_messages: dict[bytes, StreamPendingMessage]
+    max_message_size: int
 
-    def __init__(self):
+    def __init__(
+        self,
+        binary_views=False,
+        max_pending_bytes=0,
+        max_pending_messages=0,
+        pending_timeout=0,
+        serializer=None,
+    ):
         self.pending_messages = {}
+        self.pending_bytes = 0
+        self.max_message_size = int(os.environ.get("WSLINK_AUTH_MSG_SIZE", "512"))
+        self.max_pending_bytes = max_pending_bytes
+        self.max_pending_messages = max_pending_messages
+        self.pending_timeout = pending_timeout
+        self.serializer = serializer or Serializer()
+        self.binary_views = binary_views
+        # Codec negotiated in hello, client side only (see UnChunker)
+        self.compression = None
+
+    def set_max_message_size(self, size):
+        self.max_message_size = size
+
+    def unpack(self, buffer):
+        return self.serializer.unpack(buffer, self.binary_views)
 
-    def set_max_message_size(self, _size):
-        pass
+    def decompressor(self, id):
+        if self.compression is None or not id & COMPRESSED_FLAG:
+            return None
+        return self.compression.decompressor(self.max_message_size)
 
     def release_pending_messages(self):
         self.pending_messages = {}
+        self.pending_bytes = 0
+
+    def expire(self, now=None):
+        """Discard the partial messages which stalled, returning their ids"""
+        if not self.pending_timeout:
+            return []
+
+        deadline = (time.monotonic() if now is None else now) - self.pending_timeout
+        expired = [
+            id
+            for id, pending_message in self.pending_messages.items()
+            if pending_message["last_activity"] < deadline
+        ]
+        for id in expired:
+            self._discard(id)
+
+        return expired
+
+    def _discard(self, id):
+        pending_message = self.pending_messages.pop(id)
+        self.pending_bytes -= pending_message["received_size"]
+
+    def _reject(self, id, msg):
+        if id in self.pending_messages:
+            self._discard(id)
+        raise ValueError(msg)
 
     def process_chunk(self, chunk: bytes) -> bytes | None:
-        header, chunk_content = chunk[:HEADER_LENGTH], chunk[HEADER_LENGTH:]
-        id, offset, total_size = _decode_header(header)
+        id, offset, total_size = _decode_header(chunk)
+        chunk_content = memoryview(chunk)[HEADER_LENGTH:]
+        content_size = len(chunk_content)
 
         pending_message = self.pending_messages.get(id)
 
         if pending_message is None:
+            _check_message_size(id, total_size, self.max_message_size)
+
+            decompressor = self.decompressor(id)
+            if offset == 0 and content_size == total_size:
+                # Whole message in a single chunk, no need for a streaming unpacker
+                if decompressor is not None:
+                    chunk_content = decompressor.decompress(chunk_content)
+                return self.unpack(chunk_content)
+
+            if (
+                self.max_pending_messages
+                and len(self.pending_messages) >= self.max_pending_messages
+            ):
+                msg = (
+                    f"Too many partial messages, message {id} is refused.\n"
+                    f"Maximum pending messages = {self.max_pending_messages}."
+                )
+                raise ValueError(msg)
+
             pending_message = StreamPendingMessage(
                 received_size=0,
                 total_size=total_size,
-                unpacker=msgpack.Unpacker(max_buffer_size=total_size),
+                unpacker=self.serializer.unpacker(
+                    max_buffer_size=total_size
+                    if decompressor is None
+                    else self.max_message_size
+                ),
+                decompressor=decompressor,
+                last_activity=0,
             )
             self.pending_messages[id] = pending_message
 
         # This should never happen, but still check it
         if offset != pending_message["received_size"]:
-            del self.pending_messages[id]
             msg = (
                 f"Received an unexpected chunk for message {id}.\n"
                 f"Expected offset = {pending_message['received_size']},\n"
                 f"Received offset = {offset}."
             )
-            raise ValueError(msg)
+            self._reject(id, msg)
 
         # This should never happen, but still check it
         if total_size != pending_message["total_size"]:
-            del self.pending_messages[id]
             msg = (
                 f"Received an unexpected total size in chunk header for message {id}.\n"
                 f"Expected size = {pending_message['total_size']},\n"
                 f"Received size = {total_size}."
             )
-            raise ValueError(msg)
+            self._reject(id, msg)
+
+        if self.max_pending_bytes and (
+            self.pending_bytes + content_size > self.max_pending_bytes
+        ):
+            msg = (
+                f"Pending messages exceed the allowed size, message {id} is discarded.\n"
+                f"Maximum pending bytes = {self.max_pending_bytes}."
+            )
+            self._reject(id, msg)
 
-        content_size = len(chunk_content)
         pending_message["received_size"] += content_size
+        pending_message["last_activity"] = time.monotonic()
+        self.pending_bytes += content_size
 
         unpacker = pending_message["unpacker"]
+        if pending_message["decompressor"] is not None:
+            try:
+                chunk_content = pending_message["decompressor"].decompress(
+                    chunk_content
+                )
+            except ValueError as e:
+                self._reject(id, str(e))
         unpacker.feed(chunk_content)
 
         full_message = None
@@ -192,7 +392,7 @@ class StreamUnChunker:
             full_message = unpacker.unpack()
 
         if full_message is not None:
-            del self.pending_messages[id]
+            self._discard(id)
 
             if pending_message["received_size"] < total_size:
                 # In principle feeding a stream to the unpacker could yield multiple outputs
@@ -0,0 +1,151 @@
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Set on the chunk ids of the messages compressed with the codec negotiated
+# for the connection
+COMPRESSED_FLAG = 0x80000000
+
+# Content already compressed (images, video frames, ...) is detected by
+# compressing a few samples of the message first
+SAMPLE_SIZE = 4096
+SAMPLE_COUNT = 3
+MAX_SAMPLE_RATIO = 0.9
+
+
+class DeflateCodec:
+    name = "deflate"
+
+    def __init__(self, level=1):
+        self.level = level
+
+    def compress(self, segments):
+        compressor = zlib.compressobj(self.level)
+        parts = [compressor.compress(segment) for segment in segments]
+        parts.append(compressor.flush())
+        return b"".join(parts)
+
+    def decompressor(self, max_size):
+        return DeflateDecompressor(max_size)
+
+
+class DeflateDecompressor:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._decompressor = zlib.decompressobj()
+
+    def decompress(self, data):
+        # Never inflate more than allowed, whatever the data claims
+        output = self._decompressor.decompress(data, self.max_size - self.size + 1)
+        self.size += len(output)
+        if self.size > self.max_size or self._decompressor.unconsumed_tail:
+            msg = f"Decompressed message exceeds {self.max_size} bytes"
+            raise ValueError(msg)
+        return output
+
+
+class ZstdCodec:
+    name = "zstd"
+
+    def __init__(self, level=3):
+        self.level = level
+
+    def compress(self, segments):
+        compressor = zstandard.ZstdCompressor(level=self.level).compressobj()
+        parts = [compressor.compress(segment) for segment in segments]
+        parts.append(compressor.flush())
+        return b"".join(parts)
+
+    def decompressor(self, max_size):
+        return ZstdDecompressor(max_size)
+
+
+class ZstdDecompressor:
+    # Output handed over by zstandard at once, the most decompressed past the
+    # limit before giving up
+    WRITE_SIZE = 64 * 1024
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._parts = []
+        # Unlike decompressobj(), a stream writer hands the output over as it
+        # is produced, so it never inflates the whole data at once
+        self._writer = zstandard.ZstdDecompressor().stream_writer(
+            self, write_size=self.WRITE_SIZE
+        )
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_size:
+            msg = f"Decompressed message exceeds {self.max_size} bytes"
+            raise ValueError(msg)
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def decompress(self, data):
+        self._writer.write(data)
+        output = b"".join(self._parts)
+        self._parts.clear()
+        return output
+
+
+# Codecs the server can be configured with, zstd requiring zstandard
+CODEC_NAMES = ("zstd", "deflate")
+# Codecs available here, shared by all the connections using them
+CODECS = {"deflate": DeflateCodec()}
+if zstandard is not None:
+    CODECS["zstd"] = ZstdCodec()
+
+
+def negotiate(offered, enabled):
+    """
+    Pick the codec for a connection out of the ones offered by the client,
+    in the order of preference of the server. Returns None if none matches.
+    """
+    if not isinstance(offered, list):
+        return None
+    for name in enabled:
+        if name in offered and name in CODECS:
+            return CODECS[name]
+    return None
+
+
+def _sample(segments, size):
+    """Bytes taken at a few places spread over the message"""
+    step = max((size - SAMPLE_SIZE) // max(SAMPLE_COUNT - 1, 1), 1)
+    wanted = [(i * step, i * step + SAMPLE_SIZE) for i in range(SAMPLE_COUNT)]
+    parts = []
+    offset = 0
+    for segment in segments:
+        end = offset + len(segment)
+        for start, stop in wanted:
+            if start < end and stop > offset:
+                parts.append(
+                    memoryview(segment)[max(start - offset, 0) : stop - offset]
+                )
+        offset = end
+    return b"".join(parts)
+
+
+def compress_message(codec, segments, size, threshold):
+    """
+    Compressed bytes of a message made of segments, or None when it is below
+    the threshold or does not compress well enough to be worth it.
+    """
+    if size < threshold:
+        return None
+
+    if size > SAMPLE_COUNT * SAMPLE_SIZE:
+        sample = _sample(segments, size)
+        if len(zlib.compress(sample, 1)) > MAX_SAMPLE_RATIO * len(sample):
+            return None
+
+    compressed = codec.compress(segments)
+    if len(compressed) > MAX_SAMPLE_RATIO * size:
+        return None
+    return compressed
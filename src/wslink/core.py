@@ -3,23 +3,72 @@ import functools
 
 from .uri import checkURI
 
+EXECUTORS = ("loop", "thread", "process")
 
-def register(uri):
+
+def register(uri, executor=None, ordered=False, timeout=None, upload=False):
     """
     Decorator for RPC procedure endpoints.
+
+    executor tells where a synchronous method runs: "loop" (on the event
+    loop), "thread" or "process" (in a pool shared by the server), or a
+    concurrent.futures.Executor. None uses the server default.
+
+    ordered only matters when the server dispatches RPCs concurrently: such
+    a method waits for the calls in flight and delays the following ones.
+
+    timeout, in seconds, aborts a call still running after that delay and
+    replies with a timeout error. Methods running synchronously on the loop
+    cannot be interrupted.
+
+    upload marks a coroutine method receiving a streamed upload: an async
+    iterator over the chunks of bytes sent by the client (session.upload()
+    in JavaScript) is passed as its first argument, as they arrive.
     """
+    if isinstance(executor, str) and executor not in EXECUTORS:
+        msg = f"Invalid executor {executor}, expecting one of {EXECUTORS}"
+        raise ValueError(msg)
 
     def decorate(f):
         # called once when method is decorated, because we return 'f'.
         assert callable(f)
         if not hasattr(f, "_wslinkuris"):
             f._wslinkuris = []
-        f._wslinkuris.append({"uri": checkURI(uri)})
+        f._wslinkuris.append(
+            {
+                "uri": checkURI(uri),
+                "executor": executor,
+                "ordered": ordered,
+                "timeout": timeout,
+                "upload": upload,
+            }
+        )
         return f
 
     return decorate
 
 
+def rpc_methods(cls):
+    """
+    Return the methods registered on cls and its bases as a dictionary of
+    uri -> (function, registration info). It gets computed once per class.
+    """
+    registry = cls.__dict__.get("_wslink_rpc_methods")
+    if registry is None:
+        # Same resolution as attribute lookup: overrides hide base methods
+        attributes = {}
+        for klass in reversed(cls.__mro__):
+            attributes.update(vars(klass))
+
+        registry = {}
+        for attribute in attributes.values():
+            for info in getattr(attribute, "_wslinkuris", ()):
+                registry[info["uri"]] = (attribute, info)
+
+        cls._wslink_rpc_methods = registry
+    return registry
+
+
 #############################################################################
 #
 #                         scheduling methods
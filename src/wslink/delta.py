@@ -0,0 +1,100 @@
+import copy
+import sys
+
+# Structural differences between two values made of dicts and lists, as a
+# list of operations:
+#   - ["set", path, value]: replace (or add) the value at path
+#   - ["del", path]: remove the dict key or list item at path
+# path being the list of keys and indices leading to the value from the root
+# (an empty path replacing the root). Setting the index just past the end of
+# a list appends to it.
+
+
+def _same(old, new):
+    if old is new:
+        return True
+    if type(old) is not type(new):
+        return False
+
+    np = sys.modules.get("numpy")
+    if np is not None and isinstance(old, np.ndarray):
+        return old.dtype == new.dtype and np.array_equal(old, new)
+
+    try:
+        return bool(old == new)
+    except (TypeError, ValueError):
+        return False
+
+
+def _diff(old, new, path, operations):
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key, value in new.items():
+            if key in old:
+                _diff(old[key], value, [*path, key], operations)
+            else:
+                operations.append(["set", [*path, key], value])
+        operations.extend(["del", [*path, key]] for key in old if key not in new)
+        return
+
+    if isinstance(old, (list, tuple)) and isinstance(new, (list, tuple)):
+        for index, (a, b) in enumerate(zip(old, new, strict=False)):
+            _diff(a, b, [*path, index], operations)
+        operations.extend(
+            ["set", [*path, index], new[index]] for index in range(len(old), len(new))
+        )
+        operations.extend(
+            ["del", [*path, index]] for index in reversed(range(len(new), len(old)))
+        )
+        return
+
+    if not _same(old, new):
+        operations.append(["set", path, new])
+
+
+def diff(old, new):
+    """Operations turning old into new"""
+    operations = []
+    _diff(old, new, [], operations)
+    return operations
+
+
+def apply(value, patch):
+    """
+    Return value with the operations of patch applied. value is left as is:
+    the containers along the modified paths are copied, once per patch, and
+    the rest is shared.
+    """
+    root = [value]
+    copies = set()
+    for operation, path, *new in patch:
+        parent, key = root, 0
+        for step in path:
+            child = parent[key]
+            if id(child) not in copies:
+                child = dict(child) if isinstance(child, dict) else list(child)
+                copies.add(id(child))
+                parent[key] = child
+            parent, key = child, step
+
+        if operation == "del":
+            del parent[key]
+        elif isinstance(parent, list) and key == len(parent):
+            parent.append(new[0])
+        else:
+            parent[key] = new[0]
+    return root[0]
+
+
+class TopicState:
+    """Last value published on a delta topic and the one each client holds"""
+
+    def __init__(self):
+        self.version = 0
+        self.value = None
+        # client id => (version, value)
+        self.clients = {}
+
+    def update(self, value):
+        # Copied as the publisher may modify it in place for its next publish
+        self.version += 1
+        self.value = copy.deepcopy(value)
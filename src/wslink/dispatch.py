@@ -0,0 +1,69 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Runs the RPCs of a single connection as tasks, so the connection keeps
+# being read (e.g. to cancel a call) while they execute.
+#   - at most `concurrency` of them run at the same time, the others wait for
+#     a slot in arrival order
+#   - once `concurrency + queue` calls are pending, spawn() waits, which
+#     stops the reading of the connection
+#   - an ordered call waits for the ones before it and the ones after it wait
+#     for it to complete
+#   - an unlimited call starts right away, without waiting for a slot (uploads
+#     need to consume their data for the connection to keep being read)
+#   - nothing awaits the tasks, so the exceptions they raise are logged
+class Dispatcher:
+    def __init__(self, concurrency=1, queue=16):
+        self.tasks = {}
+        self.barrier = None
+        self._slots = asyncio.Semaphore(concurrency)
+        self._room = asyncio.Semaphore(concurrency + queue)
+
+    def __len__(self):
+        return len(self.tasks)
+
+    async def spawn(self, key, coroutine_function, *args, ordered=False, limited=True):
+        await self._room.acquire()
+        if ordered:
+            wait_for = list(self.tasks.values())
+        elif self.barrier is not None and not self.barrier.done():
+            wait_for = [self.barrier]
+        else:
+            wait_for = []
+
+        task = asyncio.ensure_future(
+            self._run(wait_for, coroutine_function, args, limited)
+        )
+        if ordered:
+            self.barrier = task
+        self.tasks[key] = task
+        task.add_done_callback(lambda _: self._done(key, task))
+        return task
+
+    def cancel(self, key=None):
+        """Cancel the task of a given key, or all of them, returning whether any was"""
+        tasks = list(self.tasks.values()) if key is None else [self.tasks.get(key)]
+        canceled = False
+        for task in tasks:
+            if task is not None and not task.done():
+                task.cancel()
+                canceled = True
+        return canceled
+
+    async def _run(self, wait_for, coroutine_function, args, limited):
+        if wait_for:
+            await asyncio.wait(wait_for)
+        if not limited:
+            return await coroutine_function(*args)
+        async with self._slots:
+            return await coroutine_function(*args)
+
+    def _done(self, key, task):
+        if self.tasks.get(key) is task:
+            del self.tasks[key]
+        self._room.release()
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("RPC %s failed", key, exc_info=task.exception())
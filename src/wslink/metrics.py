@@ -0,0 +1,210 @@
+from bisect import bisect_left
+
+# Minimal metrics registry rendered in the Prometheus text exposition format
+# (https://prometheus.io/docs/instrumenting/exposition_formats/), fed by the
+# websocket handlers when metrics are enabled (WSLINK_METRICS=1) and served by
+# the aiohttp backend.
+
+# Seconds, from a fast local call to a long computation
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 10)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values, strict=True)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        # label values => value
+        self.values = {}
+
+    def samples(self):
+        """(name, labels text, value) of each sample of the metric"""
+        # Metrics without labels start at 0
+        samples = self.values if self.labels or self.values else {(): 0}
+        for values, value in sorted(samples.items()):
+            yield self.name, _format_labels(self.labels, values), value
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(
+            f"{name}{labels} {_format_value(value)}"
+            for name, labels, value in self.samples()
+        )
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, labels=()):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        # callables giving a value to add when collected
+        self.functions = []
+
+    def inc(self, amount=1, labels=()):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, amount=1, labels=()):
+        self.inc(-amount, labels)
+
+    def track(self, function):
+        """Add the value returned by function (without labels) when collected"""
+        self.functions.append(function)
+
+    def untrack(self, function):
+        """Stop adding the value returned by a function given to track()"""
+        self.functions.remove(function)
+
+    def samples(self):
+        if not self.functions:
+            yield from super().samples()
+            return
+
+        values = dict(self.values)
+        values[()] = values.get((), 0) + sum(f() for f in self.functions)
+        for labels, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labels, labels), value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        # [count per bucket (the last one being +Inf), sum]
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def samples(self):
+        for values, (counts, total) in sorted(self.values.items()):
+            cumulated = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts, strict=True):
+                cumulated += count
+                labels = _format_labels(
+                    self.labels, values, ("le", _format_value(bound))
+                )
+                yield f"{self.name}_bucket", labels, cumulated
+            labels = _format_labels(self.labels, values)
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulated
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        """All the metrics in the Prometheus text format"""
+        return "".join(f"{metric.render()}\n" for metric in self.metrics)
+
+
+class Metrics(Registry):
+    """Metrics of the wslink websocket handlers"""
+
+    def __init__(self):
+        super().__init__()
+        self.connections = self.gauge(
+            "wslink_connections", "Open websocket connections"
+        )
+        self.received_bytes = self.counter(
+            "wslink_received_bytes_total", "Bytes received, chunk headers included"
+        )
+        self.received_chunks = self.counter(
+            "wslink_received_chunks_total", "Chunks received"
+        )
+        self.received_messages = self.counter(
+            "wslink_received_messages_total", "Messages reassembled from the chunks"
+        )
+        self.sent_bytes = self.counter(
+            "wslink_sent_bytes_total", "Bytes sent, chunk headers included"
+        )
+        self.sent_chunks = self.counter("wslink_sent_chunks_total", "Chunks sent")
+        self.sent_messages = self.counter(
+            "wslink_sent_messages_total", "Messages sent, one per recipient"
+        )
+        self.rpc_calls = self.counter(
+            "wslink_rpc_calls_total", "Calls of registered RPC methods", ("method",)
+        )
+        self.rpc_errors = self.counter(
+            "wslink_rpc_errors_total",
+            "RPC calls which raised an exception or timed out",
+            ("method",),
+        )
+        self.rpc_duration = self.histogram(
+            "wslink_rpc_duration_seconds",
+            "Time from the dispatch of a RPC call until its reply is written",
+            ("method",),
+        )
+        self.published_messages = self.counter(
+            "wslink_published_messages_total",
+            "Publish messages queued, one per recipient",
+            ("topic",),
+        )
+        self.published_bytes = self.counter(
+            "wslink_published_bytes_total",
+            "Bytes of the publish messages queued, once per recipient",
+            ("topic",),
+        )
+        self.outbox_messages = self.gauge(
+            "wslink_outbox_messages", "Messages waiting to be sent"
+        )
+        self.outbox_bytes = self.gauge(
+            "wslink_outbox_bytes", "Bytes of the messages waiting to be sent"
+        )
+        self.network_pending = self.gauge(
+            "wslink_network_pending", "Network operations in progress"
+        )
+
+
+# singleton, shared by all the websocket handlers of the process
+registry = Metrics()
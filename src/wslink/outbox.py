@@ -0,0 +1,258 @@
+import asyncio
+import logging
+from collections import deque
+
+from wslink.chunking import HEADER_LENGTH, join_chunk
+
+logger = logging.getLogger(__name__)
+
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "block", "disconnect")
+
+# Priority classes of the outgoing messages, lower goes out first
+PRIORITY_SYSTEM = 0
+PRIORITY_RPC = 1
+PRIORITY_PUBLISH = 2
+
+
+class OutboundMessage:
+    __slots__ = (
+        "chunks",
+        "droppable",
+        "future",
+        "max_pending",
+        "priority",
+        "sent",
+        "size",
+        "topic",
+    )
+
+    def __init__(
+        self,
+        chunks,
+        size,
+        future,
+        topic=None,
+        max_pending=None,
+        droppable=False,
+        priority=PRIORITY_RPC,
+    ):
+        self.chunks = chunks
+        self.size = size
+        self.future = future
+        self.topic = topic
+        self.max_pending = max_pending
+        self.droppable = droppable
+        self.priority = priority
+        # number of chunks already written
+        self.sent = 0
+
+
+# Queue of outgoing messages for a single connection.
+# A dedicated writer task sends the chunks of the messages, so a slow
+# connection only delays its own messages and never the ones going to other
+# clients.
+#
+# Messages of the same priority class go out in order. Across classes, the
+# writer picks the next chunk from the most urgent message, so a small RPC
+# reply overtakes a large publish in the middle of it (the chunk headers let
+# the client reassemble interleaved messages).
+#
+# The outbox can be given a budget (max_bytes/max_messages, 0 meaning
+# unlimited). Only droppable messages (publishes) are subject to the overflow
+# policy, RPC replies always get queued:
+#   - drop_oldest: unsent publishes are evicted to make room for the new one
+#   - drop_newest: the new publish is discarded
+#   - block: the message is queued, producers are expected to wait_for_room()
+#   - disconnect: the connection is closed
+class Outbox:
+    def __init__(self, ws, max_bytes=0, max_messages=0, overflow="block", metrics=None):
+        if overflow not in OVERFLOW_POLICIES:
+            msg = f"Invalid overflow policy {overflow}, expecting one of {OVERFLOW_POLICIES}"
+            raise ValueError(msg)
+
+        self.ws = ws
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self.overflow = overflow
+        self.metrics = metrics
+        # priority => messages not started yet
+        self.queues = {}
+        self.pending_bytes = 0
+        self.closed = False
+        # priority => message partly sent
+        self._sending = {}
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._room = asyncio.Event()
+        self._room.set()
+        self._task = self._loop.create_task(self._run())
+        # Closing of the connection by the disconnect policy
+        self._close_task = None
+
+    def __len__(self):
+        """Number of messages waiting to be sent, including the ones in progress"""
+        return sum(len(queue) for queue in self.queues.values()) + len(self._sending)
+
+    def is_full(self):
+        return bool(
+            (self.max_messages and len(self) >= self.max_messages)
+            or (self.max_bytes and self.pending_bytes >= self.max_bytes)
+        )
+
+    async def wait_for_room(self):
+        """Wait until the outbox is below its budget"""
+        while not self.closed and self.is_full():
+            self._room.clear()
+            await self._room.wait()
+
+    def put(
+        self,
+        chunks,
+        size,
+        topic=None,
+        max_pending=None,
+        droppable=False,
+        priority=PRIORITY_RPC,
+    ):
+        """
+        Queue the chunks of a message and return a future resolved with True
+        once they have all been written to the socket or with False if the
+        message was discarded.
+
+        Chunks of messages with a lower priority value are sent first.
+
+        When max_pending is provided, at most that many messages of the same
+        topic wait to be sent: older ones which did not start going out yet
+        get replaced by the newer one.
+        """
+        future = self._loop.create_future()
+        if self.closed:
+            future.set_result(False)
+            return future
+
+        if max_pending is not None:
+            self._drop_topic(topic, max_pending - 1)
+
+        if droppable and self._overflows(size):
+            if self.overflow == "drop_newest":
+                future.set_result(False)
+                return future
+            if self.overflow == "drop_oldest":
+                self._drop_oldest(size)
+            elif self.overflow == "disconnect":
+                logger.warning("Closing connection exceeding its outbound budget")
+                self.close()
+                self._close_task = self._loop.create_task(self.ws.close())
+                self._close_task.add_done_callback(self._closed)
+                future.set_result(False)
+                return future
+
+        self.queues.setdefault(priority, deque()).append(
+            OutboundMessage(
+                chunks, size, future, topic, max_pending, droppable, priority
+            )
+        )
+        self.pending_bytes += size
+        self._wakeup.set()
+        return future
+
+    def close(self):
+        """Stop the writer and discard anything not sent yet"""
+        if self.closed:
+            return
+
+        self._task.cancel()
+        self._discard()
+
+    def _closed(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Failed to close connection", exc_info=task.exception())
+
+    def _overflows(self, size):
+        # A message is never refused when nothing else is pending
+        if not len(self):
+            return False
+        return bool(
+            (self.max_messages and len(self) + 1 > self.max_messages)
+            or (self.max_bytes and self.pending_bytes + size > self.max_bytes)
+        )
+
+    def _queued(self):
+        """Messages not started yet, least urgent first, oldest first"""
+        for priority in sorted(self.queues, reverse=True):
+            yield from self.queues[priority]
+
+    def _remove(self, message):
+        self.queues[message.priority].remove(message)
+        self._release(message, False)
+
+    def _drop_oldest(self, size):
+        for message in [m for m in self._queued() if m.droppable]:
+            if not self._overflows(size):
+                return
+            self._remove(message)
+
+    def _drop_topic(self, topic, keep):
+        queued = [m for m in self._queued() if m.topic == topic]
+        for message in queued[: max(len(queued) - keep, 0)]:
+            self._remove(message)
+
+    def _discard(self):
+        self.closed = True
+        for message in self._sending.values():
+            self._release(message, False)
+        self._sending.clear()
+        for message in list(self._queued()):
+            self._release(message, False)
+        self.queues.clear()
+
+    def _next(self):
+        """Message the next chunk to send belongs to, None if there is none"""
+        for priority in sorted(self._sending.keys() | self.queues.keys()):
+            if priority in self._sending:
+                return self._sending[priority]
+            queue = self.queues[priority]
+            if queue:
+                message = self._sending[priority] = queue.popleft()
+                return message
+        return None
+
+    def _release(self, message, sent):
+        self.pending_bytes -= message.size
+        self._room.set()
+        if not message.future.done():
+            message.future.set_result(sent)
+
+    async def _send_chunk(self, header, content):
+        # Single copy of the content into the frame buffer
+        await self.ws.send_bytes(join_chunk(header, content))
+
+    async def _run(self):
+        while True:
+            message = self._next()
+            while message is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                message = self._next()
+
+            try:
+                await self._send_chunk(*message.chunks[message.sent])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # The socket is unusable, nothing else will go through
+                logger.info("Outbox closing after send failure: %s", e)
+                self._discard()
+                return
+
+            message.sent += 1
+            if message.sent == len(message.chunks):
+                del self._sending[message.priority]
+                self._release(message, True)
+                if self.metrics is not None:
+                    self.metrics.sent_messages.inc()
+                    self.metrics.sent_chunks.inc(message.sent)
+                    self.metrics.sent_bytes.inc(
+                        message.size + HEADER_LENGTH * message.sent
+                    )
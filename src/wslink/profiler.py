@@ -0,0 +1,104 @@
+import cProfile
+import marshal
+import math
+import sys
+import threading
+from collections import Counter
+
+# Profilers run inside the live server through the wslink.profile.start and
+# wslink.profile.stop system messages, restricted to the clients providing
+# the admin secret.
+
+
+class SamplingProfiler:
+    """
+    Sample the stacks of all the threads every interval (in seconds) and
+    return them in the collapsed format of flamegraph.pl and speedscope:
+    one line per distinct stack, frames separated by ';', followed by the
+    number of samples.
+    """
+
+    format = "collapsed"
+
+    def __init__(self, interval=0.005):
+        self.interval = max(interval, 0.001)
+        self.samples = 0
+        self.counts = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="wslink-profiler", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.counts.most_common()
+        )
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, top in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                frame = top
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+                    )
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.counts[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+
+class CProfileProfiler:
+    """
+    Deterministic profile of the event loop thread, returned in the pstats
+    format (what cProfile.Profile.dump_stats writes, readable with
+    pstats.Stats or snakeviz once saved to a file).
+    """
+
+    format = "pstats"
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        self.profile.create_stats()
+        return marshal.dumps(self.profile.stats)
+
+
+PROFILERS = {"sampling": SamplingProfiler, "cprofile": CProfileProfiler}
+
+
+def create_profiler(options):
+    """Profiler described by the options of wslink.profile.start"""
+    mode = options.get("mode", "sampling")
+    if mode not in PROFILERS:
+        msg = f"Invalid profiler {mode}, expecting one of {list(PROFILERS)}"
+        raise ValueError(msg)
+    if mode == "sampling":
+        interval = options.get("interval", 0.005)
+        # Non finite intervals break the sampling thread, 0 spins a core
+        if not (
+            isinstance(interval, (int, float))
+            and not isinstance(interval, bool)
+            and math.isfinite(interval)
+            and interval > 0
+        ):
+            msg = f"Invalid interval {interval}, expecting a positive number of seconds"
+            raise ValueError(msg)
+        return SamplingProfiler(interval)
+    return PROFILERS[mode]()
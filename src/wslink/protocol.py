@@ -1,15 +1,27 @@
 import asyncio
-import copy
+import functools
+import hmac
 import inspect
 import logging
 import os
+import time
 import traceback
-
-import msgpack
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 from wslink import schedule_coroutine
-from wslink.chunking import UnChunker, generate_chunks
+from wslink.chunking import HEADER, StreamUnChunker, UnChunker, generate_chunk_views
+from wslink.compression import CODEC_NAMES, compress_message, negotiate
+from wslink.core import EXECUTORS, rpc_methods
+from wslink.delta import TopicState, diff
+from wslink.dispatch import Dispatcher
+from wslink.metrics import registry as metrics_registry
+from wslink.outbox import PRIORITY_RPC, PRIORITY_SYSTEM, Outbox
+from wslink.profiler import create_profiler
 from wslink.publish import PublishManager
+from wslink.serializer import Serializer
+from wslink.tracing import TRACERS, Trace, now
+from wslink.upload import Upload
+from wslink.watchdog import Watchdog
 from wslink.websocket import ServerProtocol
 
 # from http://www.jsonrpc.org/specification, section 5.1
@@ -17,15 +29,82 @@ METHOD_NOT_FOUND = -32601
 AUTHENTICATION_ERROR = -32000
 EXCEPTION_ERROR = -32001
 RESULT_SERIALIZE_ERROR = -32002
+RPC_CANCELED_ERROR = -32003
+RPC_TIMEOUT_ERROR = -32004
 # used in client JS code:
 CLIENT_ERROR = -32099
 
 # 4MB is the default inside aiohttp
 MAX_MSG_SIZE = int(os.environ.get("WSLINK_MAX_MSG_SIZE", "4194304"))
 
+# Per client outbound budget (0 means unlimited) and overflow policy
+OUTBOX_MAX_BYTES = int(os.environ.get("WSLINK_OUTBOX_MAX_BYTES", "0"))
+OUTBOX_MAX_MESSAGES = int(os.environ.get("WSLINK_OUTBOX_MAX_MESSAGES", "0"))
+OUTBOX_OVERFLOW = os.environ.get("WSLINK_OUTBOX_OVERFLOW", "block")
+BINARY_VIEWS = bool(int(os.environ.get("WSLINK_BINARY_VIEWS", "0")))
+
+# Incoming messages reassembly: "stream" (bounded) or "buffered"
+UNCHUNKERS = {"stream": StreamUnChunker, "buffered": UnChunker}
+UNCHUNKER = os.environ.get("WSLINK_UNCHUNKER", "stream")
+# Per client limits of the stream unchunker (0 means unlimited)
+MAX_PENDING_BYTES = int(os.environ.get("WSLINK_MAX_PENDING_BYTES", "0"))
+MAX_PENDING_MESSAGES = int(os.environ.get("WSLINK_MAX_PENDING_MESSAGES", "16"))
+PENDING_TIMEOUT = float(os.environ.get("WSLINK_PENDING_TIMEOUT", "60"))
+
+# Where synchronous RPC methods run by default: "loop", "thread" or "process"
+RPC_EXECUTOR = os.environ.get("WSLINK_RPC_EXECUTOR", "loop")
+# Size of the thread and process pools (0 means the concurrent.futures default)
+RPC_WORKERS = int(os.environ.get("WSLINK_RPC_WORKERS", "0"))
+# RPCs of a client processed at the same time (1 means one after the other)
+RPC_CONCURRENCY = int(os.environ.get("WSLINK_RPC_CONCURRENCY", "1"))
+# RPCs of a client waiting for their turn before its connection stops being read
+RPC_QUEUE = int(os.environ.get("WSLINK_RPC_QUEUE", "16"))
+# Received chunks of an upload waiting to be consumed before the connection
+# stops being read
+UPLOAD_QUEUE = int(os.environ.get("WSLINK_UPLOAD_QUEUE", "8"))
+# Codecs offered to the clients for the messages sent to them, by order of
+# preference ("zstd,deflate"), none by default
+COMPRESSION = [c for c in os.environ.get("WSLINK_COMPRESSION", "").split(",") if c]
+# Smaller messages are never compressed
+COMPRESSION_THRESHOLD = int(os.environ.get("WSLINK_COMPRESSION_THRESHOLD", "4096"))
+# Feed the metrics registry served by the aiohttp backend (WSLINK_METRICS_ROUTE)
+METRICS = bool(int(os.environ.get("WSLINK_METRICS", "0")))
+# Tracer getting the timing breakdown of RPCs and publishes: "log" or
+# "opentelemetry", none by default
+TRACER = os.environ.get("WSLINK_TRACER", "")
+# Event loop lag in seconds reported as a stall, 0 disables the watchdog
+WATCHDOG = float(os.environ.get("WSLINK_WATCHDOG", "0"))
+# Secret giving access to the admin system messages (wslink.profile.*),
+# which are disabled without it
+ADMIN_SECRET = os.environ.get("WSLINK_ADMIN_SECRET", "")
+
 logger = logging.getLogger(__name__)
 
 
+# Pools shared by all the endpoints, created on first use
+rpc_pools = {}
+
+
+# Returned by streamResults once every value went out
+STREAMED = object()
+
+
+def rpc_pool(kind):
+    if kind not in rpc_pools:
+        workers = RPC_WORKERS or None
+        if kind == "thread":
+            rpc_pools[kind] = ThreadPoolExecutor(workers, thread_name_prefix="wslink")
+        else:
+            rpc_pools[kind] = ProcessPoolExecutor(workers)
+    return rpc_pools[kind]
+
+
+def endpoint_setting(protocol, name, default):
+    """ServerProtocol attributes override the environment defaults per endpoint"""
+    value = getattr(protocol, name, None)
+    return default if value is None else value
+
+
 class AbstractWebApp:
     def __init__(self, server_config):
         self._last_active_client_id = None
@@ -38,6 +117,7 @@ class AbstractWebApp:
             asyncio.set_event_loop(loop)
         self._completion = loop.create_future()
         self._app = None
+        self._watchdog = None
 
     # -------------------------------------------------------------------------
     # Config helper
@@ -67,6 +147,10 @@ class AbstractWebApp:
     def ssl_context(self):
         return self.config.get("ssl", None)
 
+    @property
+    def watchdog(self):
+        return float(self.config.get("watchdog", WATCHDOG))
+
     # -------------------------------------------------------------------------
     # In flight state
     # -------------------------------------------------------------------------
@@ -108,6 +192,25 @@ class AbstractWebApp:
             self._shutdown_task.cancel()
             self._shutdown_task = None
 
+    def watchdog_start(self, log_emitters):
+        """
+        Report the stalls of the event loop, with the RPC method blocking it,
+        as errors on the given log emitters (the ones of the server protocols)
+        """
+        if self.watchdog <= 0 or self._watchdog is not None:
+            return
+
+        def report(message):
+            for log_emitter in log_emitters:
+                log_emitter.error(message)
+
+        self._watchdog = Watchdog(self.watchdog, report)
+
+    def watchdog_stop(self):
+        if self._watchdog is not None:
+            self._watchdog.stop()
+            self._watchdog = None
+
     # -------------------------------------------------------------------------
     # Server status
     # -------------------------------------------------------------------------
@@ -139,34 +242,143 @@ class WslinkHandler:
         self.attachmentsRecvQueue = []
         self.connections = {}
         self.authentified_client_ids = set()
-        self.attachment_atomic = asyncio.Lock()
+        self.outboxes = {}
         self.pub_manager = PublishManager()
         self.unchunkers = {}
         self.network_monitor = protocol.network_monitor
         self.log_emitter = protocol.log_emitter
+        self.outbox_max_bytes = endpoint_setting(
+            protocol, "outbox_max_bytes", OUTBOX_MAX_BYTES
+        )
+        self.outbox_max_messages = endpoint_setting(
+            protocol, "outbox_max_messages", OUTBOX_MAX_MESSAGES
+        )
+        self.outbox_overflow = endpoint_setting(
+            protocol, "outbox_overflow", OUTBOX_OVERFLOW
+        )
+        self.serializer = endpoint_setting(protocol, "serializer", Serializer())
+        self.binary_views = endpoint_setting(protocol, "binary_views", BINARY_VIEWS)
+        self.unchunker = endpoint_setting(protocol, "unchunker", UNCHUNKER)
+        if self.unchunker not in UNCHUNKERS:
+            msg = f"Invalid unchunker {self.unchunker}, expecting one of {list(UNCHUNKERS)}"
+            raise ValueError(msg)
+        self.max_pending_bytes = endpoint_setting(
+            protocol, "max_pending_bytes", MAX_PENDING_BYTES
+        )
+        self.max_pending_messages = endpoint_setting(
+            protocol, "max_pending_messages", MAX_PENDING_MESSAGES
+        )
+        self.pending_timeout = endpoint_setting(
+            protocol, "pending_timeout", PENDING_TIMEOUT
+        )
+        self.expire_task = None
+        self.rpc_executor = endpoint_setting(protocol, "rpc_executor", RPC_EXECUTOR)
+        if isinstance(self.rpc_executor, str) and self.rpc_executor not in EXECUTORS:
+            msg = f"Invalid rpc executor {self.rpc_executor}, expecting one of {EXECUTORS}"
+            raise ValueError(msg)
+        self.rpcInfo = {}
+        self.rpc_concurrency = endpoint_setting(
+            protocol, "rpc_concurrency", RPC_CONCURRENCY
+        )
+        self.rpc_queue = endpoint_setting(protocol, "rpc_queue", RPC_QUEUE)
+        self.dispatchers = {}
+        self.upload_queue = endpoint_setting(protocol, "upload_queue", UPLOAD_QUEUE)
+        self.uploads = {}
+        self.compression = endpoint_setting(protocol, "compression", COMPRESSION)
+        for name in self.compression:
+            if name not in CODEC_NAMES:
+                msg = f"Invalid compression {name}, expecting one of {CODEC_NAMES}"
+                raise ValueError(msg)
+        self.compression_threshold = endpoint_setting(
+            protocol, "compression_threshold", COMPRESSION_THRESHOLD
+        )
+        self.compressions = {}
+        self.metrics = None
+        # (gauge, function) tracked until the shutdown
+        self.metricTrackers = []
+        if endpoint_setting(protocol, "metrics", METRICS):
+            self.metrics = metrics_registry
+            self.metricTrackers = [
+                (
+                    self.metrics.outbox_messages,
+                    lambda: sum(len(o) for o in self.outboxes.values()),
+                ),
+                (
+                    self.metrics.outbox_bytes,
+                    lambda: sum(o.pending_bytes for o in self.outboxes.values()),
+                ),
+                (self.metrics.network_pending, lambda: self.network_monitor.pending),
+            ]
+            for gauge, function in self.metricTrackers:
+                gauge.track(function)
+        self.tracer = endpoint_setting(protocol, "tracer", TRACER)
+        if isinstance(self.tracer, str):
+            if self.tracer and self.tracer not in TRACERS:
+                msg = f"Invalid tracer {self.tracer}, expecting one of {list(TRACERS)}"
+                raise ValueError(msg)
+            self.tracer = TRACERS[self.tracer]() if self.tracer else None
+        # client id => chunk id => time the first chunk of a message arrived
+        self.receiveStarts = {}
+        self.admin_secret = endpoint_setting(protocol, "admin_secret", ADMIN_SECRET)
+        # (client id, profiler) started by an admin client
+        self.profiling = None
+        self.streamingClients = set()
+        self.patchingClients = set()
+        # topic => TopicState of the delta topics
+        self.topicStates = {}
+        self.loop = None
 
         # Build the rpc method dictionary, assuming we were given a serverprotocol
         if self.getServerProtocol():
-            protocolList = self.getServerProtocol().getLinkProtocols()
-            protocolList.append(self.getServerProtocol())
-            for protocolObject in protocolList:
-                protocolObject.init(
-                    self.publish,
-                    self.addAttachment,
-                    lambda: schedule_coroutine(0, self.web_app.stop),
-                )
+            self.attachLinkProtocols()
+            self.getServerProtocol().addLinkProtocolListener(self.attachLinkProtocols)
+            self.pub_manager.registerProtocol(self)
 
-                def test(x):
-                    return inspect.ismethod(x) or inspect.isfunction(x)
+    def shutdown(self):
+        """
+        Stop following the server protocol once the endpoint is stopped, so it
+        no longer keeps this handler alive
+        """
+        if self.getServerProtocol():
+            self.getServerProtocol().removeLinkProtocolListener(
+                self.attachLinkProtocols
+            )
+        self.pub_manager.unregisterProtocol(self)
+        for gauge, function in self.metricTrackers:
+            gauge.untrack(function)
+        self.metricTrackers = []
+
+    def disableTransportCompression(self, client_id):
+        """
+        Called once wslink compresses the messages sent to a client, for the
+        backends to stop compressing them again at the websocket level
+        """
+
+    def attachLinkProtocols(self):
+        """
+        Wire the protocols of the server protocol to this endpoint and build
+        the rpc dispatch table out of their registered methods. The table is
+        replaced all at once, so concurrent calls see either version.
+        """
+        server_protocol = self.getServerProtocol()
+        functionMap = {}
+        rpcInfo = {}
+        for protocolObject in [*server_protocol.getLinkProtocols(), server_protocol]:
+            protocolObject.init(
+                self.publish,
+                self.addAttachment,
+                lambda: schedule_coroutine(0, self.web_app.stop),
+            )
+            protocolObject.publishManager = self.pub_manager
+            protocolObject.publish_async = self.publish_async
+            protocolObject.queue_depth = self.queue_depth
 
-                for k in inspect.getmembers(protocolObject.__class__, test):
-                    proc = k[1]
-                    if "_wslinkuris" in proc.__dict__:
-                        uri_info = proc.__dict__["_wslinkuris"][0]
-                        if "uri" in uri_info:
-                            uri = uri_info["uri"]
-                            self.functionMap[uri] = (protocolObject, proc)
-            self.pub_manager.registerProtocol(self)
+            for uri, (func, info) in rpc_methods(type(protocolObject)).items():
+                functionMap[uri] = (protocolObject, func)
+                rpcInfo[uri] = info
+
+        self.functionMap = functionMap
+        self.rpcInfo = rpcInfo
 
     def setServerProtocol(self, protocol):
         self.serverProtocol = protocol
@@ -182,8 +394,47 @@ class WslinkHandler:
     def reverse_connection_client_id(self):
         return "reverse_connection_client_id"
 
+    def createUnChunker(self):
+        if self.unchunker == "buffered":
+            return UnChunker(binary_views=self.binary_views, serializer=self.serializer)
+
+        return StreamUnChunker(
+            binary_views=self.binary_views,
+            serializer=self.serializer,
+            max_pending_bytes=self.max_pending_bytes,
+            max_pending_messages=self.max_pending_messages,
+            pending_timeout=self.pending_timeout,
+        )
+
+    async def expirePendingMessages(self):
+        while True:
+            await asyncio.sleep(self.pending_timeout)
+            for client_id, unchunker in list(self.unchunkers.items()):
+                expired = unchunker.expire()
+                if expired:
+                    logger.warning(
+                        "Discarded %d stalled partial message(s) from client %s",
+                        len(expired),
+                        client_id,
+                    )
+
     async def onConnect(self, request, client_id):
-        self.unchunkers[client_id] = UnChunker()
+        self.loop = asyncio.get_running_loop()
+        self.unchunkers[client_id] = self.createUnChunker()
+        if self.unchunker == "stream" and self.pending_timeout and not self.expire_task:
+            self.expire_task = asyncio.create_task(self.expirePendingMessages())
+        self.outboxes[client_id] = Outbox(
+            self.connections[client_id],
+            max_bytes=self.outbox_max_bytes,
+            max_messages=self.outbox_max_messages,
+            overflow=self.outbox_overflow,
+            metrics=self.metrics,
+        )
+        self.dispatchers[client_id] = Dispatcher(self.rpc_concurrency, self.rpc_queue)
+        self.uploads[client_id] = {}
+        self.receiveStarts[client_id] = {}
+        if self.metrics is not None:
+            self.metrics.connections.inc()
 
         if not self.serverProtocol:
             return
@@ -195,6 +446,31 @@ class WslinkHandler:
 
     async def onClose(self, client_id):
         del self.unchunkers[client_id]
+        if not self.unchunkers and self.expire_task:
+            self.expire_task.cancel()
+            self.expire_task = None
+        outbox = self.outboxes.pop(client_id, None)
+        if outbox is not None:
+            outbox.close()
+        dispatcher = self.dispatchers.pop(client_id, None)
+        if dispatcher is not None:
+            # Nobody is waiting for those results anymore
+            dispatcher.cancel()
+        for upload in self.uploads.pop(client_id, {}).values():
+            upload.close()
+        self.pub_manager.releaseClient(client_id)
+        self.streamingClients.discard(client_id)
+        self.patchingClients.discard(client_id)
+        for state in self.topicStates.values():
+            state.clients.pop(client_id, None)
+        self.compressions.pop(client_id, None)
+        self.receiveStarts.pop(client_id, None)
+        if self.profiling is not None and self.profiling[0] == client_id:
+            # Nobody is going to collect it
+            self.profiling[1].stop()
+            self.profiling = None
+        if self.metrics is not None:
+            self.metrics.connections.dec()
 
         if not self.serverProtocol:
             return
@@ -220,14 +496,29 @@ class WslinkHandler:
                     self.unchunkers[client_id].set_max_message_size(
                         4 * 1024 * 1024 * 1024
                     )  # 4GB
-                    await self.sendWrappedMessage(
-                        rpcid,
-                        {
-                            "clientID": f"c{client_id}",
-                            "maxMsgSize": MAX_MSG_SIZE,
-                        },
-                        client_id=client_id,
-                    )
+                    # Client managing its subscriptions only get the topics it asked for
+                    if args[0].get("subscriptions"):
+                        self.pub_manager.enableFiltering(client_id)
+                    # Client able to receive results in several messages
+                    if args[0].get("streams"):
+                        self.streamingClients.add(client_id)
+                    # Client able to apply the patches of delta topics
+                    if args[0].get("patches"):
+                        self.patchingClients.add(client_id)
+                    # Codecs the client can decompress, what it sends
+                    # remains uncompressed
+                    codec = negotiate(args[0].get("compression"), self.compression)
+                    welcome = {
+                        "clientID": f"c{client_id}",
+                        "maxMsgSize": MAX_MSG_SIZE,
+                    }
+                    if codec is not None:
+                        welcome["compression"] = codec.name
+                    await self.sendWrappedMessage(rpcid, welcome, client_id=client_id)
+                    # Only the messages following the reply get compressed
+                    if codec is not None:
+                        self.compressions[client_id] = codec
+                        self.disableTransportCompression(client_id)
                 else:
                     await self.sendWrappedError(
                         rpcid,
@@ -235,6 +526,16 @@ class WslinkHandler:
                         "Authentication failed",
                         client_id=client_id,
                     )
+            elif methodName in (
+                "wslink.subscribe",
+                "wslink.unsubscribe",
+                "wslink.resync",
+            ):
+                await self.handleSubscription(rpcid, methodName, args, client_id)
+            elif methodName == "wslink.cancel":
+                await self.handleCancel(rpcid, args, client_id)
+            elif methodName in ("wslink.profile.start", "wslink.profile.stop"):
+                await self.handleProfile(rpcid, methodName, args, client_id)
             else:
                 await self.sendWrappedError(
                     rpcid,
@@ -245,6 +546,129 @@ class WslinkHandler:
             return True
         return False
 
+    async def handleSubscription(self, rpcid, methodName, args, client_id):
+        if not self.isClientAuthenticated(client_id):
+            await self.sendWrappedError(
+                rpcid,
+                AUTHENTICATION_ERROR,
+                "Unauthorized: Skip message processing",
+                client_id=client_id,
+            )
+            return
+
+        if not args or type(args[0]) is not str:
+            await self.sendWrappedError(
+                rpcid,
+                EXCEPTION_ERROR,
+                "A topic is expected",
+                methodName,
+                client_id=client_id,
+            )
+            return
+
+        topic = args[0]
+        # The next value of a delta topic goes out whole
+        state = self.topicStates.get(topic)
+        if state is not None:
+            state.clients.pop(client_id, None)
+
+        if methodName == "wslink.subscribe":
+            self.pub_manager.subscribe(topic, client_id)
+        elif methodName == "wslink.unsubscribe":
+            self.pub_manager.unsubscribe(topic, client_id)
+        elif (
+            state is not None
+            and state.version
+            and self.pub_manager.isSubscribed(topic, client_id)
+        ):
+            # The client missed a patch, send it the current value right away
+            [(packed_wrapper, client_ids)] = self.packTopicState(
+                f"publish:{topic}:{self.pub_manager.publishCount}", topic, [client_id]
+            )
+            await self.sendPacked(
+                packed_wrapper,
+                client_ids,
+                priority=self.pub_manager.topicPriority(topic),
+            )
+
+        await self.sendWrappedMessage(rpcid, {"topic": topic}, client_id=client_id)
+
+    async def handleCancel(self, rpcid, args, client_id):
+        if not self.isClientAuthenticated(client_id):
+            await self.sendWrappedError(
+                rpcid,
+                AUTHENTICATION_ERROR,
+                "Unauthorized: Skip message processing",
+                client_id=client_id,
+            )
+            return
+
+        canceled_id = args[0] if args else None
+        canceled = type(canceled_id) is str and self.dispatchers[client_id].cancel(
+            canceled_id
+        )
+        if canceled:
+            await self.sendWrappedError(
+                canceled_id,
+                RPC_CANCELED_ERROR,
+                "RPC canceled",
+                client_id=client_id,
+            )
+        await self.sendWrappedMessage(
+            rpcid, {"id": canceled_id, "canceled": canceled}, client_id=client_id
+        )
+
+    def isAdmin(self, client_id, secret):
+        return bool(
+            self.isClientAuthenticated(client_id)
+            and self.admin_secret
+            and type(secret) is str
+            and hmac.compare_digest(secret, self.admin_secret)
+        )
+
+    async def handleProfile(self, rpcid, methodName, args, client_id):
+        """
+        Start a profiler inside the server, or stop it and send back what it
+        collected, see wslink.profiler. Only one runs at a time.
+        """
+        options = args[0] if args and type(args[0]) is dict else {}
+        if not self.isAdmin(client_id, options.get("secret")):
+            await self.sendWrappedError(
+                rpcid,
+                AUTHENTICATION_ERROR,
+                "Unauthorized: admin secret required",
+                client_id=client_id,
+            )
+            return
+
+        error = None
+        if methodName == "wslink.profile.start":
+            if self.profiling is not None:
+                error = "A profiler is already running"
+            else:
+                try:
+                    profiler = create_profiler(options)
+                    profiler.start()
+                except ValueError as e:
+                    error = str(e)
+                else:
+                    self.profiling = (client_id, profiler)
+                    result = {"format": profiler.format}
+        elif self.profiling is None:
+            error = "No profiler running"
+        else:
+            _, profiler = self.profiling
+            self.profiling = None
+            result = {"format": profiler.format, "data": profiler.stop()}
+
+        if error is not None:
+            await self.sendWrappedError(
+                rpcid, EXCEPTION_ERROR, error, methodName, client_id=client_id
+            )
+            return
+
+        await self.sendWrappedMessage(rpcid, result, client_id=client_id)
+
     async def onMessage(self, is_binary, msg, client_id):
         if not is_binary:
             logger.critical("wslink is not expecting text message:\n> %s", msg.data)
@@ -253,18 +677,118 @@ class WslinkHandler:
             )
             return
 
-        full_message = self.unchunkers[client_id].process_chunk(msg.data)
-        if full_message is not None:
-            with self.network_monitor:
-                await self.onCompleteMessage(full_message, client_id)
+        if self.metrics is not None:
+            self.metrics.received_chunks.inc()
+            self.metrics.received_bytes.inc(len(msg.data))
+
+        if self.tracer is not None:
+            received = now()
+            chunk_id, offset, _ = HEADER.unpack_from(msg.data)
+            starts = self.receiveStarts[client_id]
+            if offset == 0:
+                starts[chunk_id] = received
+
+        try:
+            full_message = self.unchunkers[client_id].process_chunk(msg.data)
+        except Exception:
+            if self.tracer is not None:
+                starts.pop(chunk_id, None)
+            raise
+        if full_message is None:
+            return
+
+        if self.metrics is not None:
+            self.metrics.received_messages.inc()
+
+        trace = None
+        if self.tracer is not None:
+            unpacked = now()
+            first_received = starts.pop(chunk_id, received)
+
+        # Data of a streamed upload, handed to the method consuming it
+        if full_message.get("upload") in ("data", "end"):
+            await self.receiveUpload(full_message, client_id)
+            return
+
+        # Calls to registered methods run as tasks while the connection keeps
+        # being read, everything else is handled right away
+        method = full_message.get("method")
+        rpcid = full_message.get("id")
+        if self.tracer is not None:
+            trace = Trace("rpc", method, rpcid)
+            trace.add("receive", first_received, received)
+            trace.add("unpack", received, unpacked)
+        if type(rpcid) is str and rpcid.startswith("rpc:") and method in self.rpcInfo:
+            info = self.rpcInfo[method]
+            upload = info.get("upload") and self.isClientAuthenticated(client_id)
+            if upload and full_message.get("upload") != "start":
+                # No data will ever come, the method would wait forever
+                await self.sendWrappedError(
+                    rpcid,
+                    EXCEPTION_ERROR,
+                    "Upload method called without upload",
+                    method,
+                    client_id=client_id,
+                )
+                return
+            if upload:
+                self.uploads[client_id][rpcid] = Upload(self.upload_queue)
+            task = await self.dispatchers[client_id].spawn(
+                rpcid,
+                self.dispatchMessage,
+                full_message,
+                client_id,
+                trace,
+                ordered=info.get("ordered", False),
+                limited=not upload,
+            )
+            if upload:
+                task.add_done_callback(lambda _: self.closeUpload(client_id, rpcid))
+            return
+
+        await self.dispatchMessage(full_message, client_id, trace)
+
+    async def receiveUpload(self, message, client_id):
+        """
+        Queue the data of an upload message, waiting (and so not reading the
+        connection) while the method lags behind.
+        """
+        upload = self.uploads.get(client_id, {}).get(message.get("id"))
+        if upload is None:
+            # The method already returned or failed, drop the rest
+            return
 
-    async def onCompleteMessage(self, rpc, client_id):
-        debug_message = "wslink incoming msg %s"
-        stripped_payload = self.payloadWithSecretStripped(rpc)
-        logger.debug(debug_message, stripped_payload)
+        if message["upload"] == "end":
+            upload.finish()
+        else:
+            await upload.put(message.get("data", b""))
 
-        if self.log_emitter.has("debug"):
-            self.log_emitter.debug(debug_message % stripped_payload)  # noqa: G002
+    def closeUpload(self, client_id, rpcid):
+        upload = self.uploads.get(client_id, {}).pop(rpcid, None)
+        if upload is not None:
+            upload.close()
+
+    async def dispatchMessage(self, rpc, client_id, trace=None):
+        with self.network_monitor:
+            try:
+                await self.onCompleteMessage(rpc, client_id, trace)
+            finally:
+                if trace is not None:
+                    self.tracer.record(trace)
+
+    async def onCompleteMessage(self, rpc, client_id, trace=None):
+        if trace is not None:
+            trace.add("queue", trace.end)
+
+        # Only redact and format the payload when something listens to it
+        emit_debug = self.log_emitter.has("debug")
+        if emit_debug or logger.isEnabledFor(logging.DEBUG):
+            debug_message = "wslink incoming msg %s"
+            stripped_payload = self.payloadWithSecretStripped(rpc)
+            logger.debug(debug_message, stripped_payload)
+
+            if emit_debug:
+                self.log_emitter.debug(debug_message % stripped_payload)  # noqa: G002
 
         if "id" not in rpc:
             return
@@ -310,24 +834,60 @@ class WslinkHandler:
             return
 
         obj, func = self.functionMap[methodName]
+        upload = self.uploads.get(client_id, {}).get(rpcid)
+        if upload is not None:
+            args.insert(0, upload)
         args.insert(0, obj)
 
+        if self.metrics is not None:
+            self.metrics.rpc_calls.inc(labels=(methodName,))
+            start = time.perf_counter()
+
         try:
             self.web_app.last_active_client_id = client_id
-            results = func(*args, **kwargs)
+            if trace is not None:
+                executing = now()
+            results = self.callFunction(methodName, func, args, kwargs)
+            if inspect.isasyncgen(results):
+                results = self.streamResults(rpcid, methodName, results, client_id)
             if inspect.isawaitable(results):
+                timeout = self.rpcInfo[methodName].get("timeout")
                 with self.network_monitor:
-                    results = await results
+                    if timeout is None:
+                        results = await results
+                    else:
+                        try:
+                            results = await asyncio.wait_for(results, timeout)
+                        except asyncio.TimeoutError:
+                            if self.metrics is not None:
+                                self.metrics.rpc_errors.inc(labels=(methodName,))
+                            await self.sendWrappedError(
+                                rpcid,
+                                RPC_TIMEOUT_ERROR,
+                                "RPC timeout",
+                                {"method": methodName, "timeout": timeout},
+                                client_id=client_id,
+                            )
+                            return
+
+            if trace is not None:
+                trace.add("execute", executing)
+
+            if results is STREAMED:
+                return
 
-            if self.connections[client_id].closed:
+            connection = self.connections.get(client_id)
+            if connection is None or connection.closed:
                 # Connection was closed during RPC call.
                 return
 
             with self.network_monitor:
                 await self.sendWrappedMessage(
-                    rpcid, results, method=methodName, client_id=client_id
+                    rpcid, results, method=methodName, client_id=client_id, trace=trace
                 )
         except Exception as e_inst:
+            if self.metrics is not None:
+                self.metrics.rpc_errors.inc(labels=(methodName,))
             captured_trace = traceback.format_exc()
             logger.error("Exception raised")
             logger.error(repr(e_inst))
@@ -345,13 +905,65 @@ class WslinkHandler:
                     },
                     client_id=client_id,
                 )
+        finally:
+            if self.metrics is not None:
+                self.metrics.rpc_duration.observe(
+                    time.perf_counter() - start, (methodName,)
+                )
+
+    def callFunction(self, methodName, func, args, kwargs):
+        """Call a RPC method, or schedule it on its executor"""
+        executor = self.rpcInfo[methodName].get("executor") or self.rpc_executor
+        if (
+            executor == "loop"
+            or inspect.iscoroutinefunction(func)
+            or inspect.isasyncgenfunction(func)
+        ):
+            return func(*args, **kwargs)
+
+        if isinstance(executor, str):
+            executor = rpc_pool(executor)
+        return asyncio.get_running_loop().run_in_executor(
+            executor, functools.partial(func, *args, **kwargs)
+        )
+
+    async def streamResults(self, rpcid, methodName, generator, client_id):
+        """
+        Send each value of an async generator as soon as it is produced, in
+        messages flagged with "stream": "data", followed by a "stream": "end"
+        one. The generator only resumes once the previous value was written.
+        Clients which did not announce streams support get the list of values.
+        """
+        try:
+            if client_id not in self.streamingClients:
+                return [value async for value in generator]
+
+            async for value in generator:
+                if not await self.sendWrappedMessage(
+                    rpcid, value, method=methodName, client_id=client_id, stream="data"
+                ):
+                    # Client gone or value not serializable
+                    return STREAMED
+
+            await self.sendWrappedMessage(
+                rpcid, None, client_id=client_id, stream="end"
+            )
+            return STREAMED
+        finally:
+            await generator.aclose()
 
     def payloadWithSecretStripped(self, payload):
-        payload = copy.deepcopy(payload)
+        # Only the redacted dicts get copied, other arguments are shared
         if "args" in payload:
-            for arg in payload["args"]:
-                if type(arg) is dict and "secret" in arg:
-                    arg["secret"] = "*****"
+            payload = {
+                **payload,
+                "args": [
+                    {**arg, "secret": "*****"}
+                    if type(arg) is dict and "secret" in arg
+                    else arg
+                    for arg in payload["args"]
+                ],
+            }
         return payload
 
     async def validateToken(self, token, client_id):
@@ -374,37 +986,73 @@ class WslinkHandler:
     def isClientAuthenticated(self, client_id):
         return client_id in self.authentified_client_ids
 
-    def getAuthenticatedWebsockets(self, client_id=None, skip_last_active_client=False):
+    def getAuthenticatedClientIds(self, client_id=None, skip_last_active_client=False):
         if skip_last_active_client:
             last_c = self.web_app.last_active_client_id
             return [
-                self.connections[c]
+                c
                 for c in self.connections
                 if self.isClientAuthenticated(c) and c != last_c
             ]
 
         if client_id:
             if self.isClientAuthenticated(client_id):
-                return [self.connections.get(client_id)]
+                return [client_id]
             return []
 
+        return [c for c in self.connections if self.isClientAuthenticated(c)]
+
+    def getAuthenticatedWebsockets(self, client_id=None, skip_last_active_client=False):
         return [
-            self.connections[c]
-            for c in self.connections
-            if self.isClientAuthenticated(c)
+            self.connections.get(c)
+            for c in self.getAuthenticatedClientIds(client_id, skip_last_active_client)
         ]
 
     async def sendWrappedMessage(
-        self, rpcid, content, method="", client_id=None, skip_last_active_client=False
+        self,
+        rpcid,
+        content,
+        method="",
+        client_id=None,
+        skip_last_active_client=False,
+        topic=None,
+        stream=None,
+        trace=None,
     ):
+        """
+        Send a result to the given clients, returning False if there was
+        nobody to send it to or if it could not be serialized.
+
+        The pack and send phases get added to the trace of the RPC given,
+        publishes get their own trace.
+        """
+        client_ids = self.getAuthenticatedClientIds(client_id, skip_last_active_client)
+        if topic is not None:
+            client_ids = self.pub_manager.filterSubscribers(topic, client_ids)
+        if not client_ids:
+            return False
+
         wrapper = {
             "wslink": "1.0",
             "id": rpcid,
             "result": content,
         }
+        if stream is not None:
+            wrapper["stream"] = stream
 
+        publish_trace = None
+        if trace is None and topic is not None and self.tracer is not None:
+            trace = publish_trace = Trace("publish", topic, rpcid)
+        if trace is not None:
+            packing = now()
+
+        # Packed and chunked once, whatever the number of recipients
         try:
-            packed_wrapper = msgpack.packb(wrapper)
+            if topic is not None and self.pub_manager.isDelta(topic):
+                self.topicStates.setdefault(topic, TopicState()).update(content)
+                messages = self.packTopicState(rpcid, topic, client_ids)
+            else:
+                messages = [(self.serializer.pack(wrapper), client_ids)]
         except Exception:
             # the content which is not serializable might be arbitrarily large, don't include.
             # repr(content) would do that...
@@ -416,22 +1064,71 @@ class WslinkHandler:
                     method,
                     client_id=client_id,
                 )
-            return
+            return False
 
-        websockets = self.getAuthenticatedWebsockets(client_id, skip_last_active_client)
+        if trace is not None:
+            trace.add("pack", packing)
+            sending = now()
 
-        # aiohttp can not handle pending ws.send_bytes()
-        # tried with semaphore but got exception with >1
-        # https://github.com/aio-libs/aiohttp/issues/2934
+        priority = self.messagePriority(rpcid, topic)
         with self.network_monitor:
-            async with self.attachment_atomic:
-                for chunk in generate_chunks(packed_wrapper, MAX_MSG_SIZE):
-                    for ws in websockets:
-                        if ws is not None:
-                            await ws.send_bytes(chunk)
+            futures = [
+                future
+                for packed_wrapper, recipients in messages
+                for future in self.queuePacked(
+                    packed_wrapper, recipients, topic, priority
+                )
+            ]
+            if futures:
+                await asyncio.wait(futures)
+
+        if publish_trace is not None:
+            self.traceSent(publish_trace, sending)
+        elif trace is not None:
+            trace.add("send", sending)
 
         # Network operation completed
         self.network_monitor.network_call_completed()
+        return True
+
+    def traceSent(self, trace, sending, _future=None):
+        """Complete and record the trace of a publish"""
+        trace.add("send", sending)
+        self.tracer.record(trace)
+
+    def packTopicState(self, rpcid, topic, client_ids):
+        """
+        Pack the current value of a delta topic once per group of clients
+        holding the same version of it. Clients supporting patches get the
+        changes since their version, or the whole value along with its version
+        when they have none, the others the plain value.
+
+        Returns (packed_wrapper, client_ids) pairs.
+        """
+        state = self.topicStates[topic]
+        # base version (0 for none) => (base value, client ids), None for the
+        # clients without patch support
+        groups = {}
+        for client_id in client_ids:
+            if client_id not in self.patchingClients:
+                groups.setdefault(None, (None, []))[1].append(client_id)
+                continue
+            base, value = state.clients.get(client_id, (0, None))
+            groups.setdefault(base, (value, []))[1].append(client_id)
+            state.clients[client_id] = (state.version, state.value)
+
+        messages = []
+        for base, (value, recipients) in groups.items():
+            wrapper = {"wslink": "1.0", "id": rpcid}
+            if base:
+                wrapper["patch"] = diff(value, state.value)
+                wrapper["base"] = base
+            else:
+                wrapper["result"] = state.value
+            if base is not None:
+                wrapper["version"] = state.version
+            messages.append((self.serializer.pack(wrapper), recipients))
+        return messages
 
     async def sendWrappedError(self, rpcid, code, message, data=None, client_id=None):
         wrapper = {
@@ -446,40 +1143,188 @@ class WslinkHandler:
             wrapper["error"]["data"] = data
 
         try:
-            packed_wrapper = msgpack.packb(wrapper)
+            packed_wrapper = self.serializer.pack(wrapper)
         except Exception:
             del wrapper["error"]["data"]
-            packed_wrapper = msgpack.packb(wrapper)
+            packed_wrapper = self.serializer.pack(wrapper)
+
+        client_ids = [client_id] if client_id else list(self.connections)
 
-        websockets = (
-            [self.connections[client_id]]
-            if client_id
-            else [self.connections[c] for c in self.connections]
-        )
-        # aiohttp can not handle pending ws.send_bytes()
-        # tried with semaphore but got exception with >1
-        # https://github.com/aio-libs/aiohttp/issues/2934
         with self.network_monitor:
-            async with self.attachment_atomic:
-                for chunk in generate_chunks(packed_wrapper, MAX_MSG_SIZE):
-                    for ws in websockets:
-                        if ws is not None:
-                            await ws.send_bytes(chunk)
+            await self.sendPacked(
+                packed_wrapper, client_ids, priority=self.messagePriority(rpcid)
+            )
 
         # Network operation completed
         self.network_monitor.network_call_completed()
 
-    def publish(self, topic, data, client_id=None, skip_last_active_client=False):
-        client_list = [client_id] if client_id else list(self.connections)
-        for client in client_list:
-            if self.isClientAuthenticated(client):
-                self.pub_manager.publish(
-                    topic,
-                    data,
-                    client_id=client,
-                    skip_last_active_client=skip_last_active_client,
+    def messagePriority(self, rpcid, topic=None):
+        """Priority class of an outgoing message, lower goes out first"""
+        if topic is not None:
+            return self.pub_manager.topicPriority(topic)
+        if type(rpcid) is str and rpcid.startswith("system:"):
+            return PRIORITY_SYSTEM
+        return PRIORITY_RPC
+
+    async def sendPacked(self, packed_wrapper, client_ids, topic=None, priority=None):
+        """
+        Queue a packed message on the outbox of each client and wait until it
+        went through all of them. Each connection has its own writer, which
+        keeps the chunks of a message in order (aiohttp can not handle
+        concurrent ws.send_bytes() on the same socket, see
+        https://github.com/aio-libs/aiohttp/issues/2934) while a slow client
+        does not hold back the others.
+        """
+        futures = self.queuePacked(packed_wrapper, client_ids, topic, priority)
+        if futures:
+            # asyncio.wait() does not cancel the futures if we get cancelled
+            await asyncio.wait(futures)
+
+    def queuePacked(self, packed_wrapper, client_ids, topic=None, priority=None):
+        """
+        Queue a packed message on the outbox of each client and return the
+        futures resolved once it got sent (or discarded).
+
+        Publishes (messages with a topic) are subject to the outbox overflow
+        policy and to the topic max_pending policy, and get the priority of
+        their topic unless one is given, see PublishManager.setTopicPolicy().
+        """
+        outboxes = {c: self.outboxes[c] for c in client_ids if c in self.outboxes}
+        if not outboxes:
+            return []
+
+        if priority is None:
+            priority = self.messagePriority(None, topic)
+
+        size = sum(len(segment) for segment in packed_wrapper)
+        max_pending = None if topic is None else self.pub_manager.maxPending(topic)
+
+        # Compressed and chunked once per codec used by the recipients
+        groups = {}
+        for client_id, outbox in outboxes.items():
+            groups.setdefault(self.compressions.get(client_id), []).append(outbox)
+
+        futures = []
+        for codec, group in groups.items():
+            message, message_size = packed_wrapper, size
+            compressed = None
+            if codec is not None:
+                compressed = compress_message(
+                    codec, packed_wrapper, size, self.compression_threshold
+                )
+            if compressed is not None:
+                message, message_size = compressed, len(compressed)
+
+            # (header, memoryviews) pairs shared by the outboxes, no copy involved
+            chunks = list(
+                generate_chunk_views(message, MAX_MSG_SIZE, compressed is not None)
+            )
+            if self.metrics is not None and topic is not None:
+                self.metrics.published_messages.inc(len(group), (topic,))
+                self.metrics.published_bytes.inc(message_size * len(group), (topic,))
+            futures.extend(
+                outbox.put(
+                    chunks,
+                    message_size,
+                    topic=topic,
+                    max_pending=max_pending,
+                    droppable=topic is not None,
+                    priority=priority,
+                )
+                for outbox in group
+            )
+        return futures
+
+    def queue_depth(self, client_id=None):
+        """
+        Messages and bytes waiting to be sent to a client, or the largest
+        backlog across authenticated clients when no client_id is provided.
+        Link protocols can use it to adapt their production rate.
+        """
+        outboxes = [
+            self.outboxes[c]
+            for c in self.getAuthenticatedClientIds(client_id)
+            if c in self.outboxes
+        ]
+        return {
+            "messages": max((len(o) for o in outboxes), default=0),
+            "bytes": max((o.pending_bytes for o in outboxes), default=0),
+        }
+
+    async def publish_async(
+        self, topic, data, client_id=None, skip_last_active_client=False
+    ):
+        """
+        Awaitable publish which returns once the message is queued.
+        With the "block" overflow policy, it first waits for every recipient
+        to be back under its outbound budget.
+        """
+        client_ids = self.pub_manager.filterSubscribers(
+            topic, self.getAuthenticatedClientIds(client_id, skip_last_active_client)
+        )
+        if not client_ids:
+            return
+
+        if self.outbox_overflow == "block":
+            await asyncio.gather(
+                *[
+                    self.outboxes[c].wait_for_room()
+                    for c in client_ids
+                    if c in self.outboxes
+                ]
+            )
+
+        rpcid = f"publish:{topic}:{self.pub_manager.publishCount}"
+        if self.tracer is not None:
+            trace = Trace("publish", topic, rpcid)
+            packing = now()
+        if self.pub_manager.isDelta(topic):
+            self.topicStates.setdefault(topic, TopicState()).update(data)
+            messages = self.packTopicState(rpcid, topic, client_ids)
+        else:
+            wrapper = {"wslink": "1.0", "id": rpcid, "result": data}
+            messages = [(self.serializer.pack(wrapper), client_ids)]
+        if self.tracer is not None:
+            trace.add("pack", packing)
+            sending = now()
+        futures = [
+            future
+            for packed_wrapper, recipients in messages
+            for future in self.queuePacked(packed_wrapper, recipients, topic)
+        ]
+        if futures:
+            self.network_monitor.on_enter()
+            sent = asyncio.ensure_future(asyncio.wait(futures))
+            sent.add_done_callback(self.network_monitor.on_exit)
+            if self.tracer is not None:
+                sent.add_done_callback(
+                    functools.partial(self.traceSent, trace, sending)
                 )
 
+    def publish(self, topic, data, client_id=None, skip_last_active_client=False):
+        if self.loop is not None and not self.isLoopThread():
+            # Called from a RPC method running on a thread pool
+            self.loop.call_soon_threadsafe(
+                self.publish, topic, data, client_id, skip_last_active_client
+            )
+            return
+
+        # A single broadcast reaches every authenticated client interested in the topic
+        client_ids = self.getAuthenticatedClientIds(client_id, skip_last_active_client)
+        if self.pub_manager.filterSubscribers(topic, client_ids):
+            self.pub_manager.publish(
+                topic,
+                data,
+                client_id=client_id,
+                skip_last_active_client=skip_last_active_client,
+            )
+
+    def isLoopThread(self):
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
     def addAttachment(self, payload):
         return self.pub_manager.addAttachment(payload)
 
@@ -1,4 +1,7 @@
+import functools
+
 from . import schedule_coroutine
+from .outbox import PRIORITY_PUBLISH
 
 # =============================================================================
 # singleton publish manager
@@ -8,6 +11,18 @@ class PublishManager:
     def __init__(self):
         self.protocols = []
         self.publishCount = 0
+        # topic => set of client ids
+        self.subscriptions = {}
+        # clients that only receive the topics they subscribed to
+        self.filtered_clients = set()
+        # topic => maximum number of unsent messages per client
+        self.topic_max_pending = {}
+        # publishes waiting for their send to be scheduled
+        self.coalesced_publishes = {}
+        # topics sent as patches to the clients supporting them
+        self.delta_topics = set()
+        # topic => priority class of its messages, see Outbox
+        self.topic_priorities = {}
 
     def registerProtocol(self, protocol):
         self.protocols.append(protocol)
@@ -16,6 +31,93 @@ class PublishManager:
         if protocol in self.protocols:
             self.protocols.remove(protocol)
 
+    def enableFiltering(self, client_id):
+        """Only send to that client the topics it subscribed to"""
+        self.filtered_clients.add(client_id)
+
+    def subscribe(self, topic, client_id):
+        self.filtered_clients.add(client_id)
+        self.subscriptions.setdefault(topic, set()).add(client_id)
+
+    def unsubscribe(self, topic, client_id):
+        subscribers = self.subscriptions.get(topic)
+        if subscribers is None:
+            return
+
+        subscribers.discard(client_id)
+        if not subscribers:
+            del self.subscriptions[topic]
+
+    def releaseClient(self, client_id):
+        self.filtered_clients.discard(client_id)
+        for topic in list(self.subscriptions):
+            self.unsubscribe(topic, client_id)
+
+    def isSubscribed(self, topic, client_id):
+        """
+        Clients which never subscribed to anything keep receiving every topic
+        to remain compatible with clients that filter on their side.
+        """
+        if client_id not in self.filtered_clients:
+            return True
+        return client_id in self.subscriptions.get(topic, ())
+
+    def filterSubscribers(self, topic, client_ids):
+        return [c for c in client_ids if self.isSubscribed(topic, c)]
+
+    def setTopicPolicy(
+        self, topic, coalesce=False, max_pending=None, delta=False, priority=None
+    ):
+        """
+        Bound the number of messages of a topic waiting to be sent.
+
+        coalesce: latest value wins, same as max_pending=1
+        max_pending: maximum number of unsent messages kept for each client,
+                     older ones are replaced by the newer publishes.
+        delta: the topic publishes a structured state (nested dicts and
+               lists), clients supporting it only receive what changed since
+               the previous value they got. Each patch builds on the previous
+               one so they are never replaced in the queues, coalesce only
+               merges the publishes not sent yet.
+        priority: priority class of the messages of the topic, lower goes out
+                  first (system replies are 0, RPC replies 1, publishes 2 by
+                  default). Messages of different classes are interleaved at
+                  the chunk level, within a class they keep their order.
+
+        Calling it without any option restores the default unbounded queue.
+        """
+        if delta:
+            self.delta_topics.add(topic)
+        else:
+            self.delta_topics.discard(topic)
+
+        if priority is None:
+            self.topic_priorities.pop(topic, None)
+        else:
+            self.topic_priorities[topic] = priority
+
+        if coalesce and max_pending is None:
+            max_pending = 1
+
+        if max_pending is None:
+            self.topic_max_pending.pop(topic, None)
+        elif max_pending < 1:
+            msg = f"max_pending must be at least 1 for topic {topic}"
+            raise ValueError(msg)
+        else:
+            self.topic_max_pending[topic] = max_pending
+
+    def maxPending(self, topic):
+        if topic in self.delta_topics:
+            return None
+        return self.topic_max_pending.get(topic)
+
+    def isDelta(self, topic):
+        return topic in self.delta_topics
+
+    def topicPriority(self, topic):
+        return self.topic_priorities.get(topic, PRIORITY_PUBLISH)
+
     def addAttachment(self, payload):
         """Deprecated method, keeping it to avoid breaking compatibility
         Now that we use msgpack to pack/unpack messages,
@@ -24,21 +126,40 @@ class PublishManager:
         return payload
 
     def publish(self, topic, data, client_id=None, skip_last_active_client=False):
+        coalesce = topic in self.topic_max_pending
         for protocol in self.protocols:
             # The client is unknown - we send to any client who is subscribed to the topic
             rpcid = f"publish:{topic}:{self.publishCount}"
+            send = protocol.sendWrappedMessage
+
+            if coalesce:
+                key = (id(protocol), topic, client_id, skip_last_active_client)
+                if key in self.coalesced_publishes:
+                    # The scheduled send did not run yet, it will pick that data
+                    self.coalesced_publishes[key] = data
+                    continue
+
+                self.coalesced_publishes[key] = data
+                send = functools.partial(self._sendCoalesced, protocol, key)
+
             protocol.network_monitor.on_enter()
             schedule_coroutine(
                 0,
-                protocol.sendWrappedMessage,
+                send,
                 rpcid,
                 data,
                 client_id=client_id,
                 skip_last_active_client=skip_last_active_client,
+                topic=topic,
                 # for schedule_coroutine call
                 done_callback=protocol.network_monitor.on_exit,
             )
 
+    async def _sendCoalesced(self, protocol, key, rpcid, _data, **kwargs):
+        # Only send the latest data published for that topic
+        data = self.coalesced_publishes.pop(key)
+        await protocol.sendWrappedMessage(rpcid, data, **kwargs)
+
 
 # singleton, used by all instances of WslinkWebSocketServerProtocol
 publishManager = PublishManager()
@@ -0,0 +1,249 @@
+import importlib.util
+import struct
+import sys
+
+import msgpack
+
+# msgpack ext type of NumPy arrays, its data being
+#   - uint8 length of the dtype string, followed by the dtype string
+#     (numpy.dtype.str, e.g. "<f4")
+#   - uint8 number of dimensions, followed by the shape (uint32 each)
+#   - the content of the array, in C order
+# all integers being little-endian.
+NDARRAY_EXT_TYPE = 1
+# Without NumPy, arrays received are left as msgpack.ExtType
+HAS_NUMPY = importlib.util.find_spec("numpy") is not None
+
+_EXT32 = struct.Struct(">BIb")
+
+# Fixed size msgpack types handled by unpack_binary_views: format byte -> struct
+_FIXED_FORMATS = {
+    0xCA: struct.Struct(">f"),
+    0xCB: struct.Struct(">d"),
+    0xCC: struct.Struct(">B"),
+    0xCD: struct.Struct(">H"),
+    0xCE: struct.Struct(">I"),
+    0xCF: struct.Struct(">Q"),
+    0xD0: struct.Struct(">b"),
+    0xD1: struct.Struct(">h"),
+    0xD2: struct.Struct(">i"),
+    0xD3: struct.Struct(">q"),
+}
+# Variable size msgpack types: format byte -> (kind, length struct)
+_SIZED_FORMATS = {
+    0xC4: ("bin", struct.Struct(">B")),
+    0xC5: ("bin", struct.Struct(">H")),
+    0xC6: ("bin", struct.Struct(">I")),
+    0xC7: ("ext", struct.Struct(">B")),
+    0xC8: ("ext", struct.Struct(">H")),
+    0xC9: ("ext", struct.Struct(">I")),
+    0xD9: ("str", struct.Struct(">B")),
+    0xDA: ("str", struct.Struct(">H")),
+    0xDB: ("str", struct.Struct(">I")),
+    0xDC: ("array", struct.Struct(">H")),
+    0xDD: ("array", struct.Struct(">I")),
+    0xDE: ("map", struct.Struct(">H")),
+    0xDF: ("map", struct.Struct(">I")),
+}
+_CONSTANTS = {0xC0: None, 0xC2: False, 0xC3: True}
+_FIXEXT_SIZES = {0xD4: 1, 0xD5: 2, 0xD6: 4, 0xD7: 8, 0xD8: 16}
+# Nesting of arrays and maps accepted by unpack_binary_views, well below the
+# Python recursion limit
+MAX_DEPTH = 512
+
+
+def _check_size(view, offset, size):
+    if offset + size > len(view):
+        msg = "Truncated msgpack payload"
+        raise ValueError(msg)
+
+
+def _unpack_view(view, offset, ext_hook, depth=0):
+    _check_size(view, offset, 1)
+    byte = view[offset]
+    offset += 1
+
+    if byte <= 0x7F:
+        return byte, offset
+    if byte >= 0xE0:
+        return byte - 0x100, offset
+    if byte <= 0x8F:
+        kind, size = "map", byte & 0x0F
+    elif byte <= 0x9F:
+        kind, size = "array", byte & 0x0F
+    elif byte <= 0xBF:
+        kind, size = "str", byte & 0x1F
+    elif byte in _CONSTANTS:
+        return _CONSTANTS[byte], offset
+    elif byte in _FIXED_FORMATS:
+        fmt = _FIXED_FORMATS[byte]
+        _check_size(view, offset, fmt.size)
+        return fmt.unpack_from(view, offset)[0], offset + fmt.size
+    elif byte in _FIXEXT_SIZES:
+        kind, size = "ext", _FIXEXT_SIZES[byte]
+    elif byte in _SIZED_FORMATS:
+        kind, fmt = _SIZED_FORMATS[byte]
+        _check_size(view, offset, fmt.size)
+        size = fmt.unpack_from(view, offset)[0]
+        offset += fmt.size
+    else:
+        msg = f"Invalid msgpack format byte 0x{byte:02x} at offset {offset - 1}"
+        raise ValueError(msg)
+
+    if kind in ("array", "map") and depth >= MAX_DEPTH:
+        msg = f"msgpack payload nested deeper than {MAX_DEPTH} levels"
+        raise ValueError(msg)
+    if kind == "array":
+        items = []
+        for _ in range(size):
+            item, offset = _unpack_view(view, offset, ext_hook, depth + 1)
+            items.append(item)
+        return items, offset
+    if kind == "map":
+        items = {}
+        for _ in range(size):
+            key, offset = _unpack_view(view, offset, ext_hook, depth + 1)
+            value, offset = _unpack_view(view, offset, ext_hook, depth + 1)
+            if isinstance(key, memoryview):
+                key = bytes(key)
+            elif not isinstance(key, str):
+                # Same restriction as msgpack (strict_map_key)
+                msg = f"{type(key).__name__} is not allowed for map key"
+                raise ValueError(msg)
+            items[key] = value
+        return items, offset
+    if kind == "ext":
+        _check_size(view, offset, 1 + size)
+        code = struct.unpack_from(">b", view, offset)[0]
+        offset += 1
+        return ext_hook(code, view[offset : offset + size]), offset + size
+
+    _check_size(view, offset, size)
+    data = view[offset : offset + size]
+    if kind == "str":
+        return str(data, "utf-8"), offset + size
+    return data, offset + size
+
+
+def default_ext_hook(code, data):
+    if code == -1:
+        return msgpack.Timestamp.from_bytes(bytes(data))
+    return msgpack.ExtType(code, bytes(data))
+
+
+def unpack_binary_views(buffer, ext_hook=default_ext_hook):
+    """
+    Equivalent of msgpack.unpackb() where bin fields are returned as
+    memoryviews into buffer instead of bytes copies. Those views keep the
+    whole buffer alive for as long as they are referenced.
+    ext_hook(code, data) gets the data of ext fields as a memoryview too.
+    """
+    view = memoryview(buffer)
+    result, offset = _unpack_view(view, 0, ext_hook)
+    if offset != len(view):
+        msg = f"Unexpected data after the msgpack payload ({len(view) - offset} bytes)"
+        raise ValueError(msg)
+    return result
+
+
+def pack_ndarray_header(array):
+    dtype = array.dtype.str.encode("ascii")
+    return struct.pack(
+        f"<B{len(dtype)}sB{array.ndim}I", len(dtype), dtype, array.ndim, *array.shape
+    )
+
+
+def unpack_ndarray(data):
+    """Return a NumPy array sharing the memory of data (read-only if data is)"""
+    import numpy as np  # noqa:  PLC0415
+
+    view = memoryview(data)
+    dtype_length = view[0]
+    dtype = str(view[1 : 1 + dtype_length], "ascii")
+    ndim = view[1 + dtype_length]
+    offset = 2 + dtype_length
+    shape = struct.unpack_from(f"<{ndim}I", view, offset)
+    offset += 4 * ndim
+    return np.frombuffer(view[offset:], dtype=dtype).reshape(shape)
+
+
+# Turns messages into bytes and back: msgpack, extended with NumPy arrays.
+#
+# Arrays are packed from their own memory: pack() returns the message as a
+# list of segments, the arrays content being among them as is, so they only
+# get copied once the chunks get written to the socket. On the receiving
+# end, they come back as numpy.frombuffer() views on the received data.
+#
+# Subclasses can support more types by overriding default() (packing) and
+# ext_hook() (unpacking), the way msgpack itself is extended.
+class Serializer:
+    def default(self, obj):
+        """Convert an object msgpack does not know into one it does"""
+        np = sys.modules.get("numpy")
+        if np is not None and isinstance(obj, np.generic):
+            return obj.item()
+
+        msg = f"Can not serialize {type(obj).__name__} object"
+        raise TypeError(msg)
+
+    def ext_hook(self, code, data):
+        """Decode the data of a msgpack ext field"""
+        if code == NDARRAY_EXT_TYPE and HAS_NUMPY:
+            return unpack_ndarray(data)
+        return default_ext_hook(code, data)
+
+    def pack(self, content):
+        """Pack content, returning the list of buffers forming the message"""
+        arrays = []
+        packer = None
+
+        def default(obj):
+            np = sys.modules.get("numpy")
+            if np is None or not isinstance(obj, np.ndarray):
+                return self.default(obj)
+
+            if not obj.flags.c_contiguous:
+                obj = obj.copy(order="C")
+            # Bytes view on the array memory, whatever its dtype
+            content = memoryview(obj.reshape(-1).view(np.uint8))
+
+            # Only the header goes through msgpack, the content gets
+            # inserted at the same position afterwards
+            header = pack_ndarray_header(obj)
+            placeholder = msgpack.ExtType(NDARRAY_EXT_TYPE, header)
+            with packer.getbuffer() as buffer:
+                position = len(buffer)
+            arrays.append((position, len(msgpack.packb(placeholder)), header, content))
+            return placeholder
+
+        packer = msgpack.Packer(autoreset=False, default=default)
+        packer.pack(content)
+        packed = packer.getbuffer()
+        if not arrays:
+            return [packed]
+
+        segments = []
+        offset = 0
+        for position, placeholder_size, header, array_content in arrays:
+            segments.append(packed[offset:position])
+            segments.append(
+                _EXT32.pack(0xC9, len(header) + len(array_content), NDARRAY_EXT_TYPE)
+                + header
+            )
+            segments.append(array_content)
+            offset = position + placeholder_size
+        segments.append(packed[offset:])
+        return segments
+
+    def unpack(self, buffer, binary_views=False):
+        """
+        Unpack a whole message. With binary_views, bin fields and arrays
+        share the memory of buffer instead of being copied.
+        """
+        if binary_views:
+            return unpack_binary_views(buffer, self.ext_hook)
+        return msgpack.unpackb(buffer, ext_hook=self.ext_hook)
+
+    def unpacker(self, max_buffer_size=0):
+        """Streaming unpacker fed with the chunks of a message"""
+        return msgpack.Unpacker(max_buffer_size=max_buffer_size, ext_hook=self.ext_hook)
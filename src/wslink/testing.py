@@ -0,0 +1,227 @@
+import asyncio
+import contextlib
+import os
+import time
+
+import aiohttp
+import msgpack
+
+from wslink.backends.aiohttp import create_webserver
+from wslink.chunking import UnChunker, generate_chunks
+from wslink.compression import CODECS
+
+# Minimal wslink clients, speaking the protocol of the JavaScript client, and
+# an aiohttp server on a free local port, shared by the tests and benchmarks.
+
+
+class Message:
+    """Binary message handed to a generic backend connection"""
+
+    def __init__(self, data):
+        self.data = data
+
+
+class Client:
+    """
+    wslink client talking to a generic backend endpoint in-process. The
+    publishes received are counted and, unless keep_publications is False,
+    kept in publications.
+    """
+
+    def __init__(self, endpoint, secret, delay=0, keep_publications=True):
+        self.endpoint = endpoint
+        self.secret = secret
+        # Seconds waited before handling each chunk, to mimic a slow client
+        self.delay = delay
+        self.keep_publications = keep_publications
+        self.connection = None
+        self.unchunker = UnChunker()
+        self.unchunker.set_max_message_size(4 * 1024 * 1024 * 1024)
+        self.pending = {}
+        self.publications = []
+        self.publish_count = 0
+        # (count, future) resolved once that many publishes were received
+        self.publish_waiter = None
+        self.streamed = {}
+        self.received_bytes = 0
+        self.msg_count = 0
+        # Size of the chunks sent, given by the server in its hello reply
+        self.max_msg_size = 0
+
+    @property
+    def client_id(self):
+        return self.connection.client_id
+
+    async def connect(self, secret=None, **capabilities):
+        self.connection = await self.endpoint.connect()
+        self.connection.on_message(self._on_message)
+        return await self.hello(secret, **capabilities)
+
+    async def hello(self, secret=None, **capabilities):
+        if secret is None:
+            secret = self.secret
+        reply = await self.call(
+            "wslink.hello", [{"secret": secret, **capabilities}], rpc_id="system:c0:0"
+        )
+        result = reply.get("result", {})
+        self.max_msg_size = result.get("maxMsgSize", 0)
+        self.unchunker.compression = CODECS.get(result.get("compression"))
+        return reply
+
+    async def close(self):
+        await self.endpoint.disconnect(self.connection)
+
+    def send_chunk(self, chunk):
+        return self.connection.send(True, Message(chunk))
+
+    async def _on_message(self, _is_binary, data):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+        self.received_bytes += len(data)
+        message = self.unchunker.process_chunk(data)
+        if message is None:
+            return
+
+        if message["id"].startswith("publish:"):
+            self.publish_count += 1
+            if self.keep_publications:
+                self.publications.append(message)
+            if self.publish_waiter and self.publish_count >= self.publish_waiter[0]:
+                self.publish_waiter[1].set_result(None)
+                self.publish_waiter = None
+        elif message.get("stream") == "data":
+            self.streamed.setdefault(message["id"], []).append(message["result"])
+        elif message["id"] in self.pending:
+            self.pending.pop(message["id"]).set_result(message)
+
+    async def send(self, payload):
+        for chunk in generate_chunks(msgpack.packb(payload), self.max_msg_size):
+            await self.send_chunk(chunk)
+
+    async def request(self, method, args=None, kwargs=None, rpc_id=None, **extra):
+        """Send a RPC and return the future of its reply"""
+        if rpc_id is None:
+            rpc_id = f"rpc:{self.client_id}:{self.msg_count}"
+            self.msg_count += 1
+
+        future = asyncio.get_running_loop().create_future()
+        future.rpc_id = rpc_id
+        self.pending[rpc_id] = future
+        await self.send(
+            {
+                "wslink": "1.0",
+                "id": rpc_id,
+                "method": method,
+                "args": args or [],
+                "kwargs": kwargs or {},
+                **extra,
+            }
+        )
+        return future
+
+    async def upload(self, method, chunks, args=None):
+        """Start an upload RPC, send its data and return the future of its reply"""
+        future = await self.request(method, args, upload="start")
+        for chunk in chunks:
+            await self.send(
+                {"wslink": "1.0", "id": future.rpc_id, "upload": "data", "data": chunk}
+            )
+        await self.send({"wslink": "1.0", "id": future.rpc_id, "upload": "end"})
+        return future
+
+    async def call(self, method, args=None, kwargs=None, rpc_id=None):
+        return await (await self.request(method, args, kwargs, rpc_id))
+
+    async def timed_call(self, method, args=None):
+        """Seconds taken by a RPC round trip"""
+        start = time.perf_counter()
+        await self.call(method, args)
+        return time.perf_counter() - start
+
+    def wait_publishes(self, count):
+        """Future resolved once count publishes were received in total"""
+        future = asyncio.get_running_loop().create_future()
+        if self.publish_count >= count:
+            future.set_result(None)
+        else:
+            self.publish_waiter = (count, future)
+        return future
+
+
+class AiohttpClient(Client):
+    """wslink client connected to a server through an actual websocket"""
+
+    def __init__(self, url, secret, delay=0, keep_publications=True):
+        super().__init__(None, secret, delay, keep_publications)
+        self.url = url
+        self.session = None
+        self.ws = None
+        self._client_id = None
+        self._reader = None
+
+    @property
+    def client_id(self):
+        return self._client_id
+
+    async def connect(self, secret=None, **capabilities):
+        self.session = aiohttp.ClientSession()
+        self.ws = await self.session.ws_connect(self.url, max_msg_size=0)
+        self._reader = asyncio.ensure_future(self._read())
+        return await self.hello(secret, **capabilities)
+
+    async def hello(self, secret=None, **capabilities):
+        reply = await super().hello(secret, **capabilities)
+        self._client_id = reply.get("result", {}).get("clientID")
+        return reply
+
+    async def _read(self):
+        async for msg in self.ws:
+            if msg.type == aiohttp.WSMsgType.BINARY:
+                await self._on_message(True, msg.data)
+
+        # Fail the calls instead of waiting forever
+        for future in self.pending.values():
+            future.set_exception(ConnectionError(f"{self.url} closed"))
+        self.pending.clear()
+
+    async def close(self):
+        await self.ws.close()
+        await self._reader
+        await self.session.close()
+
+    def send_chunk(self, chunk):
+        return self.ws.send_bytes(chunk)
+
+
+@contextlib.asynccontextmanager
+async def aiohttp_server(protocol):
+    """
+    Yield an aiohttp server of the given server protocol on a free local port
+    and its websocket url
+    """
+    # Keep the ready message out of the output
+    ready_msg = os.environ.get("WSLINK_READY_MSG")
+    os.environ["WSLINK_READY_MSG"] = ""
+    try:
+        server = create_webserver(
+            {
+                "host": "127.0.0.1",
+                "port": 0,
+                "handle_signals": False,
+                "ws": {"ws": protocol},
+            }
+        )
+        started = asyncio.get_running_loop().create_future()
+        task = asyncio.ensure_future(server.start(started.set_result))
+        port = await started
+        try:
+            yield server, f"ws://127.0.0.1:{port}/ws"
+        finally:
+            await server.stop()
+            await task
+    finally:
+        if ready_msg is None:
+            del os.environ["WSLINK_READY_MSG"]
+        else:
+            os.environ["WSLINK_READY_MSG"] = ready_msg
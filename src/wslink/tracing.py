@@ -0,0 +1,107 @@
+import logging
+import time
+
+# Timing breakdown of the RPCs and publishes going through a websocket
+# handler, handed to a tracer once complete. Phases of a RPC:
+#   - receive: from its first chunk until its last one arrives
+#   - unpack: processing of the last chunk, which completes the reassembly
+#     and unpacks the message
+#   - queue: waiting for the dispatcher (RPC concurrency of the client)
+#   - execute: the method itself, executor included
+#   - pack: serialization of the reply
+#   - send: from the reply being queued in the outbox until it is written to
+#     the socket, behind the other messages of the connection
+# Publishes only have the pack and send phases, the latter ending once the
+# message went out to every recipient.
+#
+# Tracers implement record(trace), called on the event loop. Nothing is
+# measured when the handler has no tracer.
+
+logger = logging.getLogger(__name__)
+
+
+def now():
+    """Timestamp of the phases, in nanoseconds since the epoch"""
+    return time.time_ns()
+
+
+class Trace:
+    __slots__ = ("id", "kind", "name", "phases")
+
+    def __init__(self, kind, name, id):
+        # "rpc" or "publish"
+        self.kind = kind
+        # method or topic
+        self.name = name
+        self.id = id
+        # (phase, start, end)
+        self.phases = []
+
+    def add(self, phase, start, end=None):
+        self.phases.append((phase, start, now() if end is None else end))
+
+    @property
+    def start(self):
+        return min(start for _, start, _ in self.phases)
+
+    @property
+    def end(self):
+        return max(end for _, _, end in self.phases)
+
+
+class LoggingTracer:
+    """Log the breakdown of each trace on a single line"""
+
+    def __init__(self, logger=logger, level=logging.DEBUG):
+        self.logger = logger
+        self.level = level
+
+    def record(self, trace):
+        if not trace.phases or not self.logger.isEnabledFor(self.level):
+            return
+        phases = " ".join(
+            f"{phase}={(end - start) / 1e6:.3f}ms" for phase, start, end in trace.phases
+        )
+        self.logger.log(
+            self.level,
+            "%s %s %s %.3fms: %s",
+            trace.kind,
+            trace.name,
+            trace.id,
+            (trace.end - trace.start) / 1e6,
+            phases,
+        )
+
+
+class OpenTelemetryTracer:
+    """
+    Turn each trace into an OpenTelemetry span (wslink.rpc or wslink.publish)
+    with a child span per phase. Uses the tracer given or the one of the
+    global tracer provider, requires opentelemetry-api.
+    """
+
+    def __init__(self, tracer=None):
+        from opentelemetry import trace  # noqa: PLC0415
+
+        self._trace = trace
+        self.tracer = tracer or trace.get_tracer("wslink")
+
+    def record(self, trace):
+        if not trace.phases:
+            return
+
+        key = "wslink.method" if trace.kind == "rpc" else "wslink.topic"
+        attributes = {key: trace.name, "wslink.id": trace.id}
+        span = self.tracer.start_span(
+            f"wslink.{trace.kind}", start_time=trace.start, attributes=attributes
+        )
+        context = self._trace.set_span_in_context(span)
+        for phase, start, end in trace.phases:
+            self.tracer.start_span(
+                f"wslink.{phase}", context=context, start_time=start
+            ).end(end_time=end)
+        span.end(end_time=trace.end)
+
+
+# Ready-made tracers, selected by WSLINK_TRACER
+TRACERS = {"log": LoggingTracer, "opentelemetry": OpenTelemetryTracer}
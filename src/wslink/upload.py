@@ -0,0 +1,58 @@
+import asyncio
+from collections import deque
+
+
+# Async iterator over the data of a streamed upload, handed to the RPC method
+# registered with upload=True while the client keeps sending it.
+#
+# At most max_chunks received chunks wait to be consumed: put() then waits,
+# which stops the reading of the connection until the method catches up, so
+# an upload of any size only holds a few chunks in memory.
+class Upload:
+    def __init__(self, max_chunks=8):
+        self.max_chunks = max_chunks
+        self.chunks = deque()
+        self.size = 0
+        self.finished = False
+        self.closed = False
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.chunks:
+            if self.finished or self.closed:
+                raise StopAsyncIteration
+            self._readable.clear()
+            await self._readable.wait()
+
+        chunk = self.chunks.popleft()
+        self._writable.set()
+        return chunk
+
+    async def put(self, chunk):
+        """Queue a received chunk, waiting while too many are pending"""
+        while not self.closed and len(self.chunks) >= self.max_chunks:
+            self._writable.clear()
+            await self._writable.wait()
+        if self.closed:
+            return
+
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        self._readable.set()
+
+    def finish(self):
+        """The client sent everything, iteration stops after the last chunk"""
+        self.finished = True
+        self._readable.set()
+
+    def close(self):
+        """Nobody consumes the upload anymore, discard what comes next"""
+        self.closed = True
+        self.chunks.clear()
+        self._readable.set()
+        self._writable.set()
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+
+def running_method(frame):
+    """Name of the RPC method being executed in the stack of frame, if any"""
+    while frame is not None:
+        if frame.f_code.co_name == "onCompleteMessage":
+            return frame.f_locals.get("methodName")
+        frame = frame.f_back
+    return None
+
+
+# Event loop lag detector.
+#
+# A task on the loop wakes up every interval and measures how late it is: past
+# the threshold, report() gets called (on the loop) with a description of the
+# stall. As the loop can stay blocked for long, a thread also checks that task
+# keeps running and, once it is late by more than the threshold, logs right
+# away the RPC method being executed along with the stack of the loop thread,
+# which then gets included in the report.
+class Watchdog:
+    def __init__(self, threshold, report, interval=None):
+        self.threshold = threshold
+        self.interval = interval or threshold / 4
+        self.report = report
+        # lag of the last wake up, and the largest one seen
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self._beat = time.monotonic()
+        # (method, stack) of the loop thread during the current stall
+        self._sample = None
+        self._loop_thread = threading.get_ident()
+        self._stopped = threading.Event()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(
+            target=self._watch, name="wslink-watchdog", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._task.cancel()
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            self._beat = time.monotonic()
+            self.lag = max(self._beat - expected, 0)
+            self.max_lag = max(self.max_lag, self.lag)
+
+            sample, self._sample = self._sample, None
+            if self.lag < self.threshold:
+                continue
+
+            message = f"Event loop blocked for {self.lag:.3f}s"
+            if sample is None:
+                logger.warning(message)
+            else:
+                method, stack = sample
+                if method is not None:
+                    message += f" while running {method}"
+                message += f"\n{stack}"
+            self.report(message)
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            late = time.monotonic() - self._beat - self.interval
+            if self._sample is not None or late < self.threshold:
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            method = running_method(frame)
+            stack = "".join(traceback.format_stack(frame))
+            self._sample = (method, stack)
+            del frame
+            logger.warning(
+                "Event loop blocked for more than %.3fs (running %s):\n%s",
+                late,
+                method,
+                stack,
+            )
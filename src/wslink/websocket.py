@@ -10,6 +10,7 @@ from contextlib import suppress
 
 from wslink import register as exportRpc
 from wslink import schedule_callback
+from wslink.core import rpc_methods
 from wslink.emitter import EventEmitter
 
 logger = logging.getLogger(__name__)
@@ -25,23 +26,55 @@ logger = logging.getLogger(__name__)
 def noop(*_, **__): ...
 
 
+async def async_noop(*_, **__): ...
+
+
+# Attributes connecting a protocol to its server. They are not sent to the
+# worker processes running methods registered with executor="process".
+SERVER_ATTRIBUTES = (
+    "publish",
+    "addAttachment",
+    "stopServer",
+    "coreServer",
+    "publishManager",
+    "publish_async",
+    "queue_depth",
+)
+
+
 class LinkProtocol:
     """
     Subclass this to communicate with wslink clients. LinkProtocol
     objects provide rpc and pub/sub actions.
     """
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Record the registered methods once, when the class gets defined
+        rpc_methods(cls)
+
     def __init__(self):
         # need a no-op in case they are called before connect.
         self.publish = noop
         self.addAttachment = noop
         self.coreServer = None
+        # Set once attached to a websocket endpoint (e.g. to call setTopicPolicy)
+        self.publishManager = None
+        self.publish_async = async_noop
+        self.queue_depth = lambda *_: {"messages": 0, "bytes": 0}
 
     def init(self, publish, addAttachment, stopServer):
         self.publish = publish
         self.addAttachment = addAttachment
         self.stopServer = stopServer
 
+    def __getstate__(self):
+        return {k: v for k, v in self.__dict__.items() if k not in SERVER_ATTRIBUTES}
+
+    def __setstate__(self, state):
+        LinkProtocol.__init__(self)
+        self.__dict__.update(state)
+
     def getSharedObject(self, key):
         if self.coreServer:
             return self.coreServer.getSharedObject(key)
@@ -147,12 +180,58 @@ class ServerProtocol:
     objects that provide rpc and publish functionality.
     """
 
+    # Per endpoint settings, None means using the environment default
+    # (WSLINK_OUTBOX_MAX_BYTES, WSLINK_OUTBOX_MAX_MESSAGES, WSLINK_OUTBOX_OVERFLOW,
+    # WSLINK_BINARY_VIEWS, WSLINK_UNCHUNKER, WSLINK_MAX_PENDING_BYTES,
+    # WSLINK_MAX_PENDING_MESSAGES, WSLINK_PENDING_TIMEOUT, WSLINK_RPC_EXECUTOR,
+    # WSLINK_RPC_CONCURRENCY, WSLINK_RPC_QUEUE, WSLINK_UPLOAD_QUEUE,
+    # WSLINK_COMPRESSION, WSLINK_COMPRESSION_THRESHOLD, WSLINK_METRICS,
+    # WSLINK_TRACER, WSLINK_ADMIN_SECRET)
+    outbox_max_bytes = None
+    outbox_max_messages = None
+    outbox_overflow = None
+    # Receive bin fields as memoryviews into the incoming message buffer
+    binary_views = None
+    # Reassembly of incoming messages: "stream" or "buffered"
+    unchunker = None
+    # Limits on partial incoming messages, per client
+    max_pending_bytes = None
+    max_pending_messages = None
+    pending_timeout = None
+    # Where synchronous RPC methods run without an executor given to register()
+    rpc_executor = None
+    # RPCs of a client processed at the same time, see register(ordered=True)
+    rpc_concurrency = None
+    # RPCs of a client waiting for their turn before its connection stops being read
+    rpc_queue = None
+    # Received chunks of an upload waiting to be consumed before the
+    # connection stops being read
+    upload_queue = None
+    # wslink.serializer.Serializer (or subclass) instance packing the messages
+    serializer = None
+    # Codecs offered to the clients by order of preference, e.g. ["deflate"]
+    compression = None
+    # Size in bytes under which messages are sent uncompressed
+    compression_threshold = None
+    # Feed wslink.metrics.registry
+    metrics = None
+    # Name of a ready-made tracer ("log", "opentelemetry") or object with a
+    # record(trace) method, see wslink.tracing
+    tracer = None
+    # Secret of the admin system messages (wslink.profile.*)
+    admin_secret = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        rpc_methods(cls)
+
     def __init__(self):
         self.network_monitor = NetworkMonitor()
         self.log_emitter = EventEmitter(
             allowed_events=["exception", "error", "critical", "info", "debug"]
         )
         self.linkProtocols = []
+        self.linkProtocolListeners = set()
         self.secret = None
         self.initialize()
 
@@ -184,10 +263,10 @@ class ServerProtocol:
         assert isinstance(protocol, LinkProtocol)
         protocol.coreServer = self
         self.linkProtocols.append(protocol)
+        self.notifyLinkProtocolListeners()
 
-    # Note: this can only be used _before_ a connection is made -
-    # otherwise the WslinkWebSocketServerProtocol will already have stored references to
-    # the RPC methods in the protocol.
+    # Protocols can be registered and unregistered at any time, the endpoints
+    # serving this ServerProtocol update their RPC dispatch table right away.
     def unregisterLinkProtocol(self, protocol):
         assert isinstance(protocol, LinkProtocol)
         protocol.coreServer = None
@@ -197,6 +276,19 @@ class ServerProtocol:
             error_message = "Link protocol missing from registered list."
             logger.error(error_message)
             self.log_emitter("error", error_message)
+            return
+        self.notifyLinkProtocolListeners()
+
+    def addLinkProtocolListener(self, listener):
+        """Call listener() whenever the list of link protocols changes"""
+        self.linkProtocolListeners.add(listener)
+
+    def removeLinkProtocolListener(self, listener):
+        self.linkProtocolListeners.discard(listener)
+
+    def notifyLinkProtocolListeners(self):
+        for listener in list(self.linkProtocolListeners):
+            listener()
 
     def getLinkProtocols(self):
         return self.linkProtocols
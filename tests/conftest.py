@@ -0,0 +1,95 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from wslink import register, testing
+from wslink.backends.generic.core import GenericServer
+from wslink.websocket import LinkProtocol, ServerProtocol
+
+SECRET = "wslink-test-secret"
+
+
+class EchoProtocol(LinkProtocol):
+    @register("test.echo")
+    def echo(self, value):
+        return value
+
+    @register("test.sleep")
+    async def sleep(self, duration):
+        await asyncio.sleep(duration)
+        return duration
+
+    @register("test.stream")
+    async def stream(self, count):
+        for i in range(count):
+            yield i
+
+    @register("test.upload", upload=True)
+    async def upload(self, chunks, limit=None):
+        sizes = []
+        async for chunk in chunks:
+            sizes.append(len(chunk))
+            if len(sizes) == limit:
+                break
+        return sizes
+
+    @register("test.timeout", timeout=0.05)
+    async def timeout(self, duration):
+        await asyncio.sleep(duration)
+
+    @register("test.ordered", ordered=True)
+    def ordered(self):
+        return "ordered"
+
+    @register("test.ordered_fail", ordered=True)
+    def ordered_fail(self):
+        msg = "ordered failure"
+        raise RuntimeError(msg)
+
+    @register("test.freeze")
+    def freeze(self, duration):
+        # Blocks the event loop
+        time.sleep(duration)
+        return duration
+
+    @register("test.block", executor="thread")
+    def block(self, duration):
+        time.sleep(duration)
+        self.publish("test.blocked", duration)
+        return threading.current_thread().name
+
+    @register("test.pid", executor="process")
+    def pid(self):
+        return os.getpid()
+
+
+class EchoServerProtocol(ServerProtocol):
+    def initialize(self):
+        self.updateSecret(SECRET)
+        self.registerLinkProtocol(EchoProtocol())
+
+
+class Client(testing.Client):
+    """Client of the test secret"""
+
+    def __init__(self, endpoint, delay=0):
+        super().__init__(endpoint, SECRET, delay)
+
+
+@pytest.fixture
+def endpoint():
+    server = GenericServer({"ws": {"ws": EchoServerProtocol()}})
+    return server["ws"]
+
+
+@pytest.fixture
+def connect(endpoint):
+    async def _connect(delay=0, **capabilities):
+        client = Client(endpoint, delay)
+        await client.connect(**capabilities)
+        return client
+
+    return _connect
@@ -0,0 +1,178 @@
+import msgpack
+import pytest
+
+from wslink.chunking import (
+    HEADER_LENGTH,
+    StreamUnChunker,
+    UnChunker,
+    generate_chunk_views,
+    generate_chunks,
+)
+from wslink.serializer import unpack_binary_views
+
+
+def test_chunk_views_do_not_copy():
+    message = bytes(range(256)) * 10
+    views = list(generate_chunk_views(message, 100))
+
+    assert len(views) == len(message) // (100 - HEADER_LENGTH) + 1
+    assert b"".join(bytes(content) for _, content in views) == message
+    for header, content in views:
+        assert len(header) == HEADER_LENGTH
+        assert content.obj is message
+
+
+@pytest.mark.parametrize("unchunker_class", [UnChunker, StreamUnChunker])
+@pytest.mark.parametrize("max_size", [0, 64, 1024])
+def test_round_trip(unchunker_class, max_size):
+    payload = {"id": "rpc:c0:1", "args": [b"\x00" * 1000, "text", 3.5]}
+    unchunker = unchunker_class()
+    unchunker.set_max_message_size(1024 * 1024)
+
+    results = [
+        unchunker.process_chunk(chunk)
+        for chunk in generate_chunks(msgpack.packb(payload), max_size)
+    ]
+
+    assert results[-1] == payload
+    assert all(r is None for r in results[:-1])
+    assert unchunker.pending_messages == {}
+
+
+@pytest.mark.parametrize("unchunker_class", [UnChunker, StreamUnChunker])
+def test_single_chunk_fast_path(unchunker_class):
+    packed = msgpack.packb({"id": "rpc:c0:2", "result": "ok"})
+    chunks = list(generate_chunks(packed, 1024))
+    first, second = (next(generate_chunks(packed, 0)) for _ in range(2))
+    unchunker = unchunker_class()
+
+    assert len(chunks) == 1
+    assert len(chunks[0]) == HEADER_LENGTH + len(packed)
+    assert first[:4] != second[:4]
+    assert unchunker.process_chunk(chunks[0]) == {"id": "rpc:c0:2", "result": "ok"}
+    assert unchunker.pending_messages == {}
+
+
+@pytest.mark.parametrize("unchunker_class", [UnChunker, StreamUnChunker])
+def test_single_chunk_during_multi_chunk_message(unchunker_class):
+    large = msgpack.packb("x" * 100)
+    small = msgpack.packb("y")
+    unchunker = unchunker_class()
+    first, *rest = generate_chunks(large, 64)
+    single = next(generate_chunks(small, 0))
+
+    assert first[:4] != single[:4]
+    assert unchunker.process_chunk(first) is None
+    assert unchunker.process_chunk(single) == "y"
+    assert [unchunker.process_chunk(chunk) for chunk in rest][-1] == "x" * 100
+
+
+def test_single_chunk_size_limit():
+    unchunker = UnChunker()
+    unchunker.set_max_message_size(16)
+
+    with pytest.raises(ValueError):
+        unchunker.process_chunk(next(generate_chunks(msgpack.packb("x" * 32), 0)))
+
+
+def test_unpack_binary_views_matches_msgpack():
+    payload = {
+        "id": "rpc:c0:3",
+        "args": [None, True, False, -1, -200, 2**40, 1.5, "é" * 40, [1, [2]]],
+        "kwargs": {"ext": msgpack.ExtType(5, b"abc"), "big": list(range(70000))},
+        "text": "x" * 70000,
+    }
+    packed = msgpack.packb(payload)
+
+    assert unpack_binary_views(packed) == msgpack.unpackb(packed)
+
+
+def test_unpack_binary_views_malformed():
+    packed = msgpack.packb({"id": "rpc:c0:3", "args": [1.5, 2**40, b"x" * 300]})
+    for size in range(len(packed)):
+        with pytest.raises(ValueError):
+            unpack_binary_views(packed[:size])
+
+    nested = b"\x91" * 10000 + b"\xc0"
+    with pytest.raises(ValueError):
+        msgpack.unpackb(nested)
+    with pytest.raises(ValueError):
+        unpack_binary_views(nested)
+
+    with pytest.raises(ValueError):
+        unpack_binary_views(msgpack.packb({1: 2}, strict_types=False))
+
+
+@pytest.mark.parametrize("max_size", [0, 64])
+def test_binary_views_point_into_reassembly_buffer(max_size):
+    data = bytes(range(256)) * 4
+    unchunker = UnChunker(binary_views=True)
+    unchunker.set_max_message_size(1024 * 1024)
+
+    for chunk in generate_chunks(
+        msgpack.packb({"args": [data, {b"key": data}]}), max_size
+    ):
+        message = unchunker.process_chunk(chunk)
+
+    view, nested = message["args"]
+    assert isinstance(view, memoryview)
+    assert view == data
+    assert nested[b"key"].obj is view.obj
+
+
+def partial_chunks(size, max_size=64):
+    return list(generate_chunks(msgpack.packb(b"x" * size), max_size))
+
+
+def test_stream_pre_auth_size_limit():
+    unchunker = StreamUnChunker()
+
+    with pytest.raises(ValueError):
+        unchunker.process_chunk(partial_chunks(1024)[0])
+    assert unchunker.pending_messages == {}
+
+
+def test_stream_max_pending_messages():
+    unchunker = StreamUnChunker(max_pending_messages=2)
+    unchunker.set_max_message_size(1024 * 1024)
+    first, second, third = (partial_chunks(200) for _ in range(3))
+
+    unchunker.process_chunk(first[0])
+    unchunker.process_chunk(second[0])
+    with pytest.raises(ValueError):
+        unchunker.process_chunk(third[0])
+
+    for chunk in first[1:]:
+        message = unchunker.process_chunk(chunk)
+    assert message == b"x" * 200
+    unchunker.process_chunk(third[0])
+    assert len(unchunker.pending_messages) == 2
+
+
+def test_stream_max_pending_bytes():
+    unchunker = StreamUnChunker(max_pending_bytes=300)
+    unchunker.set_max_message_size(1024 * 1024)
+    small, large = partial_chunks(200), partial_chunks(1000)
+
+    for chunk in small[:-1]:
+        unchunker.process_chunk(chunk)
+    with pytest.raises(ValueError):
+        for chunk in large:
+            unchunker.process_chunk(chunk)
+
+    assert len(unchunker.pending_messages) == 1
+    assert unchunker.process_chunk(small[-1]) == b"x" * 200
+    assert unchunker.pending_bytes == 0
+
+
+def test_stream_expire_stalled_messages():
+    unchunker = StreamUnChunker(pending_timeout=10)
+    unchunker.set_max_message_size(1024 * 1024)
+    chunks = partial_chunks(200)
+    unchunker.process_chunk(chunks[0])
+    last_activity = next(iter(unchunker.pending_messages.values()))["last_activity"]
+
+    assert unchunker.expire(now=last_activity + 5) == []
+    assert len(unchunker.expire(now=last_activity + 11)) == 1
+    assert unchunker.pending_messages == {}
+    assert unchunker.pending_bytes == 0
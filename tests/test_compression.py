@@ -0,0 +1,212 @@
+import asyncio
+import base64
+import os
+import zlib
+
+import msgpack
+import pytest
+from conftest import SECRET, EchoServerProtocol
+
+from wslink.chunking import (
+    HEADER,
+    StreamUnChunker,
+    UnChunker,
+    generate_chunk_views,
+    generate_chunks,
+)
+from wslink.compression import CODECS, COMPRESSED_FLAG, compress_message
+from wslink.testing import aiohttp_server
+
+STATE = {"cells": [{"id": i, "visible": True, "color": [1, 0, 0]} for i in range(2000)]}
+
+
+def test_compress_message():
+    packed = msgpack.packb(STATE)
+    deflate = CODECS["deflate"]
+
+    compressed = compress_message(deflate, [packed], len(packed), 4096)
+    assert len(compressed) < len(packed) / 5
+    assert compress_message(deflate, [packed], len(packed), len(packed) + 1) is None
+
+
+def test_already_compressed_payload_skipped():
+    # Random bytes, as incompressible as a JPEG frame
+    packed = msgpack.packb({"image": os.urandom(100000)})
+
+    assert compress_message(CODECS["deflate"], [packed], len(packed), 4096) is None
+
+
+@pytest.mark.parametrize("unchunker_class", [UnChunker, StreamUnChunker])
+@pytest.mark.parametrize("max_size", [0, 1000])
+def test_compressed_round_trip(unchunker_class, max_size):
+    packed = msgpack.packb(STATE)
+    compressed = compress_message(CODECS["deflate"], [packed], len(packed), 0)
+    unchunker = unchunker_class()
+    unchunker.set_max_message_size(1024 * 1024)
+    unchunker.compression = CODECS["deflate"]
+
+    results = [
+        unchunker.process_chunk(header + content)
+        for header, content in generate_chunk_views(compressed, max_size, True)
+    ]
+
+    assert results[-1] == STATE
+
+
+@pytest.mark.parametrize("unchunker_class", [UnChunker, StreamUnChunker])
+def test_compressed_message_size_limit(unchunker_class):
+    packed = msgpack.packb("x" * 100000)
+    header, content = next(
+        generate_chunk_views(CODECS["deflate"].compress([packed]), 0, True)
+    )
+    unchunker = unchunker_class()
+    unchunker.set_max_message_size(10000)
+
+    unchunker.compression = CODECS["deflate"]
+    with pytest.raises(ValueError, match="exceeds"):
+        unchunker.process_chunk(header + content)
+
+
+@pytest.mark.asyncio
+async def test_compression_negotiated(monkeypatch, endpoint, connect):
+    monkeypatch.setattr(endpoint, "compression", ["zstd", "deflate"])
+    plain = await connect()
+    client = await connect(compression=["deflate"])
+
+    assert plain.unchunker.compression is None
+    assert client.unchunker.compression is CODECS["deflate"]
+
+    for c in (plain, client):
+        c.received_bytes = 0
+        reply = await c.call("test.echo", [STATE])
+        assert reply["result"] == STATE
+    assert client.received_bytes < plain.received_bytes / 5
+
+
+@pytest.mark.asyncio
+async def test_compression_disabled_by_default(connect):
+    client = await connect(compression=["deflate"])
+
+    assert client.unchunker.compression is None
+
+
+def test_zstd_message_size_limit():
+    pytest.importorskip("zstandard")
+    packed = msgpack.packb(b"\0" * 10000000)
+    header, content = next(
+        generate_chunk_views(CODECS["zstd"].compress([packed]), 0, True)
+    )
+    unchunker = UnChunker()
+    unchunker.set_max_message_size(10000)
+
+    unchunker.compression = CODECS["zstd"]
+    with pytest.raises(ValueError, match="exceeds"):
+        unchunker.process_chunk(header + content)
+
+
+async def open_websocket(url):
+    """Websocket handshake offering permessage-deflate, over a raw connection"""
+    host, port = url.split("/")[2].split(":")
+    reader, writer = await asyncio.open_connection(host, int(port))
+    key = base64.b64encode(os.urandom(16)).decode()
+    writer.write(
+        (
+            f"GET /ws HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\n"
+            f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\n"
+            "Sec-WebSocket-Version: 13\r\n"
+            "Sec-WebSocket-Extensions: permessage-deflate\r\n\r\n"
+        ).encode()
+    )
+    response = await reader.readuntil(b"\r\n\r\n")
+    assert b"permessage-deflate" in response
+    return reader, writer
+
+
+def send_frame(writer, data):
+    # Binary frame masked with a zero key, leaving the payload as is
+    size = len(data)
+    if size < 126:
+        header = bytes([0x82, 0x80 | size])
+    elif size < 65536:
+        header = bytes([0x82, 0x80 | 126]) + size.to_bytes(2, "big")
+    else:
+        header = bytes([0x82, 0x80 | 127]) + size.to_bytes(8, "big")
+    writer.write(header + bytes(4) + data)
+
+
+async def receive_frame(reader):
+    """Whether the frame got compressed by permessage-deflate (RSV1) and its payload"""
+    first, second = await reader.readexactly(2)
+    size = second & 0x7F
+    if size == 126:
+        size = int.from_bytes(await reader.readexactly(2), "big")
+    elif size == 127:
+        size = int.from_bytes(await reader.readexactly(8), "big")
+    return bool(first & 0x40), await reader.readexactly(size)
+
+
+def inflate(payload):
+    # First frame of the connection, no previous context
+    return zlib.decompressobj(-zlib.MAX_WBITS).decompress(payload + b"\x00\x00\xff\xff")
+
+
+async def websocket_call(reader, writer, rpc_id, method, args):
+    """Send a call and return the frames of its reply"""
+    message = {"wslink": "1.0", "id": rpc_id, "method": method, "args": args}
+    for chunk in generate_chunks(msgpack.packb(message), 0):
+        send_frame(writer, chunk)
+    # The replies fit in a frame
+    return [await receive_frame(reader)]
+
+
+@pytest.mark.asyncio
+async def test_transport_compression_disabled_when_negotiated():
+    protocol = EchoServerProtocol()
+    protocol.compression = ["deflate"]
+    async with aiohttp_server(protocol) as (_, url):
+        # permessage-deflate only
+        reader, writer = await open_websocket(url)
+        hello = [{"secret": SECRET}]
+        frames = await websocket_call(
+            reader, writer, "system:c0:0", "wslink.hello", hello
+        )
+        reply = UnChunker().process_chunk(inflate(frames[0][1]))
+        rpc_id = f"rpc:{reply['result']['clientID']}:0"
+        frames = await websocket_call(reader, writer, rpc_id, "test.echo", [STATE])
+        assert [deflated for deflated, _ in frames] == [True]
+        writer.close()
+
+        # wslink compression only
+        reader, writer = await open_websocket(url)
+        hello = [{"secret": SECRET, "compression": ["deflate"]}]
+        frames = await websocket_call(
+            reader, writer, "system:c0:0", "wslink.hello", hello
+        )
+        unchunker = UnChunker()
+        unchunker.set_max_message_size(1024 * 1024)
+        # The reply to hello still goes through permessage-deflate
+        (deflated, chunk), *_ = frames
+        assert deflated
+        reply = unchunker.process_chunk(inflate(chunk))
+        assert reply["result"]["compression"] == "deflate"
+
+        unchunker.compression = CODECS["deflate"]
+        rpc_id = f"rpc:{reply['result']['clientID']}:0"
+        frames = await websocket_call(reader, writer, rpc_id, "test.echo", [STATE])
+        (deflated, chunk), *_ = frames
+        assert not deflated
+        assert HEADER.unpack_from(chunk)[0] & COMPRESSED_FLAG
+        assert unchunker.process_chunk(chunk)["result"] == STATE
+        writer.close()
+
+
+@pytest.mark.asyncio
+async def test_transport_compression_warning(monkeypatch, caplog):
+    async with aiohttp_server(EchoServerProtocol()) as (server, _):
+        (handler,) = server._ws_handlers
+        # aiohttp without the writer attribute
+        with monkeypatch.context() as patch:
+            patch.setitem(handler.connections, "client", object())
+            handler.disableTransportCompression("client")
+
+    assert "Cannot turn off permessage-deflate of client client" in caplog.text
@@ -0,0 +1,99 @@
+import asyncio
+import copy
+
+import pytest
+
+from wslink.delta import apply, diff
+
+STATES = [
+    ({"a": 1, "b": {"c": [1, 2, 3]}}, {"a": 2, "b": {"c": [1, 5, 3]}}),
+    ({"a": 1, "b": 2}, {"b": 2, "d": {"e": None}}),
+    ({"items": [1, 2]}, {"items": [1, 2, 3, {"x": 4}]}),
+    ({"items": [1, 2, 3, 4]}, {"items": [1]}),
+    ({"a": [1, {"b": 2}]}, {"a": "replaced"}),
+    ([{"a": 1}], {"a": 1}),
+    (3, 4),
+]
+
+
+@pytest.mark.parametrize(("old", "new"), STATES)
+def test_diff_apply(old, new):
+    kept = copy.deepcopy(old)
+
+    assert apply(old, diff(old, new)) == new
+    assert old == kept
+
+
+def test_diff_only_changes():
+    old = {"large": list(range(1000)), "nested": {"a": 1, "b": 2}}
+    new = {"large": list(range(1000)), "nested": {"a": 1, "b": 3}}
+
+    assert diff(old, new) == [["set", ["nested", "b"], 3]]
+    assert diff(new, new) == []
+
+
+def test_apply_shares_untouched_values():
+    old = {"large": list(range(1000)), "nested": {"a": 1, "b": 2}}
+    new = apply(old, [["set", ["nested", "b"], 3], ["set", ["nested", "c"], 4]])
+
+    assert new["large"] is old["large"]
+    assert new["nested"] == {"a": 1, "b": 3, "c": 4}
+
+
+def state(client, topic):
+    """Value rebuilt from the snapshots and patches received so far"""
+    value = None
+    for message in client.publications:
+        if message["id"].split(":")[1] != topic:
+            continue
+        if "patch" in message:
+            value = apply(value, message["patch"])
+        else:
+            value = message["result"]
+    return value
+
+
+@pytest.mark.asyncio
+async def test_delta_topic(endpoint, connect):
+    endpoint.publishManager.setTopicPolicy("state", delta=True)
+    client = await connect(patches=True)
+    legacy = await connect()
+
+    value = {"items": [{"id": i, "name": f"item {i}"} for i in range(500)]}
+    endpoint.publish("state", value)
+    await asyncio.sleep(0.05)
+    # Modified in place before being published again
+    value["items"][42]["name"] = "renamed"
+    value["selected"] = 42
+    endpoint.publish("state", value)
+    await asyncio.sleep(0.05)
+
+    first, second = client.publications
+    assert first["version"] == 1
+    assert second["base"] == 1
+    assert second["version"] == 2
+    assert len(second["patch"]) == 2
+    assert state(client, "state") == value
+    # Clients without patch support get every value
+    assert [m["result"] for m in legacy.publications][-1] == value
+    assert "version" not in legacy.publications[0]
+
+
+@pytest.mark.asyncio
+async def test_delta_topic_resync(endpoint, connect):
+    endpoint.publishManager.setTopicPolicy("state", delta=True)
+    client = await connect(patches=True)
+
+    endpoint.publish("state", {"count": 1})
+    await asyncio.sleep(0.05)
+    endpoint.publish("state", {"count": 2})
+    await asyncio.sleep(0.05)
+    reply = await client.call("wslink.resync", ["state"], rpc_id="system:c0:1")
+    endpoint.publish("state", {"count": 3})
+    await asyncio.sleep(0.05)
+
+    assert reply["result"] == {"topic": "state"}
+    assert [m.get("version") for m in client.publications] == [1, 2, 2, 3]
+    assert client.publications[2]["result"] == {"count": 2}
+    assert client.publications[3]["base"] == 2
+    assert state(client, "state") == {"count": 3}
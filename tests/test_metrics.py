@@ -0,0 +1,95 @@
+import asyncio
+
+import aiohttp
+import pytest
+from conftest import Client, EchoServerProtocol
+
+from wslink.backends.generic.core import GenericServer
+from wslink.metrics import Registry, registry
+from wslink.testing import aiohttp_server
+
+
+def test_render_prometheus_text():
+    metrics = Registry()
+    calls = metrics.counter("calls_total", "Calls", ("method",))
+    duration = metrics.histogram("duration_seconds", "Duration", buckets=(0.1, 1))
+    calls.inc(labels=('say "hi"',))
+    calls.inc(2, labels=('say "hi"',))
+    duration.observe(0.05)
+    duration.observe(0.5)
+
+    assert metrics.render().splitlines() == [
+        "# HELP calls_total Calls",
+        "# TYPE calls_total counter",
+        'calls_total{method="say \\"hi\\""} 3',
+        "# HELP duration_seconds Duration",
+        "# TYPE duration_seconds histogram",
+        'duration_seconds_bucket{le="0.1"} 1',
+        'duration_seconds_bucket{le="1"} 2',
+        'duration_seconds_bucket{le="+Inf"} 2',
+        "duration_seconds_sum 0.55",
+        "duration_seconds_count 2",
+    ]
+
+
+def test_metrics_disabled_by_default(endpoint):
+    assert endpoint.metrics is None
+
+
+@pytest.mark.asyncio
+async def test_handler_metrics():
+    protocol = EchoServerProtocol()
+    protocol.metrics = True
+    endpoint = GenericServer({"ws": {"ws": protocol}})["ws"]
+    calls = registry.rpc_calls.values.get(("test.echo",), 0)
+    published = registry.published_messages.values.get(("metrics",), 0)
+    received = registry.received_messages.values.get((), 0)
+
+    client = Client(endpoint)
+    await client.connect()
+    await client.call("test.echo", ["a"])
+    await client.call("test.timeout", [1])
+    endpoint.publish("metrics", b"x" * 100)
+    await asyncio.sleep(0.05)
+
+    assert registry.rpc_calls.values[("test.echo",)] == calls + 1
+    assert registry.rpc_errors.values[("test.timeout",)] >= 1
+    assert registry.published_messages.values[("metrics",)] == published + 1
+    assert registry.published_bytes.values[("metrics",)] >= 100
+    assert registry.received_messages.values[()] == received + 3
+    text = registry.render()
+    assert 'wslink_rpc_duration_seconds_count{method="test.echo"}' in text
+    assert "wslink_connections 1" in text
+
+    await client.close()
+    assert "wslink_connections 0" in registry.render()
+
+
+@pytest.mark.asyncio
+async def test_stopped_handler_untracked():
+    tracked = len(registry.outbox_bytes.functions)
+    protocol = EchoServerProtocol()
+    protocol.metrics = True
+    server = GenericServer({"ws": {"ws": protocol}})
+
+    assert len(registry.outbox_bytes.functions) == tracked + 1
+    await server.stop()
+    assert len(registry.outbox_bytes.functions) == tracked
+
+
+@pytest.mark.asyncio
+async def test_metrics_route():
+    protocol = EchoServerProtocol()
+    protocol.metrics = True
+    async with (
+        aiohttp_server(protocol) as (server, _),
+        aiohttp.ClientSession() as session,
+    ):
+        url = f"http://127.0.0.1:{server.get_port()}/metrics"
+        async with session.get(url) as response:
+            assert response.status == 200
+            assert response.content_type == "text/plain"
+            text = await response.text()
+
+    assert "# TYPE wslink_connections gauge" in text
+    assert "wslink_outbox_bytes " in text
@@ -0,0 +1,97 @@
+import pstats
+
+import pytest
+
+import wslink.protocol
+
+ADMIN = "wslink-test-admin"
+
+
+@pytest.fixture
+def admin(endpoint, connect):
+    endpoint.admin_secret = ADMIN
+
+    async def _admin():
+        client = await connect()
+        client.system_count = 0
+
+        async def system(method, args):
+            client.system_count += 1
+            rpc_id = f"system:{client.client_id}:{client.system_count}"
+            return await client.call(method, args, rpc_id=rpc_id)
+
+        client.system = system
+        return client
+
+    return _admin
+
+
+@pytest.mark.asyncio
+async def test_profile_requires_admin_secret(endpoint, admin):
+    client = await admin()
+
+    reply = await client.system("wslink.profile.start", [{"secret": "wrong"}])
+    assert reply["error"]["code"] == wslink.protocol.AUTHENTICATION_ERROR
+
+    endpoint.admin_secret = ""
+    reply = await client.system("wslink.profile.start", [{"secret": ""}])
+    assert reply["error"]["code"] == wslink.protocol.AUTHENTICATION_ERROR
+    assert endpoint.profiling is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "interval", [0, -1, float("nan"), float("inf"), "0.01", True, False]
+)
+async def test_sampling_profile_invalid_interval(endpoint, admin, interval):
+    client = await admin()
+
+    reply = await client.system(
+        "wslink.profile.start", [{"secret": ADMIN, "interval": interval}]
+    )
+    assert reply["error"]["message"].startswith("Invalid interval")
+    assert endpoint.profiling is None
+
+
+@pytest.mark.asyncio
+async def test_sampling_profile(admin):
+    client = await admin()
+
+    reply = await client.system(
+        "wslink.profile.start", [{"secret": ADMIN, "interval": 0.002}]
+    )
+    assert reply["result"] == {"format": "collapsed"}
+    reply = await client.system("wslink.profile.start", [{"secret": ADMIN}])
+    assert reply["error"]["message"] == "A profiler is already running"
+
+    await client.call("test.freeze", [0.05])
+    reply = await client.system("wslink.profile.stop", [{"secret": ADMIN}])
+
+    stacks = reply["result"]["data"].splitlines()
+    assert any("freeze (" in stack for stack in stacks)
+    assert all(stack.rsplit(" ", 1)[1].isdigit() for stack in stacks)
+
+
+@pytest.mark.asyncio
+async def test_cprofile_profile(admin, tmp_path):
+    client = await admin()
+
+    await client.system("wslink.profile.start", [{"secret": ADMIN, "mode": "cprofile"}])
+    await client.call("test.echo", [1])
+    reply = await client.system("wslink.profile.stop", [{"secret": ADMIN}])
+
+    assert reply["result"]["format"] == "pstats"
+    path = tmp_path / "wslink.pstats"
+    path.write_bytes(reply["result"]["data"])
+    functions = [name for _, _, name in pstats.Stats(str(path)).stats]
+    assert "echo" in functions
+
+
+@pytest.mark.asyncio
+async def test_profile_stopped_on_close(endpoint, admin):
+    client = await admin()
+
+    await client.system("wslink.profile.start", [{"secret": ADMIN}])
+    await client.close()
+
+    assert endpoint.profiling is None
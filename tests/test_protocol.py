@@ -0,0 +1,549 @@
+import asyncio
+import os
+
+import msgpack
+import pytest
+from conftest import Client, EchoServerProtocol
+
+import wslink.protocol
+from wslink import register
+from wslink.backends.generic.core import GenericServer
+from wslink.chunking import StreamUnChunker, generate_chunks
+from wslink.core import rpc_methods
+from wslink.dispatch import Dispatcher
+from wslink.outbox import Outbox
+from wslink.testing import Message
+from wslink.upload import Upload
+from wslink.websocket import LinkProtocol
+
+
+@pytest.mark.asyncio
+async def test_rpc_round_trip(connect):
+    client = await connect()
+    reply = await client.call("test.echo", [{"a": 1}])
+    assert reply["result"] == {"a": 1}
+
+
+@pytest.mark.asyncio
+async def test_slow_client_does_not_block_others(endpoint, connect):
+    slow = await connect()
+    fast = await connect()
+    slow.delay = 0.5
+
+    # Publish to everyone, the slow client takes a while to drain it
+    endpoint.publish("topic", b"x" * 1024)
+    await asyncio.sleep(0.01)
+
+    reply = await asyncio.wait_for(fast.call("test.echo", [1]), 0.25)
+    assert reply["result"] == 1
+    assert len(fast.publications) == 1
+    assert len(slow.publications) == 0
+
+
+@pytest.mark.asyncio
+async def test_publish_packs_once(monkeypatch, endpoint, connect):
+    clients = [await connect() for _ in range(3)]
+
+    pack = endpoint.serializer.pack
+    calls = []
+
+    def counting_pack(*args, **kwargs):
+        calls.append(args)
+        return pack(*args, **kwargs)
+
+    monkeypatch.setattr(endpoint.serializer, "pack", counting_pack)
+
+    endpoint.publish("topic", b"x" * 1024)
+    await asyncio.sleep(0.05)
+
+    assert len(calls) == 1
+    for client in clients:
+        assert [m["result"] for m in client.publications] == [b"x" * 1024]
+
+
+@pytest.mark.asyncio
+async def test_publish_only_to_subscribers(endpoint, connect):
+    legacy = await connect()
+    filtered = await connect(subscriptions=True)
+
+    reply = await filtered.call("wslink.subscribe", ["a"], rpc_id="system:c1:1")
+    assert reply["result"] == {"topic": "a"}
+
+    endpoint.publish("a", 1)
+    endpoint.publish("b", 2)
+    await asyncio.sleep(0.05)
+
+    assert sorted(m["result"] for m in legacy.publications) == [1, 2]
+    assert [m["result"] for m in filtered.publications] == [1]
+
+    await filtered.call("wslink.unsubscribe", ["a"], rpc_id="system:c1:2")
+    endpoint.publish("a", 3)
+    await asyncio.sleep(0.05)
+
+    assert [m["result"] for m in filtered.publications] == [1]
+
+    await filtered.close()
+    assert endpoint.pub_manager.subscriptions == {}
+
+
+@pytest.mark.asyncio
+async def test_coalesced_topic_keeps_latest(endpoint, connect):
+    slow = await connect(delay=0.1)
+    endpoint.pub_manager.setTopicPolicy("frame", coalesce=True)
+
+    for i in range(10):
+        endpoint.publish("frame", i)
+        await asyncio.sleep(0.01)
+
+    await asyncio.sleep(0.3)
+
+    frames = [m["result"] for m in slow.publications]
+    assert frames[0] == 0
+    assert frames[-1] == 9
+    assert len(frames) <= 3
+    assert endpoint.outboxes[slow.client_id].pending_bytes == 0
+    assert endpoint.network_monitor.pending == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ("overflow", "expected"), [("drop_newest", [0, 1]), ("drop_oldest", [0, 4])]
+)
+async def test_outbox_overflow_policies(endpoint, connect, overflow, expected):
+    endpoint.outbox_max_messages = 2
+    endpoint.outbox_overflow = overflow
+    slow = await connect(delay=0.05)
+
+    for i in range(5):
+        endpoint.publish(f"topic{i}", i)
+        await asyncio.sleep(0.001)
+
+    assert endpoint.queue_depth(slow.client_id)["messages"] == 2
+
+    await asyncio.sleep(0.2)
+    assert [m["result"] for m in slow.publications] == expected
+    assert endpoint.queue_depth() == {"messages": 0, "bytes": 0}
+
+
+@pytest.mark.asyncio
+async def test_publish_async_blocks_producer(endpoint, connect):
+    endpoint.outbox_max_messages = 1
+    slow = await connect(delay=0.05)
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    for i in range(4):
+        await endpoint.publish_async("topic", i)
+        assert endpoint.queue_depth()["messages"] <= 1
+    assert loop.time() - start >= 0.15
+
+    await asyncio.sleep(0.1)
+    assert [m["result"] for m in slow.publications] == [0, 1, 2, 3]
+    assert endpoint.network_monitor.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_outbox_overflow_disconnect(endpoint, connect):
+    endpoint.outbox_max_messages = 1
+    endpoint.outbox_overflow = "disconnect"
+    slow = await connect(delay=0.05)
+
+    for i in range(3):
+        endpoint.publish(f"topic{i}", i)
+        await asyncio.sleep(0.001)
+
+    await asyncio.sleep(0.1)
+    assert slow.client_id not in endpoint.connections
+    assert slow.client_id not in endpoint.outboxes
+
+
+class ClosingSocket:
+    def __init__(self, error=None):
+        self.error = error
+        self.closed = False
+
+    async def send_bytes(self, _data):
+        await asyncio.sleep(1)
+
+    async def close(self):
+        self.closed = True
+        if self.error is not None:
+            raise self.error
+
+
+@pytest.mark.asyncio
+async def test_outbox_disconnect_closes_socket(caplog):
+    ws = ClosingSocket()
+    outbox = Outbox(ws, max_messages=1, overflow="disconnect")
+    outbox.put([(b"", b"a")], 1, droppable=True)
+    await asyncio.sleep(0)
+
+    assert await outbox.put([(b"", b"b")], 1, droppable=True) is False
+    await outbox._close_task
+    assert ws.closed
+
+    ws = ClosingSocket(ConnectionResetError("reset"))
+    outbox = Outbox(ws, max_messages=1, overflow="disconnect")
+    outbox.put([(b"", b"a")], 1, droppable=True)
+    await asyncio.sleep(0)
+    outbox.put([(b"", b"b")], 1, droppable=True)
+    await asyncio.sleep(0.01)
+
+    assert ws.closed
+    assert "Failed to close connection" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_rpc_reply_overtakes_publish(endpoint, connect, monkeypatch):
+    monkeypatch.setattr(wslink.protocol, "MAX_MSG_SIZE", 1024)
+    slow = await connect(delay=0.005)
+
+    endpoint.publish("dataset", b"x" * 50 * 1024)
+    endpoint.publish("progress", 1)
+    await asyncio.sleep(0.02)
+    reply = await slow.call("test.echo", ["click"])
+
+    assert reply["result"] == "click"
+    assert slow.publications == []
+
+    await asyncio.sleep(0.5)
+    # Publishes keep their order
+    assert [m["id"].split(":")[1] for m in slow.publications] == [
+        "dataset",
+        "progress",
+    ]
+    assert len(slow.publications[0]["result"]) == 50 * 1024
+
+
+@pytest.mark.asyncio
+async def test_stream_unchunker_by_default(endpoint, connect):
+    connection = await endpoint.connect()
+    assert isinstance(endpoint.unchunkers[connection.client_id], StreamUnChunker)
+
+    # Unauthenticated clients cannot send large messages
+    packed = msgpack.packb({"id": "system:c0:0", "args": [b"x" * 1024]})
+    with pytest.raises(ValueError):
+        for chunk in generate_chunks(packed, 256):
+            await connection.send(True, Message(chunk))
+
+    client = await connect()
+    reply = await client.call("test.echo", [b"x" * 1024 * 1024])
+    assert reply["result"] == b"x" * 1024 * 1024
+    assert endpoint.expire_task is not None
+
+
+@pytest.mark.asyncio
+async def test_payload_redacted_only_for_debug_sinks(monkeypatch, endpoint, connect):
+    client = await connect()
+    redacted = []
+    strip = endpoint.payloadWithSecretStripped
+    monkeypatch.setattr(
+        endpoint,
+        "payloadWithSecretStripped",
+        lambda payload: redacted.append(payload) or strip(payload),
+    )
+
+    await client.call("test.echo", [1])
+    assert redacted == []
+
+    messages = []
+    endpoint.log_emitter.add_event_listener("debug", messages.append)
+    await client.call("test.echo", [{"secret": "not-shown", "data": memoryview(b"x")}])
+    assert len(redacted) == 1
+    assert "*****" in messages[0]
+    assert "not-shown" not in messages[0]
+
+
+@pytest.mark.asyncio
+async def test_thread_executor_keeps_loop_responsive(connect):
+    blocked = await connect()
+    other = await connect()
+
+    blocking_call = asyncio.ensure_future(blocked.call("test.block", [0.3]))
+    await asyncio.sleep(0.05)
+    reply = await asyncio.wait_for(other.call("test.echo", [1]), 0.1)
+    assert reply["result"] == 1
+    assert not blocking_call.done()
+
+    reply = await blocking_call
+    assert reply["result"].startswith("wslink")
+    await asyncio.sleep(0.01)
+    assert [p["result"] for p in other.publications] == [0.3]
+
+
+@pytest.mark.asyncio
+async def test_process_executor(connect):
+    client = await connect()
+    reply = await client.call("test.pid")
+    assert reply["result"] != os.getpid()
+
+
+@pytest.mark.asyncio
+async def test_sequential_dispatch_by_default(connect):
+    client = await connect()
+
+    first = await client.request("test.sleep", [0.1])
+    second = await client.request("test.echo", [2])
+    assert not first.done()
+
+    await second
+    assert first.done()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_dispatch(endpoint, connect):
+    endpoint.rpc_concurrency = 2
+    client = await connect()
+    loop = asyncio.get_running_loop()
+
+    start = loop.time()
+    slow = [await client.request("test.sleep", [0.2]) for _ in range(2)]
+    await asyncio.gather(*slow)
+    assert loop.time() - start < 0.35
+
+
+@pytest.mark.asyncio
+async def test_dispatch_queue_stops_reading(endpoint, connect):
+    endpoint.rpc_queue = 0
+    client = await connect()
+
+    first = await client.request("test.sleep", [0.05])
+    assert not first.done()
+    # No room left, the connection is not read until the first call is over
+    await client.request("test.echo", [2])
+    assert first.done()
+
+
+@pytest.mark.asyncio
+async def test_ordered_method_waits_for_calls_in_flight(endpoint, connect):
+    endpoint.rpc_concurrency = 4
+    client = await connect()
+
+    slow = await client.request("test.sleep", [0.1])
+    ordered = await client.request("test.ordered")
+    after = await client.request("test.echo", [3])
+    assert (await ordered)["result"] == "ordered"
+    assert slow.done()
+    assert not after.done()
+    assert (await after)["result"] == 3
+
+
+@pytest.mark.asyncio
+async def test_failing_ordered_method_releases_later_calls(connect):
+    client = await connect()
+
+    slow = await client.request("test.sleep", [0.05])
+    failing = await client.request("test.ordered_fail")
+    after = [await client.request("test.echo", [i]) for i in range(3)]
+
+    assert "ordered failure" in (await failing)["error"]["data"]["exception"]
+    assert slow.done()
+    assert [(await reply)["result"] for reply in after] == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_logs_task_exceptions(caplog):
+    async def fail():
+        msg = "escaped"
+        raise RuntimeError(msg)
+
+    dispatcher = Dispatcher()
+    task = await dispatcher.spawn("rpc:c0:1", fail, ordered=True)
+    after = await dispatcher.spawn("rpc:c0:2", asyncio.sleep, 0)
+    await asyncio.wait([task, after])
+    await asyncio.sleep(0)
+
+    assert not after.exception()
+    assert len(dispatcher) == 0
+    records = [r for r in caplog.records if r.name == "wslink.dispatch"]
+    assert [r.getMessage() for r in records] == ["RPC rpc:c0:1 failed"]
+    assert records[0].exc_info[1] is task.exception()
+
+
+@pytest.mark.asyncio
+async def test_cancel_rpc(connect):
+    client = await connect()
+
+    slow = await client.request("test.sleep", [10])
+    reply = await client.call("wslink.cancel", [slow.rpc_id], rpc_id="system:c0:1")
+    assert reply["result"] == {"id": slow.rpc_id, "canceled": True}
+    assert (await slow)["error"]["code"] == wslink.protocol.RPC_CANCELED_ERROR
+
+    reply = await client.call("wslink.cancel", [slow.rpc_id], rpc_id="system:c0:2")
+    assert reply["result"]["canceled"] is False
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_logs_failure_of_canceled_task(caplog):
+    async def cleanup_fails():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            msg = "cleanup failed"
+            raise RuntimeError(msg) from None
+
+    dispatcher = Dispatcher()
+    task = await dispatcher.spawn("rpc:c0:1", cleanup_fails)
+    await asyncio.sleep(0)
+    assert dispatcher.cancel("rpc:c0:1")
+    await asyncio.wait([task])
+    await asyncio.sleep(0)
+
+    records = [r for r in caplog.records if r.name == "wslink.dispatch"]
+    assert [r.getMessage() for r in records] == ["RPC rpc:c0:1 failed"]
+    assert str(records[0].exc_info[1]) == "cleanup failed"
+
+
+@pytest.mark.asyncio
+async def test_rpc_timeout(connect):
+    client = await connect()
+
+    reply = await client.call("test.timeout", [1])
+    assert reply["error"]["code"] == wslink.protocol.RPC_TIMEOUT_ERROR
+    assert reply["error"]["data"] == {"method": "test.timeout", "timeout": 0.05}
+
+
+@pytest.mark.asyncio
+async def test_close_cancels_rpcs(endpoint, connect):
+    client = await connect()
+
+    await client.request("test.sleep", [10])
+    task = next(iter(endpoint.dispatchers[client.client_id].tasks.values()))
+    await client.close()
+    await asyncio.sleep(0)
+    assert task.cancelled()
+
+
+class ExtraProtocol(LinkProtocol):
+    @register("test.extra")
+    def extra(self):
+        return "extra"
+
+
+class OverridingProtocol(ExtraProtocol):
+    def extra(self):
+        return "not registered"
+
+
+def test_rpc_methods_recorded_per_class():
+    assert set(rpc_methods(ExtraProtocol)) == {"test.extra"}
+    assert "_wslink_rpc_methods" in vars(ExtraProtocol)
+    assert rpc_methods(OverridingProtocol) == {}
+
+
+@pytest.mark.asyncio
+async def test_live_protocol_registration(endpoint, connect):
+    client = await connect()
+    extra = ExtraProtocol()
+
+    reply = await client.call("test.extra")
+    assert reply["error"]["code"] == wslink.protocol.METHOD_NOT_FOUND
+
+    endpoint.getServerProtocol().registerLinkProtocol(extra)
+    reply = await client.call("test.extra")
+    assert reply["result"] == "extra"
+
+    endpoint.getServerProtocol().unregisterLinkProtocol(extra)
+    reply = await client.call("test.extra")
+    assert reply["error"]["code"] == wslink.protocol.METHOD_NOT_FOUND
+
+
+@pytest.mark.asyncio
+async def test_stopped_endpoint_detached_from_protocol():
+    protocol = EchoServerProtocol()
+    server = GenericServer({"ws": {"ws": protocol}})
+    endpoint = server["ws"]
+    assert protocol.linkProtocolListeners == {endpoint.attachLinkProtocols}
+
+    await server.stop()
+    assert not protocol.linkProtocolListeners
+    assert endpoint not in endpoint.pub_manager.protocols
+
+    # Protocols registered afterwards no longer reach the stopped endpoint
+    protocol.registerLinkProtocol(ExtraProtocol())
+    assert "test.extra" not in endpoint.functionMap
+
+    # while a new endpoint serves them
+    client = Client(GenericServer({"ws": {"ws": protocol}})["ws"])
+    await client.connect()
+    assert (await client.call("test.extra"))["result"] == "extra"
+
+
+@pytest.mark.asyncio
+async def test_streamed_results(connect):
+    client = await connect(streams=True)
+
+    future = await client.request("test.stream", [3])
+    reply = await future
+    assert reply["stream"] == "end"
+    assert client.streamed[future.rpc_id] == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_streamed_results_collected_for_older_clients(connect):
+    client = await connect()
+
+    reply = await client.call("test.stream", [3])
+    assert reply["result"] == [0, 1, 2]
+    assert client.streamed == {}
+
+
+@pytest.mark.asyncio
+async def test_streamed_upload(connect):
+    client = await connect()
+
+    reply = await (await client.upload("test.upload", [b"x" * 1000] * 5 + [b"end"]))
+    assert reply["result"] == [1000] * 5 + [3]
+
+
+@pytest.mark.asyncio
+async def test_upload_does_not_wait_for_a_dispatch_slot(connect):
+    client = await connect()
+
+    sleeping = await client.request("test.sleep", [0.2])
+    reply = await (await client.upload("test.upload", [b"x"] * 20))
+    assert reply["result"] == [1] * 20
+    assert not sleeping.done()
+
+
+@pytest.mark.asyncio
+async def test_upload_data_dropped_once_method_returned(connect):
+    client = await connect()
+
+    reply = await (await client.upload("test.upload", [b"x"] * 20, [2]))
+    assert reply["result"] == [1, 1]
+    reply = await client.call("test.echo", ["still reading"])
+    assert reply["result"] == "still reading"
+
+
+@pytest.mark.asyncio
+async def test_upload_requires_authentication(connect):
+    client = await connect(secret="wrong")
+
+    reply = await (await client.upload("test.upload", [b"x"] * 20))
+    assert reply["error"]["code"] == wslink.protocol.AUTHENTICATION_ERROR
+
+
+@pytest.mark.asyncio
+async def test_upload_method_called_without_upload(connect):
+    client = await connect()
+
+    reply = await asyncio.wait_for(client.call("test.upload"), 1)
+    assert reply["error"]["code"] == wslink.protocol.EXCEPTION_ERROR
+    assert reply["error"]["message"] == "Upload method called without upload"
+
+
+@pytest.mark.asyncio
+async def test_upload_waits_for_room():
+    upload = Upload(max_chunks=2)
+    await upload.put(b"a")
+    await upload.put(b"b")
+
+    blocked = asyncio.ensure_future(upload.put(b"c"))
+    await asyncio.sleep(0.01)
+    assert not blocked.done()
+
+    assert await upload.__anext__() == b"a"
+    await blocked
+    upload.finish()
+    assert [chunk async for chunk in upload] == [b"b", b"c"]
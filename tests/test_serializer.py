@@ -0,0 +1,76 @@
+import asyncio
+
+import msgpack
+import pytest
+
+from wslink.chunking import StreamUnChunker, UnChunker, generate_chunks
+from wslink.serializer import NDARRAY_EXT_TYPE, Serializer
+
+np = pytest.importorskip("numpy")
+
+ARRAYS = [
+    np.arange(12, dtype="<f4").reshape(3, 4),
+    np.arange(12, dtype=">i8").reshape(3, 4).T,
+    np.array(7, dtype="u2"),
+    np.zeros((0, 3)),
+    np.array(["2020-01-01", "2021-06-30"], dtype="M8[ms]"),
+]
+
+
+@pytest.mark.parametrize("binary_views", [False, True])
+def test_ndarray_round_trip(binary_views):
+    serializer = Serializer()
+    payload = {"arrays": ARRAYS, "scalar": np.int64(3), "text": "x" * 300}
+
+    result = serializer.unpack(b"".join(serializer.pack(payload)), binary_views)
+
+    assert result["scalar"] == 3
+    assert result["text"] == payload["text"]
+    for array, decoded in zip(ARRAYS, result["arrays"], strict=True):
+        assert decoded.dtype == array.dtype
+        assert decoded.shape == array.shape
+        np.testing.assert_array_equal(decoded, array)
+
+
+def test_ndarray_packed_from_its_memory():
+    array = np.arange(1024, dtype="f8")
+    segments = Serializer().pack({"id": "rpc:c0:1", "result": array})
+
+    assert any(np.shares_memory(np.frombuffer(s, "u1"), array) for s in segments)
+    ext = msgpack.unpackb(b"".join(segments))["result"]
+    assert ext.code == NDARRAY_EXT_TYPE
+
+
+def test_ndarray_decoded_as_view_on_the_message():
+    packed = bytearray(b"".join(Serializer().pack([np.arange(100, dtype="i4")])))
+
+    array = Serializer().unpack(packed, binary_views=True)[0]
+    assert np.shares_memory(array, np.frombuffer(packed, "u1"))
+
+
+@pytest.mark.parametrize("unchunker_class", [UnChunker, StreamUnChunker])
+@pytest.mark.parametrize("max_size", [0, 64, 100000])
+def test_segments_chunked(unchunker_class, max_size):
+    payload = {"before": "a" * 50, "array": np.arange(500), "after": b"b" * 50}
+    unchunker = unchunker_class()
+    unchunker.set_max_message_size(1024 * 1024)
+
+    results = [
+        unchunker.process_chunk(chunk)
+        for chunk in generate_chunks(Serializer().pack(payload), max_size)
+    ]
+
+    np.testing.assert_array_equal(results[-1]["array"], payload["array"])
+    assert results[-1]["after"] == payload["after"]
+
+
+@pytest.mark.asyncio
+async def test_publish_ndarray(endpoint, connect):
+    client = await connect()
+
+    endpoint.publish("topic", np.linspace(0, 1, 5))
+    await asyncio.sleep(0.05)
+
+    np.testing.assert_array_equal(
+        client.publications[0]["result"], np.linspace(0, 1, 5)
+    )
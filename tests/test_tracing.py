@@ -0,0 +1,105 @@
+import asyncio
+import logging
+
+import pytest
+from conftest import Client, EchoServerProtocol
+
+from wslink.backends.generic.core import GenericServer
+from wslink.chunking import generate_chunks
+from wslink.testing import Message
+from wslink.tracing import OpenTelemetryTracer
+
+RPC_PHASES = ["receive", "unpack", "queue", "execute", "pack", "send"]
+
+
+class Recorder:
+    def __init__(self):
+        self.traces = []
+
+    def record(self, trace):
+        self.traces.append(trace)
+
+
+async def traced_client(tracer):
+    protocol = EchoServerProtocol()
+    protocol.tracer = tracer
+    endpoint = GenericServer({"ws": {"ws": protocol}})["ws"]
+    client = Client(endpoint)
+    await client.connect()
+    return endpoint, client
+
+
+@pytest.mark.asyncio
+async def test_rpc_and_publish_traces():
+    recorder = Recorder()
+    endpoint, client = await traced_client(recorder)
+
+    await client.call("test.echo", ["a"])
+    endpoint.publish("topic", 1)
+    await endpoint.publish_async("topic", 2)
+    await asyncio.sleep(0.05)
+
+    hello, echo, *publishes = recorder.traces
+    assert hello.name == "wslink.hello"
+    assert (echo.kind, echo.name, echo.id) == (
+        "rpc",
+        "test.echo",
+        f"rpc:{client.client_id}:0",
+    )
+    assert [phase for phase, _, _ in echo.phases] == RPC_PHASES
+    assert all(start <= end for _, start, end in echo.phases)
+    assert [(t.kind, t.name) for t in publishes] == [("publish", "topic")] * 2
+    assert [[p for p, _, _ in t.phases] for t in publishes] == [["pack", "send"]] * 2
+
+
+@pytest.mark.asyncio
+async def test_logging_tracer(caplog):
+    _, client = await traced_client("log")
+
+    with caplog.at_level(logging.DEBUG, logger="wslink.tracing"):
+        await client.call("test.echo", ["a"])
+        await asyncio.sleep(0.01)
+
+    message = caplog.records[-1].getMessage()
+    assert message.startswith(f"rpc test.echo rpc:{client.client_id}:0")
+    assert all(f"{phase}=" in message for phase in RPC_PHASES)
+
+
+def test_invalid_tracer():
+    protocol = EchoServerProtocol()
+    protocol.tracer = "unknown"
+    with pytest.raises(ValueError, match="Invalid tracer"):
+        GenericServer({"ws": {"ws": protocol}})
+
+
+@pytest.mark.asyncio
+async def test_opentelemetry_tracer():
+    sdk_trace = pytest.importorskip("opentelemetry.sdk.trace")
+    export = pytest.importorskip("opentelemetry.sdk.trace.export")
+    in_memory = pytest.importorskip(
+        "opentelemetry.sdk.trace.export.in_memory_span_exporter"
+    )
+
+    exporter = in_memory.InMemorySpanExporter()
+    provider = sdk_trace.TracerProvider()
+    provider.add_span_processor(export.SimpleSpanProcessor(exporter))
+    _, client = await traced_client(OpenTelemetryTracer(provider.get_tracer("wslink")))
+
+    await client.call("test.echo", ["a"])
+    await asyncio.sleep(0.01)
+
+    spans = {span.name: span for span in exporter.get_finished_spans()}
+    assert spans["wslink.rpc"].attributes["wslink.method"] == "test.echo"
+    assert spans["wslink.execute"].parent.span_id == (
+        spans["wslink.rpc"].context.span_id
+    )
+
+
+@pytest.mark.asyncio
+async def test_receive_start_dropped_with_invalid_message():
+    endpoint, client = await traced_client(Recorder())
+    (chunk,) = generate_chunks(b"\xc1", 0)
+
+    with pytest.raises(ValueError):
+        await endpoint.onMessage(True, Message(chunk), client.client_id)
+    assert endpoint.receiveStarts[client.client_id] == {}
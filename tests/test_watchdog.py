@@ -0,0 +1,44 @@
+import asyncio
+import time
+
+import pytest
+from conftest import Client, EchoServerProtocol
+
+from wslink.backends.generic.core import GenericServer
+from wslink.watchdog import Watchdog
+
+
+@pytest.mark.asyncio
+async def test_watchdog_measures_lag():
+    reports = []
+    watchdog = Watchdog(0.05, reports.append)
+
+    await asyncio.sleep(0.05)
+    assert watchdog.lag < 0.05
+    # Blocking on purpose
+    time.sleep(0.1)
+    await asyncio.sleep(0.05)
+    watchdog.stop()
+
+    assert watchdog.max_lag >= 0.05
+    assert reports[0].startswith("Event loop blocked for")
+
+
+@pytest.mark.asyncio
+async def test_watchdog_reports_blocking_method():
+    protocol = EchoServerProtocol()
+    errors = []
+    protocol.log_emitter.add_event_listener("error", errors.append)
+    server = GenericServer({"ws": {"ws": protocol}, "watchdog": 0.05})
+    started = asyncio.create_task(server.start(None))
+    client = Client(server["ws"])
+    await client.connect()
+
+    await client.call("test.freeze", [0.3])
+    await asyncio.sleep(0.05)
+    await server.stop()
+    await started
+
+    assert len(errors) == 1
+    assert "while running test.freeze" in errors[0]
+    assert "time.sleep(duration)" in errors[0]